@@ -3,9 +3,21 @@ from quart_cors import cors
 from dotenv import load_dotenv
 from tortoise import Tortoise
 from app.ormModels.applicationAdmins import ensure_default_admins
+from app.utils.ratingHandler import refreshRatingIndex, refreshRatingIndexPeriodically, rebuildDocumentRatingStats
+from app.utils import quadrant
+from app.utils.collectionSetup import ensure_collections
+from app.utils.embeddingBackend import export_onnx_model
+from app.utils.linkChangeHandler import record_link_change, compact_link_changes, UPSERT
+from app.utils.scrapeJobHandler import scrape_jobs
+from app.utils.instrumentation import instrumentation
+from app.utils.writeBehind import write_behind
+from app.utils.userQuestionHandler import migrate_question_history
 import config
-from quart import current_app
+from quart import current_app, g
+import asyncio
+import click
 import os
+import time
 
 app = Quart(__name__)
 app.config.from_object(config)
@@ -19,17 +31,177 @@ load_dotenv(override=True)
 async def init_tortoise():
     await Tortoise.init(
         db_url=current_app.config.get("DB_URL", "sqlite://essencifai"),
-        modules={"models": ["app.ormModels.rating", "app.ormModels.points", "app.ormModels.userQuestionHistorie", "app.ormModels.applicationAdmins"]},
+        modules={"models": ["app.ormModels.rating", "app.ormModels.points", "app.ormModels.userQuestionHistorie", "app.ormModels.applicationAdmins", "app.ormModels.documentRatingStats", "app.ormModels.linkChange", "app.ormModels.scrapeJob", "app.ormModels.orphanGcJob"]},
     )
     await Tortoise.generate_schemas()
     
     # Ensure default admin entries exist
     await ensure_default_admins()
 
+# Create or validate the Qdrant collections and their payload indexes, with dry_run only report the differences
+async def setup_collections(dry_run: bool = False):
+    return await ensure_collections(
+        quadrant.qdrant_client,
+        collection_chunk=os.getenv("COLLECTION_CHUNK", "chunk_collection"),
+        collection_metadata=os.getenv("COLLECTION_METADATA", "metadata_collection"),
+        vector_size=quadrant.model.get_sentence_embedding_dimension(),
+        hnsw_m=app.config.get("QDRANT_HNSW_M", 16),
+        hnsw_ef_construct=app.config.get("QDRANT_HNSW_EF_CONSTRUCT", 100),
+        scalar_quantization=app.config.get("QDRANT_SCALAR_QUANTIZATION", False),
+        dry_run=dry_run,
+    )
+
 # Initialize the database (you should now await this in the main async function)
 @app.before_serving
 async def init():
     await init_tortoise()
+    write_behind.start()
+    await quadrant.init_qdrant_client()
+    quadrant.embedding_service.start()
+
+    # Only validate, every worker starts at the same time and changes are applied with 'quart setup-collections'
+    if app.config.get("QDRANT_VALIDATE_ON_STARTUP", True):
+        try:
+            await setup_collections(dry_run=True)
+        except Exception as e:
+            print(f"Error validating the Qdrant collections: {e}")
+
+    # Load the rating index and keep it in sync with ratings saved by other workers
+    await refreshRatingIndex()
+    app.rating_index_task = asyncio.create_task(
+        refreshRatingIndexPeriodically(app.config.get("RATING_INDEX_REFRESH_SECONDS", 60))
+    )
+
+    # Load the metadata mirror the query filters run against and reload it when the collection changed elsewhere
+    try:
+        await quadrant.refresh_metadata_mirror(force=True)
+    except Exception as e:
+        print(f"Error loading the metadata mirror, filters run in Qdrant until it is loaded: {e}")
+    app.metadata_mirror_task = asyncio.create_task(
+        quadrant.refresh_metadata_mirror_periodically(app.config.get("METADATA_MIRROR_REFRESH_SECONDS", 30))
+    )
+
+    # Open the pooled client to the scraping worker and continue the jobs that were pending when the app stopped
+    scrape_jobs.start()
+    resumed_jobs = await scrape_jobs.resume_pending()
+    if resumed_jobs:
+        print(f"Resumed {resumed_jobs} pending scrape jobs.")
+
+@app.after_serving
+async def shutdown():
+    app.rating_index_task.cancel()
+    app.metadata_mirror_task.cancel()
+    await scrape_jobs.stop()
+    # Write the queued question history and point grants before the database is closed
+    await write_behind.stop()
+    await quadrant.embedding_service.stop()
+    await quadrant.close_qdrant_client()
+    await Tortoise.close_connections()
+
+@app.cli.command("backfill-rating-stats")
+def backfill_rating_stats():
+    """
+    Rebuilds the document rating stats from all existing ratings
+    """
+    async def backfill():
+        async with app.app_context():
+            await init_tortoise()
+            document_count = await rebuildDocumentRatingStats()
+            await Tortoise.close_connections()
+            print(f"Rebuilt rating stats for {document_count} documents.")
+
+    asyncio.run(backfill())
+
+@app.cli.command("setup-collections")
+def setup_collections_command():
+    """
+    Creates or validates the Qdrant collections and their payload indexes
+    """
+    async def setup():
+        await quadrant.init_qdrant_client()
+        changes = await setup_collections()
+        await quadrant.close_qdrant_client()
+        print("\n".join(changes) if changes else "Qdrant collections are up to date.")
+
+    asyncio.run(setup())
+
+@app.cli.command("export-onnx-model")
+@click.option("--output", default=lambda: os.getenv("EMBEDDING_ONNX_PATH", "onnx_model"), help="Directory for the exported model")
+@click.option("--quantize/--no-quantize", default=True, help="Also write an int8 dynamically quantized model")
+def export_onnx_model_command(output, quantize):
+    """
+    Exports MODEL_NAME to ONNX for EMBEDDING_BACKEND=onnx
+    """
+    for path in export_onnx_model(quadrant.MODEL_NAME, output, quantize):
+        print(f"Wrote {path}")
+
+@app.cli.command("resync-rating-payloads")
+def resync_rating_payloads():
+    """
+    Writes the current average rating of every document into its Qdrant metadata payload
+    """
+    async def resync():
+        async with app.app_context():
+            await init_tortoise()
+            await quadrant.init_qdrant_client()
+            corrected = await quadrant.resync_document_ratings(os.getenv("COLLECTION_METADATA", "metadata_collection"))
+            for link_id in corrected:
+                await record_link_change(link_id, UPSERT)
+            await quadrant.close_qdrant_client()
+            await Tortoise.close_connections()
+            print(f"Corrected the rating payload of {len(corrected)} documents.")
+
+    asyncio.run(resync())
+
+@app.cli.command("migrate-question-history")
+def migrate_question_history_command():
+    """
+    Moves the question history from the user_questions table into the per-user question slots
+    """
+    async def migrate():
+        async with app.app_context():
+            await init_tortoise()
+            migrated = await migrate_question_history()
+            await Tortoise.close_connections()
+            print(f"Migrated {migrated} questions.")
+
+    asyncio.run(migrate())
+
+@app.cli.command("gc-orphan-chunks")
+@click.option("--batch-size", default=1000, help="Number of chunks scanned per batch")
+@click.option("--dry-run", is_flag=True, help="Only count the orphaned chunks")
+def gc_orphan_chunks(batch_size, dry_run):
+    """
+    Deletes chunks whose link has no metadata point anymore
+    """
+    async def collect():
+        await quadrant.init_qdrant_client()
+        stats = await quadrant.delete_orphan_chunks(
+            os.getenv("COLLECTION_CHUNK", "chunk_collection"),
+            os.getenv("COLLECTION_METADATA", "metadata_collection"),
+            batch_size,
+            dry_run,
+            progress=lambda stats: print(f"Scanned {stats['scanned']} chunks, {stats['orphans']} orphaned, {stats['deleted']} deleted"),
+        )
+        await quadrant.close_qdrant_client()
+        print(f"Done: {stats}")
+
+    asyncio.run(collect())
+
+@app.cli.command("compact-link-changes")
+@click.option("--retention-days", type=float, default=lambda: float(os.getenv("LINK_CHANGE_RETENTION_DAYS", 30)), help="How long every change is kept")
+def compact_link_changes_command(retention_days):
+    """
+    Removes the link change log entries older than the retention that delta syncs no longer need
+    """
+    async def compact():
+        async with app.app_context():
+            await init_tortoise()
+            compacted_version, removed = await compact_link_changes(retention_days)
+            await Tortoise.close_connections()
+            print(f"Removed {removed} link changes up to version {compacted_version}.")
+
+    asyncio.run(compact())
 
 # Import blueprints (same as before)
 from app.routes.base_routes import base_blueprint
@@ -59,6 +231,21 @@ app.register_blueprint(rating_blueprint)
 app.register_blueprint(point_blueprint)
 app.register_blueprint(adminCheck_blueprint)
 
+# Collect the stage timings of every request and send them back in the Server-Timing header
+@app.before_request
+async def start_request_timings():
+    if instrumentation.enabled:
+        instrumentation.start_request()
+        g.request_start = time.perf_counter()
+
+@app.after_request
+async def add_server_timing(response):
+    if instrumentation.enabled and "request_start" in g:
+        server_timing = instrumentation.server_timing(total_ms=(time.perf_counter() - g.request_start) * 1000)
+        response.headers["Server-Timing"] = server_timing
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
 # CORS header middleware
 @app.after_request
 async def after_request(response):
@@ -0,0 +1,17 @@
+from tortoise import fields
+from tortoise.models import Model
+
+class DocumentRatingStats(Model):
+    '''
+    Aggregated ratings of a document in qdrant, kept up to date whenever a rating is saved
+    '''
+    class Meta:
+        table = "document_rating_stats"
+    
+    qdrant_id = fields.CharField(max_length=255, primary_key=True)
+    rating_sum = fields.FloatField(default=0)
+    rating_count = fields.IntField(default=0)
+    average_rating = fields.FloatField(null=True)
+
+    def __repr__(self):
+        return f"<DocumentRatingStats(qdrant_id={self.qdrant_id}, rating_count={self.rating_count}, average_rating={self.average_rating})>"
@@ -0,0 +1,35 @@
+from tortoise import fields
+from tortoise.models import Model
+
+class LinkChange(Model):
+    '''
+    An entry of the change log of the metadata collection. The version increases with every change, clients
+    pass the last version they have seen to /api/links/all?since=<version> to get only what changed afterwards
+    '''
+    class Meta:
+        table = "link_change_log"
+    
+    version = fields.IntField(primary_key=True)
+    link_id = fields.CharField(max_length=255, db_index=True)
+    operation = fields.CharField(max_length=16) # "upsert" or "delete"
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    def __repr__(self):
+        return f"<LinkChange(version={self.version}, link_id={self.link_id}, operation={self.operation})>"
+
+
+class LinkChangeCompaction(Model):
+    '''
+    A compaction of the change log. Changes up to its version may have been removed, clients that saw an older
+    version have to list all links again
+    '''
+    class Meta:
+        table = "link_change_compaction"
+
+    id = fields.IntField(primary_key=True)
+    version = fields.IntField()
+    deleted = fields.IntField(default=0) # number of removed change log entries
+    compacted_at = fields.DatetimeField(auto_now_add=True)
+
+    def __repr__(self):
+        return f"<LinkChangeCompaction(version={self.version}, deleted={self.deleted})>"
@@ -0,0 +1,26 @@
+from tortoise import fields
+from tortoise.models import Model
+
+class OrphanGcJob(Model):
+    '''
+    The state of the orphan chunk collection started with POST /api/links/gc, one row that every worker reads and
+    claims, so only one collection runs at a time. The running worker renews its lease with every batch
+    '''
+    class Meta:
+        table = "orphan_gc_job"
+
+    name = fields.CharField(max_length=64, primary_key=True)
+    status = fields.CharField(max_length=16, default="idle") # "idle", "running", "finished" or "failed"
+    dry_run = fields.BooleanField(default=False)
+    batch_size = fields.IntField(default=0)
+    scanned = fields.IntField(default=0)
+    orphans = fields.IntField(default=0)
+    deleted = fields.IntField(default=0)
+    error = fields.TextField(null=True)
+    owner = fields.CharField(max_length=255, null=True) # process that runs the collection
+    lease_until = fields.DatetimeField(null=True) # a running collection whose lease expired is considered dead
+    started_at = fields.DatetimeField(null=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    def __repr__(self):
+        return f"<OrphanGcJob(name={self.name}, status={self.status}, owner={self.owner})>"
@@ -13,3 +13,20 @@ class UserPoints(Model):
 
     def __repr__(self):
         return f"<UserPoints(user_id={self.user_id}, points={self.points})>"
+
+
+class PointGrant(Model):
+    '''
+    One grant of points to a user, the ledger the balance in UserPoints is the running sum of
+    '''
+    class Meta:
+        table = "point_ledger"
+
+    id = fields.IntField(primary_key=True)
+    user_id = fields.CharField(max_length=255, db_index=True)
+    points = fields.IntField()
+    reason = fields.CharField(max_length=64, default="")
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    def __repr__(self):
+        return f"<PointGrant(user_id={self.user_id}, points={self.points}, reason={self.reason})>"
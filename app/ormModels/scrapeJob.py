@@ -0,0 +1,28 @@
+from tortoise import fields
+from tortoise.models import Model
+
+class ScrapeJob(Model):
+    '''
+    A link submitted for scraping. POST /api/links creates it and returns its id right away, the scraping worker
+    is called in the background and the state can be read from /api/links/jobs/<id>. A pending job belongs to the
+    process holding its lease
+    '''
+    class Meta:
+        table = "scrape_job"
+
+    id = fields.UUIDField(primary_key=True)
+    url = fields.CharField(max_length=2048)
+    title = fields.CharField(max_length=1024, default="")
+    link_type = fields.CharField(max_length=255, default="")
+    user_id = fields.CharField(max_length=255, default="")
+    user_name = fields.CharField(max_length=255, default="")
+    status = fields.CharField(max_length=16, db_index=True) # "queued", "running", "succeeded", "duplicate" or "failed"
+    link_id = fields.CharField(max_length=255, null=True) # metadata point of the scraped or already existing link
+    error = fields.TextField(null=True)
+    owner = fields.CharField(max_length=255, null=True) # process that runs the pending job
+    lease_until = fields.DatetimeField(null=True, db_index=True) # renewed by the owner, other processes resume the job once it expired
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    def __repr__(self):
+        return f"<ScrapeJob(id={self.id}, url={self.url}, status={self.status})>"
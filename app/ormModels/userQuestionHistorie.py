@@ -5,6 +5,7 @@ class UserQuestion(Model):
     '''
     Model used to save the questions a user asked via the query
     Saves the question and response 
+    Replaced by UserQuestionSlot, only read by the migrate-question-history command
     '''
     class Meta:
         table = "user_questions"
@@ -15,3 +16,41 @@ class UserQuestion(Model):
     question = fields.TextField()  
     response = fields.JSONField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
+
+
+class UserQuestionSlot(Model):
+    '''
+    One slot of the question history of a user, a ring buffer of QUESTION_HISTORY_SIZE slots per user.
+    A new question overwrites the slot sequence % QUESTION_HISTORY_SIZE, so adding a question is a single update.
+    Slots are created empty (sequence -1) together with the counter of the user.
+    The response is stored compactly: the response text and the point ids and scores of the documents, optionally zlib compressed
+    '''
+    class Meta:
+        table = "user_question_slots"
+        unique_together = (("user_id", "slot"),)
+
+    id = fields.IntField(primary_key=True)
+    user_id = fields.CharField(max_length=255)
+    slot = fields.IntField()
+    sequence = fields.IntField() # number of questions the user asked before this one
+    question = fields.TextField()
+    payload = fields.BinaryField(null=True) # JSON of {"response_text", "documents": [{"id", "score"}]}
+    compressed = fields.BooleanField(default=False)
+    created_at = fields.DatetimeField()
+
+    def __repr__(self):
+        return f"<UserQuestionSlot(user_id={self.user_id}, slot={self.slot}, sequence={self.sequence})>"
+
+
+class UserQuestionCounter(Model):
+    '''
+    The number of questions a user asked, incremented atomically to give every question a unique sequence
+    '''
+    class Meta:
+        table = "user_question_counters"
+
+    user_id = fields.CharField(max_length=255, primary_key=True)
+    next_sequence = fields.IntField(default=0)
+
+    def __repr__(self):
+        return f"<UserQuestionCounter(user_id={self.user_id}, next_sequence={self.next_sequence})>"
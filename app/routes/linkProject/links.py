@@ -1,102 +1,315 @@
-from quart import Blueprint, request, jsonify
-from app.utils.quadrant import get_documents, update_qdrant_entry, delete_point_by_id, get_point
-import httpx
+from quart import Blueprint, request, jsonify, make_response
+from app.utils.quadrant import get_documents_page, iter_document_pages, get_documents_by_ids, encode_cursor, decode_cursor, update_qdrant_entries, delete_point_by_id, delete_points_by_ids
+from app.utils.linkChangeHandler import record_link_change, record_link_changes, get_links_version, get_link_changes_since, LinkChangesCompacted, UPSERT, DELETE
+import hashlib
+import json
 import os
-from app.utils.pointHandler import grant_points
+import uuid
+from app.utils.responseCache import response_cache
+from app.utils.scrapeJobHandler import scrape_jobs, scrape_job_to_dict, DUPLICATE
+from app.utils.orphanGcHandler import start_orphan_gc, get_orphan_gc_job, orphan_gc_job_to_dict
+from app.ormModels.scrapeJob import ScrapeJob
 
 link_blueprint = Blueprint('link', __name__)
 
 COLLECTION_METADATA_NAME = os.getenv("COLLECTION_METADATA", "metadata_collection")
 COLLECTION_CHUNK_NAME = os.getenv("COLLECTION_CHUNK", "chunk_collection")
-WORKER_URL = os.getenv("WORKER_URL", "localhost:8000")
+LINKS_PAGE_SIZE = int(os.getenv("LINKS_PAGE_SIZE", 500))
+LINKS_MAX_PAGE_SIZE = 1000
+LINKS_BULK_MAX_SIZE = 1000
 
-@link_blueprint.route('/api/links/personal', methods=['GET'])
-async def get_links():
+
+def is_id_list(ids):
     """
-    Route that returns entries for a specific userID from Qdrant.
+    Returns whether ids is a list of point ids (strings or integers).
     """
-    tippgeber_id = request.args.get('tippgeber_id')
+    return isinstance(ids, list) and all(isinstance(point_id, (str, int)) and not isinstance(point_id, bool) for point_id in ids)
+
+
+def listing_variant(tippgeber_id, page_size: int, cursor: str, stream_ndjson: bool):
+    """
+    Returns a short hash of everything that selects the documents of a listing and its format, part of its ETag.
+    """
+    variant = json.dumps([tippgeber_id, page_size, cursor, "ndjson" if stream_ndjson else "json"])
+    return hashlib.sha1(variant.encode("utf-8")).hexdigest()[:16]
+
+
+async def document_pages_response(tippgeber_id=None):
+    """
+    Lists the documents of the metadata collection, optionally only the ones of a tippgeber.
 
+    Query parameters:
+        page_size: Documents per page (default LINKS_PAGE_SIZE, at most LINKS_MAX_PAGE_SIZE).
+        cursor: The next_cursor of the previous page.
+        format: 'ndjson' streams one document per line as the pages arrive (also selected by Accept: application/x-ndjson).
+
+    With page_size or cursor (and without ndjson) a single page is returned as {"documents": [...], "next_cursor": ...},
+    otherwise all documents are streamed page by page as {"documents": [...]}. Full listings carry the version of the
+    change log as ETag (and X-Links-Version), a request with a matching If-None-Match is answered with 304.
+    """
     try:
-        documents = await get_documents(COLLECTION_METADATA_NAME, tippgeber_id)
-        
+        page_size = int(request.args.get('page_size', LINKS_PAGE_SIZE))
+        offset = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid pagination parameters: {str(e)}"}), 400
+
+    if not 1 <= page_size <= LINKS_MAX_PAGE_SIZE:
+        return jsonify({"error": f"page_size must be between 1 and {LINKS_MAX_PAGE_SIZE}"}), 400
+
+    stream_ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    paginated = 'page_size' in request.args or 'cursor' in request.args
+
+    # The version is read before the documents, so a change during the listing leads to a new ETag next time
+    etag = None
+    if not paginated:
+        try:
+            version = await get_links_version()
+        except Exception as e:
+            return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+        etag = f"links-{version}-{listing_variant(tippgeber_id, page_size, request.args.get('cursor'), stream_ndjson)}"
+        if request.if_none_match.contains(etag):
+            return "", 304, {"ETag": f'"{etag}"', "X-Links-Version": str(version), "Vary": "Accept"}
+
+    # The first page is read before the response starts, so errors still get a proper status code
+    try:
+        documents, next_offset = await get_documents_page(COLLECTION_METADATA_NAME, tippgeber_id, page_size, offset)
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    if paginated and not stream_ndjson:
         return jsonify({
             "documents": documents,
+            "next_cursor": encode_cursor(next_offset),
         }), 200
-    except Exception as e:
-        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    async def pages():
+        yield documents
+        if next_offset is not None:
+            async for page in iter_document_pages(COLLECTION_METADATA_NAME, tippgeber_id, page_size, next_offset):
+                yield page
+
+    async def ndjson_lines():
+        try:
+            async for page in pages():
+                yield "".join(json.dumps(document) + "\n" for document in page)
+        except Exception as e:
+            print(f"Error while streaming documents: {e}")
+            yield json.dumps({"error": f"An error occurred: {str(e)}"}) + "\n"
+
+    async def json_chunks():
+        # Same body as one jsonify call, written page by page
+        yield '{"documents": ['
+        first = True
+        try:
+            async for page in pages():
+                if page:
+                    yield ("" if first else ", ") + ", ".join(json.dumps(document) for document in page)
+                    first = False
+        except Exception as e:
+            # The status code is already sent, the unterminated JSON tells the client the listing is incomplete
+            print(f"Error while streaming documents: {e}")
+            return
+        yield ']}'
+
+    if stream_ndjson:
+        response = await make_response(ndjson_lines(), 200, {"Content-Type": "application/x-ndjson"})
+    else:
+        response = await make_response(json_chunks(), 200, {"Content-Type": "application/json"})
+    response.timeout = None
+    if etag:
+        response.set_etag(etag)
+        response.headers["X-Links-Version"] = str(version)
+        response.headers["Vary"] = "Accept"
+    return response
+
+
+@link_blueprint.route('/api/links/personal', methods=['GET'])
+async def get_links():
+    """
+    Route that returns entries for a specific userID from Qdrant.
+    """
+    tippgeber_id = request.args.get('tippgeber_id')
+
+    return await document_pages_response(tippgeber_id)
     
     
 @link_blueprint.route('/api/links/all', methods=['GET'])
 async def get_all_links():
     """
     Route that returns entries from Qdrant.
+    With since=<version> only the links added, updated or deleted after that version are returned, 410 if the changes
+    since that version were compacted and all links have to be listed again
     """
+    since = request.args.get('since')
+    if since is None:
+        return await document_pages_response()
+
     try:
-        documents = await get_documents(COLLECTION_METADATA_NAME)
-        
+        since = int(since)
+    except ValueError:
+        return jsonify({"error": "since must be a version number"}), 400
+
+    try:
+        version, upserted, deleted = await get_link_changes_since(since)
+        documents = await get_documents_by_ids(COLLECTION_METADATA_NAME, upserted)
+
+        # Links that were deleted after their last logged change count as deleted as well
+        found = {str(document["id"]) for document in documents}
+        deleted += [link_id for link_id in upserted if link_id not in found]
+
         return jsonify({
+            "version": version,
             "documents": documents,
+            "deleted": deleted,
         }), 200
+    except LinkChangesCompacted as e:
+        return jsonify({"error": str(e), "full": True, "compacted_version": e.compacted_version}), 410
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+def link_submission(data: dict):
+    return {
+        "url": data.get("url", ""),
+        "title": data.get("title", ""),
+        "type": data.get("type", ""),
+        "user": {
+            "id": data.get("user", {}).get("id", ""),
+            "name": data.get("user", {}).get("name", ""),
+        },
+    }
+
+
+def scrape_job_response(job):
+    """
+    Returns the job with 200 if the link already existed, otherwise with 202 and the URL to poll
+    """
+    body = scrape_job_to_dict(job)
+    if job.status == DUPLICATE:
+        return jsonify(body), 200
+    return jsonify(body), 202, {"Location": f"/api/links/jobs/{job.id}"}
+
+
 # This is being used by the worker who scrapes data and gets all required data for this endpoint
 @link_blueprint.route('/api/links', methods=['POST'])
 async def add_link():
     """
-    Adds an entry to Qdrant
+    Submits a link for scraping and returns its job right away, a URL that is already stored or being scraped
+    returns the existing link or job instead of scraping it again
     """
     data = await request.get_json()
-    user_id = data.get("user", {}).get("id", "")
+    if not data or not data.get("url", "").strip():
+        return jsonify({"error": "url is required"}), 400
 
-    json_payload = {
-        "url": data.get("url", ""),
-        "title": data.get("title", ""),
-        "type": data.get("type", ""),
-        "user": {
-            "id": user_id,
-            "name": data.get("user", {}).get("name", ""),  
-        },
-    }
- 
+    link = link_submission(data)
     try:
-        # Call the scraping API using httpx
-        async with httpx.AsyncClient() as client:
-            response = await client.post("http://" + WORKER_URL + "/scrape", json=json_payload)
-            print(response.status_code)
-            if response.status_code == 200:
-                await grant_points(user_id, 100)
-                response_data = response.json()
-                return jsonify(response_data), 200
-            else:
-                return jsonify({"error": f"Scraping API error: {response.text}"}), response.status_code
+        job = await scrape_jobs.submit(link["url"], link["title"], link["type"], link["user"])
+        return scrape_job_response(job)
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
+@link_blueprint.route('/api/links/bulk', methods=['POST'])
+async def add_links():
+    """
+    Submits many links for scraping, the body is {"links": [...]} with the same fields as POST /api/links
+    """
+    body = await request.get_json()
+
+    if not body or not isinstance(body.get('links'), list) or not body['links'] or not all(isinstance(link, dict) and str(link.get("url", "")).strip() for link in body['links']):
+        return jsonify({"error": "Invalid JSON data, expected a list of links with url"}), 400
+
+    if len(body['links']) > LINKS_BULK_MAX_SIZE:
+        return jsonify({"error": f"At most {LINKS_BULK_MAX_SIZE} links are allowed per call"}), 400
+
+    try:
+        jobs = await scrape_jobs.submit_many([link_submission(link) for link in body['links']])
+        return jsonify({"jobs": [scrape_job_to_dict(job) for job in jobs]}), 202
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@link_blueprint.route('/api/links/jobs/<job_id>', methods=['GET'])
+async def get_link_job(job_id):
+    """
+    Returns the state of a scrape job
+    """
+    try:
+        job = await ScrapeJob.get_or_none(id=uuid.UUID(job_id))
+    except ValueError:
+        job = None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(scrape_job_to_dict(job)), 200
+
+
 @link_blueprint.route('/api/links', methods=['PUT'])
 async def update_link():
     """
     Update an element in Qdrant, keeping certain parts of the data intact (like IDs).
+    With an If-Match header the update is only applied while the element still has that version (metadata.revision,
+    "" for elements that were never updated), otherwise 412 is returned.
     """
     id = request.args.get('id')
     data = await request.get_json()
+    if_match = request.headers.get('If-Match')
+
+    if not id or not isinstance(data, dict):
+        return jsonify({"error": "Invalid request, expected the id parameter and a JSON object"}), 400
+
+    update = {"id": id, "data": data}
+    if if_match is not None:
+        update["expected_version"] = if_match.replace('W/', '', 1).strip('"') or None
 
     try:
-        # Fetch existing data from Qdrant
-        existing_data = await get_point(COLLECTION_METADATA_NAME, id)
-        
-        # Ensure that the data exists
-        if not existing_data:
+        # Write the changed fields into the metadata payload, the vector stays untouched. The existence and version
+        # checks happen in the same call
+        result = (await update_qdrant_entries(COLLECTION_METADATA_NAME, [update]))[0]
+
+        if result["status"] == "not_found":
             return jsonify({"error": "The item with the provided ID does not exist."}), 404
-        
-        # Add the updated entry back to Qdrant
-        point_id = await update_qdrant_entry(COLLECTION_METADATA_NAME, id, data)
+        if result["status"] == "conflict":
+            return jsonify({"error": f"The item was changed in the meantime, its version is {result['version']}.", "version": result["version"]}), 412
+
+        response_cache.invalidate_link(id)
+        await record_link_change(id, UPSERT)
         
         # Return the updated point_id as a response
-        return jsonify({"point_id": point_id}), 200
+        return jsonify({"point_id": id, "version": result["version"]}), 200
+
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@link_blueprint.route('/api/links/bulk', methods=['PUT'])
+async def update_links():
+    """
+    Updates many elements in Qdrant in one call. The body is either {"ids": [...], "data": {...}} to apply the same
+    data to all ids or {"updates": [{"id": ..., "data": {...}, "expected_version": ...}, ...]}, where expected_version
+    is optional and makes the update conditional like If-Match of PUT /api/links.
+    """
+    body = await request.get_json()
+
+    if isinstance(body, dict) and is_id_list(body.get('ids')) and isinstance(body.get('data'), dict):
+        updates = [{"id": point_id, "data": body['data']} for point_id in body['ids']]
+    elif isinstance(body, dict) and isinstance(body.get('updates'), list) and all(
+        isinstance(update, dict) and is_id_list([update.get('id')]) and isinstance(update.get('data'), dict) for update in body['updates']
+    ):
+        updates = body['updates']
+    else:
+        return jsonify({"error": "Invalid JSON data, expected ids and data or a list of updates with id and data"}), 400
+
+    if len(updates) > LINKS_BULK_MAX_SIZE:
+        return jsonify({"error": f"At most {LINKS_BULK_MAX_SIZE} updates are allowed per call"}), 400
+
+    try:
+        results = await update_qdrant_entries(COLLECTION_METADATA_NAME, updates)
+
+        for result in results:
+            if result["status"] == "updated":
+                response_cache.invalidate_link(result["id"])
+        await record_link_changes([result["id"] for result in results if result["status"] == "updated"], UPSERT)
 
+        return jsonify({"results": results}), 200
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
@@ -110,6 +323,66 @@ async def delete_link():
 
     try:
         response = await delete_point_by_id(COLLECTION_METADATA_NAME, COLLECTION_CHUNK_NAME, id)
+        response_cache.invalidate_link(id)
+        await record_link_change(id, DELETE)
         return jsonify(response), 200
     except Exception as e:
-        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
\ No newline at end of file
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@link_blueprint.route('/api/links/bulk', methods=['DELETE'])
+async def delete_links():
+    """
+    Deletes many entries and their chunks from Qdrant in one call, the body is {"ids": [...]}
+    """
+    body = await request.get_json()
+
+    if not isinstance(body, dict) or not is_id_list(body.get('ids')) or not body['ids']:
+        return jsonify({"error": "Invalid JSON data, expected a list of ids"}), 400
+
+    if len(body['ids']) > LINKS_BULK_MAX_SIZE:
+        return jsonify({"error": f"At most {LINKS_BULK_MAX_SIZE} ids are allowed per call"}), 400
+
+    try:
+        deleted_ids, missing_ids = await delete_points_by_ids(COLLECTION_METADATA_NAME, COLLECTION_CHUNK_NAME, body['ids'])
+
+        for id in deleted_ids:
+            response_cache.invalidate_link(id)
+        await record_link_changes(deleted_ids, DELETE)
+
+        return jsonify({"deleted": deleted_ids, "not_found": missing_ids}), 200
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@link_blueprint.route('/api/links/gc', methods=['POST'])
+async def start_orphan_gc_job():
+    """
+    Starts deleting chunks whose link no longer exists, optional query parameters are batch_size and dry_run.
+    Returns 409 while a collection is running in any worker
+    """
+    try:
+        batch_size = min(int(request.args.get('batch_size', LINKS_MAX_PAGE_SIZE)), LINKS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "batch_size must be an integer"}), 400
+    if batch_size < 1:
+        return jsonify({"error": "batch_size must be positive"}), 400
+    dry_run = request.args.get('dry_run', 'false').lower() in ('1', 'true', 'yes')
+
+    try:
+        started = await start_orphan_gc(COLLECTION_CHUNK_NAME, COLLECTION_METADATA_NAME, batch_size, dry_run)
+        job = await get_orphan_gc_job()
+        return jsonify(orphan_gc_job_to_dict(job)), 202 if started else 409
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@link_blueprint.route('/api/links/gc', methods=['GET'])
+async def get_orphan_gc():
+    """
+    Returns the progress of the last orphan chunk collection of any worker
+    """
+    try:
+        return jsonify(orphan_gc_job_to_dict(await get_orphan_gc_job())), 200
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
@@ -1,12 +1,19 @@
-from quart import Blueprint, request, jsonify
-from app.utils.quadrant import query_qdrant
-from app.utils.llm import generate_response_from_retrieved_documents
-from app.utils.userQuestionHandler import add_requested_question, get_last_three_questions
+from quart import Blueprint, request, jsonify, make_response
+from app.utils.quadrant import query_qdrant, query_qdrant_batch, embedding_cache, encode_query, resolve_filters
+from app.utils.responseCache import response_cache
+from app.utils.llm import generate_response_from_retrieved_documents, stream_response_from_retrieved_documents
+from app.utils.userQuestionHandler import queue_requested_question, get_last_three_questions
+from app.utils.instrumentation import instrumentation
+from app.utils.writeBehind import write_behind
+import asyncio
+import json
 import os
 
 query_blueprint = Blueprint('query', __name__)
 COLLECTION_CHUNK_NAME = os.getenv("COLLECTION_CHUNK", "chunk_collection")
 COLLECTION_METADATA_NAME = os.getenv("COLLECTION_METADATA", "metadata_collection")
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", 100))
+QUERY_BATCH_LLM_CONCURRENCY = int(os.getenv("QUERY_BATCH_LLM_CONCURRENCY", 4))
 
 @query_blueprint.route('/api/query', methods=['POST'])
 async def query_qdrant_endpoint():
@@ -23,7 +30,17 @@ async def query_qdrant_endpoint():
     filters = data['filters']  # The filters object that contains the limits and criteria
     print(f"Filters: {filters}")
     
-    # Init quadrant and the model
+    # Serve paraphrases of recently answered questions with the same filters from the semantic cache
+    query_vector = await encode_query(query_text)
+    resolved_filters = resolve_filters(filters)
+    with instrumentation.span("cache"):
+        links_version = await response_cache.sync()
+        cached = response_cache.get(query_vector, resolved_filters)
+    if cached:
+        retrieved_docs, response = cached
+        with instrumentation.span("history"):
+            await queue_requested_question(question=query_text, user_id=user_id, response={"response_text": response, "documents": retrieved_docs})
+        return {"response_text": response, "documents": retrieved_docs, "cached": True}
 
     # Get the top documents from qdrant
     retrieved_docs = await query_qdrant(
@@ -34,7 +51,7 @@ async def query_qdrant_endpoint():
     )
     
     if not retrieved_docs:
-         return {"response_text": "Es wurden keine Dokumente gefunden", "documents": []}
+         return {"response_text": "Es wurden keine Dokumente gefunden", "documents": [], "cached": False}
     
     # Generate a response using the retrieved documents
     response = await generate_response_from_retrieved_documents(
@@ -42,8 +59,137 @@ async def query_qdrant_endpoint():
         retrieved_docs=retrieved_docs
     )
     
-    await add_requested_question(question=query_text, user_id=user_id, response={"response_text": response, "documents": retrieved_docs}) 
-    return {"response_text": response, "documents": retrieved_docs}
+    response_cache.put(query_vector, resolved_filters, retrieved_docs, response, links_version)
+    with instrumentation.span("history"):
+        await queue_requested_question(question=query_text, user_id=user_id, response={"response_text": response, "documents": retrieved_docs})
+    return {"response_text": response, "documents": retrieved_docs, "cached": False}
+
+@query_blueprint.route('/api/query/batch', methods=['POST'])
+async def query_qdrant_batch_endpoint():
+    """
+    Route for internal tools and evaluations that runs many query_texts with the same filters in one call.
+    The answers are generated concurrently (at most QUERY_BATCH_LLM_CONCURRENCY at once) unless generate_answers is false
+    """
+    data = await request.get_json()
+
+    if not data or 'query_texts' not in data or 'filters' not in data:
+        return jsonify({"error": "Invalid JSON data or missing query_texts or filters"}), 400
+
+    query_texts = data['query_texts']  # The queries to run
+    filters = data['filters']  # The filters object that is shared by all queries
+    generate_answers = data.get('generate_answers', True)  # Whether to generate LLM answers or only retrieve documents
+
+    if not isinstance(query_texts, list) or not query_texts or not all(isinstance(query_text, str) for query_text in query_texts):
+        return jsonify({"error": "query_texts must be a non-empty list of strings"}), 400
+    if len(query_texts) > QUERY_BATCH_MAX_SIZE:
+        return jsonify({"error": f"At most {QUERY_BATCH_MAX_SIZE} query_texts are allowed per batch"}), 400
+
+    try:
+        documents_per_query = await query_qdrant_batch(
+            collection_name=COLLECTION_CHUNK_NAME,
+            collection_metadata=COLLECTION_METADATA_NAME,
+            query_texts=query_texts,
+            filters=filters,
+        )
+
+        semaphore = asyncio.Semaphore(QUERY_BATCH_LLM_CONCURRENCY)
+
+        async def answer(query_text: str, retrieved_docs: list):
+            if not generate_answers:
+                return None
+            if not retrieved_docs:
+                return "Es wurden keine Dokumente gefunden"
+            async with semaphore:
+                return await generate_response_from_retrieved_documents(query=query_text, retrieved_docs=retrieved_docs)
+
+        responses = await asyncio.gather(*(
+            answer(query_text, retrieved_docs) for query_text, retrieved_docs in zip(query_texts, documents_per_query)
+        ))
+
+        return jsonify({"results": [
+            {"query_text": query_text, "response_text": response, "documents": retrieved_docs}
+            for query_text, response, retrieved_docs in zip(query_texts, responses, documents_per_query)
+        ]}), 200
+    except Exception as e:
+        print(f"Error while running the query batch: {e}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+def format_sse(event: str, data) -> str:
+    """
+    Formats a Server-Sent Event with a JSON payload
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@query_blueprint.route('/api/query/stream', methods=['POST'])
+async def query_qdrant_stream_endpoint():
+    """
+    Streaming variant of /api/query. Answers with Server-Sent Events: first a 'documents' event with the retrieved
+    documents, then one 'token' event per part of the generated answer and a final 'done' event ('error' on failure)
+    """
+    data = await request.get_json()
+
+    if not data or 'query_text' not in data or 'filters' not in data or 'user_id' not in data:
+        return jsonify({"error": "Invalid JSON data or missing query_text or filters or user_id"}), 400
+    
+    query_text = data['query_text']  # The query the user asked for
+    user_id = data['user_id']  # The user who requested the query
+    filters = data['filters']  # The filters object that contains the limits and criteria
+    print(f"Filters: {filters}")
+
+    async def generate_events():
+        try:
+            query_vector = await encode_query(query_text)
+            resolved_filters = resolve_filters(filters)
+            with instrumentation.span("cache"):
+                links_version = await response_cache.sync()
+                cached = response_cache.get(query_vector, resolved_filters)
+            if cached:
+                retrieved_docs, response = cached
+                yield format_sse("documents", {"documents": retrieved_docs, "cached": True})
+                yield format_sse("token", {"text": response})
+                yield format_sse("done", {})
+                with instrumentation.span("history"):
+                    await queue_requested_question(question=query_text, user_id=user_id, response={"response_text": response, "documents": retrieved_docs})
+                return
+
+            # Get the top documents from qdrant and send them before the answer is generated
+            retrieved_docs = await query_qdrant(
+                collection_name=COLLECTION_CHUNK_NAME,
+                collection_metadata=COLLECTION_METADATA_NAME,
+                query_text=query_text,
+                filters=filters,
+            )
+            yield format_sse("documents", {"documents": retrieved_docs, "cached": False})
+
+            if not retrieved_docs:
+                yield format_sse("token", {"text": "Es wurden keine Dokumente gefunden"})
+                yield format_sse("done", {})
+                return
+
+            parts = []
+            async for part in stream_response_from_retrieved_documents(query=query_text, retrieved_docs=retrieved_docs):
+                parts.append(part)
+                yield format_sse("token", {"text": part})
+            yield format_sse("done", {})
+
+            response = "".join(parts)
+            response_cache.put(query_vector, resolved_filters, retrieved_docs, response, links_version)
+            with instrumentation.span("history"):
+                await queue_requested_question(question=query_text, user_id=user_id, response={"response_text": response, "documents": retrieved_docs})
+        except Exception as e:
+            print(f"Error while streaming the query response: {e}")
+            yield format_sse("error", {"error": f"An error occurred: {str(e)}"})
+
+    response = await make_response(generate_events(), 200, {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # The generation can take longer than the default response timeout
+    response.timeout = None
+    return response
 
 @query_blueprint.route('/api/query/historie', methods=['GET'])
 async def get_last_questions():
@@ -56,3 +202,35 @@ async def get_last_questions():
         return jsonify({"error": "user_id parameter is required"}), 400
     
     return await get_last_three_questions(user_id=user_id)
+
+
+@query_blueprint.route('/api/query/embedding-cache', methods=['GET'])
+async def get_embedding_cache_stats():
+    """
+    Returns the size and hit/miss counters of the query embedding cache of this worker
+    """
+    return jsonify(embedding_cache.stats()), 200
+
+
+@query_blueprint.route('/api/query/response-cache', methods=['GET'])
+async def get_response_cache_stats():
+    """
+    Returns the size and hit/miss counters of the semantic response cache of this worker
+    """
+    return jsonify(response_cache.stats()), 200
+
+
+@query_blueprint.route('/api/query/write-behind', methods=['GET'])
+async def get_write_behind_stats():
+    """
+    Returns the depth and flush counters of the queue that writes the question history and point grants of this worker
+    """
+    return jsonify(write_behind.stats()), 200
+
+
+@query_blueprint.route('/api/query/metrics', methods=['GET'])
+async def get_query_metrics():
+    """
+    Returns the latency histograms of the query stages (encode, prefilter, search, metadata, ratings, llm, history, ...) of this worker
+    """
+    return jsonify(instrumentation.snapshot()), 200
@@ -1,7 +1,12 @@
 from quart import Blueprint, request, jsonify
 from app.utils.ratingHandler import saveRating, getUserRatings, getDocumentRating
+from app.utils.quadrant import set_document_rating
+from app.utils.responseCache import response_cache
+from app.utils.linkChangeHandler import record_link_change, UPSERT
+import os
 
 rating_blueprint = Blueprint('rating', __name__)
+COLLECTION_METADATA_NAME = os.getenv("COLLECTION_METADATA", "metadata_collection")
 
 @rating_blueprint.route('/api/rating', methods=['POST'])
 async def create_or_update_rating():
@@ -20,7 +25,16 @@ async def create_or_update_rating():
         
         response = await saveRating(user_id=data['user_id'], document_id=data['document_id'], rating=data['rating'])
         print(response)
-        
+        response_cache.invalidate_link(data['document_id'])
+
+        # The average rating is part of the listed metadata and of cached responses on every worker
+        await record_link_change(data['document_id'], UPSERT)
+
+        # Mirror the new average into the metadata payload so the rating filter can run inside Qdrant
+        try:
+            await set_document_rating(COLLECTION_METADATA_NAME, data['document_id'], response["average_rating"])
+        except Exception as e:
+            print(f"Rating payload not synced, it will be fixed by the next resync: {e}")
     
         if response["type"] == "update":
             return jsonify({
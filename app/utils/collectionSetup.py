@@ -0,0 +1,144 @@
+import logging
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, HnswConfigDiff, PayloadSchemaType,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType
+)
+
+logger = logging.getLogger(__name__)
+
+SCORE_FIELDS = ["co2_score", "reduk_score", "report_score", "sustfin_score", "regul_score"]
+
+# Payload fields the filters in quadrant.py run against, with the index type they need
+CHUNK_PAYLOAD_INDEXES = {
+    "link_id": PayloadSchemaType.KEYWORD,
+    "url": PayloadSchemaType.KEYWORD, # group_by key of query_points_groups
+}
+METADATA_PAYLOAD_INDEXES = {
+    "metadata.url": PayloadSchemaType.KEYWORD,
+    "metadata.link_type": PayloadSchemaType.KEYWORD,
+    "metadata.user.id": PayloadSchemaType.KEYWORD,
+    "metadata.avg_rating": PayloadSchemaType.FLOAT,
+    **{"metadata." + field: PayloadSchemaType.FLOAT for field in SCORE_FIELDS},
+}
+
+
+async def ensure_collection(client: AsyncQdrantClient, collection_name: str, vector_size: int, payload_indexes: dict,
+                            hnsw_m: int = 16, hnsw_ef_construct: int = 100, scalar_quantization: bool = False,
+                            dry_run: bool = False):
+    """
+    Creates a collection if it does not exist yet, otherwise validates it and applies the HNSW, quantization and
+    payload index settings that differ. With dry_run nothing is changed, only the differences are returned.
+
+    Args:
+        client (AsyncQdrantClient): The client to use.
+        collection_name (str): The name of the collection.
+        vector_size (int): The dimension of the embedding model, existing collections must match it.
+        payload_indexes (dict): Payload field name -> PayloadSchemaType that should be indexed.
+        hnsw_m (int): Number of edges per node in the HNSW graph.
+        hnsw_ef_construct (int): Number of neighbours considered while building the HNSW graph.
+        scalar_quantization (bool): Whether vectors should additionally be stored as int8.
+        dry_run (bool): Whether to only report the changes instead of making them.
+
+    Returns:
+        List[str]: A description of every change that was made (or would be made with dry_run).
+
+    Raises:
+        ValueError: If the collection exists with a different vector size.
+    """
+    changes = []
+    hnsw_config = HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+    quantization_config = ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+    ) if scalar_quantization else None
+
+    if not await client.collection_exists(collection_name):
+        if dry_run:
+            return [f"{collection_name}: collection does not exist"]
+        await client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+            hnsw_config=hnsw_config,
+            quantization_config=quantization_config,
+        )
+        changes.append(f"{collection_name}: created collection with vector size {vector_size}")
+        collection_info = await client.get_collection(collection_name)
+    else:
+        collection_info = await client.get_collection(collection_name)
+        vectors = collection_info.config.params.vectors
+        if isinstance(vectors, VectorParams) and vectors.size != vector_size:
+            raise ValueError(
+                f"Collection {collection_name} stores vectors of size {vectors.size}, but the model produces {vector_size}."
+            )
+
+        current_hnsw = collection_info.config.hnsw_config
+        if current_hnsw.m != hnsw_m or current_hnsw.ef_construct != hnsw_ef_construct:
+            if not dry_run:
+                await client.update_collection(collection_name=collection_name, hnsw_config=hnsw_config)
+            changes.append(
+                f"{collection_name}: HNSW m={current_hnsw.m}, ef_construct={current_hnsw.ef_construct} differs from m={hnsw_m}, ef_construct={hnsw_ef_construct}"
+                if dry_run else f"{collection_name}: set HNSW m={hnsw_m}, ef_construct={hnsw_ef_construct}"
+            )
+
+        if scalar_quantization and collection_info.config.quantization_config is None:
+            if not dry_run:
+                await client.update_collection(collection_name=collection_name, quantization_config=quantization_config)
+            changes.append(f"{collection_name}: int8 scalar quantization is disabled" if dry_run else f"{collection_name}: enabled int8 scalar quantization")
+
+    existing_indexes = collection_info.payload_schema or {}
+    for field_name, field_schema in payload_indexes.items():
+        existing_index = existing_indexes.get(field_name)
+        if existing_index is not None and existing_index.data_type == field_schema:
+            continue
+
+        if not dry_run:
+            if existing_index is not None:
+                await client.delete_payload_index(collection_name=collection_name, field_name=field_name)
+            await client.create_payload_index(collection_name=collection_name, field_name=field_name, field_schema=field_schema)
+            changes.append(f"{collection_name}: created {field_schema.value} index on {field_name}")
+        elif existing_index is None:
+            changes.append(f"{collection_name}: missing {field_schema.value} index on {field_name}")
+        else:
+            changes.append(f"{collection_name}: index on {field_name} is {existing_index.data_type.value}, expected {field_schema.value}")
+
+    return changes
+
+
+async def ensure_collections(client: AsyncQdrantClient, collection_chunk: str, collection_metadata: str, vector_size: int,
+                             hnsw_m: int = 16, hnsw_ef_construct: int = 100, scalar_quantization: bool = False,
+                             dry_run: bool = False):
+    """
+    Creates or validates the chunk and the metadata collection including their payload indexes.
+
+    Args:
+        client (AsyncQdrantClient): The client to use.
+        collection_chunk (str): The name of the chunk collection.
+        collection_metadata (str): The name of the metadata collection.
+        vector_size (int): The dimension of the embedding model.
+        hnsw_m (int): Number of edges per node in the HNSW graph.
+        hnsw_ef_construct (int): Number of neighbours considered while building the HNSW graph.
+        scalar_quantization (bool): Whether the chunk vectors should additionally be stored as int8.
+        dry_run (bool): Whether to only report the differences, e.g. on startup.
+
+    Returns:
+        List[str]: A description of every change that was made (or would be made with dry_run).
+    """
+    changes = await ensure_collection(
+        client, collection_chunk, vector_size, CHUNK_PAYLOAD_INDEXES,
+        hnsw_m=hnsw_m, hnsw_ef_construct=hnsw_ef_construct, scalar_quantization=scalar_quantization, dry_run=dry_run
+    )
+    # The metadata collection is only filtered, never searched by vector, so it is not quantized
+    changes += await ensure_collection(
+        client, collection_metadata, vector_size, METADATA_PAYLOAD_INDEXES,
+        hnsw_m=hnsw_m, hnsw_ef_construct=hnsw_ef_construct, dry_run=dry_run
+    )
+
+    for change in changes:
+        if dry_run:
+            logger.warning(f"Qdrant setup differs, run 'quart setup-collections' to apply: {change}")
+        else:
+            logger.info(change)
+    if not changes:
+        logger.info("Qdrant collections are up to date.")
+
+    return changes
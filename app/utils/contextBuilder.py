@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Rough number of characters per token, used if the tokenizer of the model can not be loaded
+CHARS_PER_TOKEN = 4
+
+
+def shingles(text: str, size: int = 3):
+    """
+    Returns the set of word n-grams of a text, used to compare chunks independent of whitespace and casing.
+    """
+    words = re.findall(r"\w+", text.casefold())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[start:start + size]) for start in range(len(words) - size + 1)}
+
+
+def jaccard_similarity(shingles_a: set, shingles_b: set):
+    if not shingles_a or not shingles_b:
+        return 0.0
+    return len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+
+
+class ContextBuilder:
+    '''
+    Packs retrieved documents into the context of the RAG prompt within a token budget counted with the tokenizer
+    of the LLM. Near-duplicate chunks are removed, whichever URL they come from (the search returns one chunk per URL,
+    but mirrors and re-posts of a page share their text). If the context is too large, the longest summaries are
+    shortened first, never below min_summary_tokens, then the lowest-scoring documents are dropped and the last one
+    is truncated.
+    '''
+
+    def __init__(self, model_name: str, max_tokens: int = 4000, min_summary_tokens: int = 100, duplicate_threshold: float = 0.8):
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.min_summary_tokens = min_summary_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self._encoding = None
+        self._encoding_loaded = False
+
+    @property
+    def encoding(self):
+        # Loaded lazily, tiktoken downloads the encoding on first use
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            try:
+                import tiktoken
+                self._encoding = tiktoken.encoding_for_model(self.model_name)
+            except Exception as e:
+                logger.warning(f"Could not load the tokenizer of {self.model_name}, estimating {CHARS_PER_TOKEN} characters per token: {e}")
+        return self._encoding
+
+    def count_tokens(self, text: str):
+        """
+        Returns the number of tokens of a text for the model.
+        """
+        if self.encoding is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int):
+        """
+        Cuts a text to at most max_tokens tokens, marking the cut with '...'.
+        """
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            return text[:max_tokens * CHARS_PER_TOKEN].rstrip() + "..."
+        return self.encoding.decode(self.encoding.encode(text)[:max_tokens]).rstrip() + "..."
+
+    def build(self, retrieved_docs: list):
+        """
+        Creates the context of the prompt from the retrieved documents.
+
+        Args:
+            retrieved_docs (List[Dict]): The documents as returned by query_qdrant (metadata, chunk and score).
+
+        Returns:
+            Tuple[str, dict]: The context and a report with the number of used, removed and truncated documents
+            and the tokens of the context.
+        """
+        report = {
+            "documents": len(retrieved_docs),
+            "duplicates_removed": 0,
+            "summaries_truncated": 0,
+            "documents_dropped": 0,
+            "context_tokens": 0,
+            "max_tokens": self.max_tokens,
+        }
+
+        # Highest scores first, documents without a score keep their position at the end
+        documents = sorted(retrieved_docs, key=lambda doc: doc.get("score") if doc.get("score") is not None else float("-inf"), reverse=True)
+
+        entries = []
+        seen_chunks = [] # shingles of the chunks already in the context
+        for doc in documents:
+            chunk = doc.get("chunk") or ""
+            chunk_shingles = shingles(chunk)
+            if any(jaccard_similarity(chunk_shingles, other) >= self.duplicate_threshold for other in seen_chunks):
+                report["duplicates_removed"] += 1
+                continue
+            seen_chunks.append(chunk_shingles)
+            entries.append({
+                "url": doc["metadata"].get("url", "No URL available"),
+                "summary": doc["metadata"].get("summary", "No text available") or "",
+                "chunk": chunk,
+            })
+
+        report["summaries_truncated"] = self._shorten_summaries(entries)
+
+        # Drop the lowest-scoring documents until the context fits, but always keep the best one
+        texts = [self._format_entry(number, entry) for number, entry in enumerate(entries)]
+        token_counts = [self.count_tokens(text) for text in texts]
+        while len(entries) > 1 and sum(token_counts) + len(entries) - 1 > self.max_tokens:
+            entries.pop()
+            texts.pop()
+            token_counts.pop()
+            report["documents_dropped"] += 1
+
+        context = "\n".join(texts)
+        if entries and self.count_tokens(context) > self.max_tokens:
+            # A single document larger than the budget: keep its source and summary, cut the chunk
+            entry = entries[0]
+            overhead = self.count_tokens(self._format_entry(0, {**entry, "chunk": ""}))
+            context = self._format_entry(0, {**entry, "chunk": self.truncate(entry["chunk"], self.max_tokens - overhead - 1)})
+
+        report["context_tokens"] = self.count_tokens(context)
+        return context, report
+
+    def _context_tokens(self, entries: list):
+        return sum(self.count_tokens(self._format_entry(number, entry)) for number, entry in enumerate(entries)) + max(len(entries) - 1, 0)
+
+    def _shorten_summaries(self, entries: list):
+        """
+        Cuts the longest summaries to a common length, as long as needed for the context to fit but not below
+        min_summary_tokens.
+
+        Returns:
+            int: The number of shortened summaries.
+        """
+        excess = self._context_tokens(entries) - self.max_tokens
+        summary_tokens = [self.count_tokens(entry["summary"]) for entry in entries]
+        if excess <= 0 or not summary_tokens or max(summary_tokens) <= self.min_summary_tokens:
+            return 0
+
+        def saved(limit):
+            return sum(max(tokens - limit, 0) for tokens in summary_tokens)
+
+        # The largest common length that saves enough tokens, or min_summary_tokens if nothing does
+        low, high = self.min_summary_tokens, max(summary_tokens)
+        if saved(low) > excess:
+            while low < high:
+                limit = (low + high + 1) // 2
+                if saved(limit) >= excess:
+                    low = limit
+                else:
+                    high = limit - 1
+
+        shortened = 0
+        for entry, tokens in zip(entries, summary_tokens):
+            if tokens > low:
+                # One token is left for the '...' that marks the cut
+                entry["summary"] = self.truncate(entry["summary"], max(low - 1, 1))
+                shortened += 1
+        return shortened
+
+    @staticmethod
+    def _format_entry(number: int, entry: dict):
+        return f"{number+1}. [Quelle]: {entry['url']}\n [Summary]: {entry['summary']}\n [Relevant chunk]: {entry['chunk']}\n\n"
+
+
+def create_context_builder(model_name: str):
+    """
+    Creates the context builder from the environment (LLM_CONTEXT_MAX_TOKENS, LLM_SUMMARY_MIN_TOKENS, LLM_DUPLICATE_THRESHOLD).
+
+    Args:
+        model_name (str): The name of the LLM whose tokenizer counts the tokens.
+
+    Returns:
+        ContextBuilder: The new builder.
+    """
+    return ContextBuilder(
+        model_name=model_name,
+        max_tokens=int(os.getenv("LLM_CONTEXT_MAX_TOKENS", 4000)),
+        min_summary_tokens=int(os.getenv("LLM_SUMMARY_MIN_TOKENS", 100)),
+        duplicate_threshold=float(os.getenv("LLM_DUPLICATE_THRESHOLD", 0.8)),
+    )
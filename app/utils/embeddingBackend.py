@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+CONFIG_FILE = "embedding_config.json"
+REFERENCE_FILE = "reference_embeddings.npz"
+
+# Sentences whose torch embeddings are stored next to an exported model to verify the ONNX output against them
+REFERENCE_SENTENCES = [
+    "Wie kann ein Unternehmen seine CO2-Emissionen reduzieren?",
+    "Was ist nachhaltige Finanzierung?",
+    "Welche Regulierungen gelten für das Nachhaltigkeitsreporting?",
+    "How do green bonds work?",
+    "Scope 3 emissions of the supply chain",
+]
+
+
+def cosine_similarities(vectors_a: np.ndarray, vectors_b: np.ndarray):
+    """
+    Returns the row-wise cosine similarity of two matrices of the same shape.
+    """
+    vectors_a = vectors_a / np.linalg.norm(vectors_a, axis=1, keepdims=True)
+    vectors_b = vectors_b / np.linalg.norm(vectors_b, axis=1, keepdims=True)
+    return np.sum(vectors_a * vectors_b, axis=1)
+
+
+class OnnxEmbeddingBackend:
+    '''
+    Runs an exported sentence transformer with ONNX Runtime. It mirrors the parts of the SentenceTransformer API the
+    app uses (encode, get_sentence_embedding_dimension) and refuses to load if its output drifts from the torch model
+    the vectors in Qdrant were created with.
+    '''
+
+    def __init__(self, model_dir: str, model_name: str, quantized: bool = False, min_similarity: float = 0.98):
+        # Only the tokenizers library is needed here, transformers would pull torch into the process
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as config_file:
+            self.config = json.load(config_file)
+
+        if self.config["model_name"] != model_name:
+            raise RuntimeError(
+                f"The ONNX model in {model_dir} was exported from {self.config['model_name']}, but MODEL_NAME is {model_name}. "
+                f"Its vectors would not match the ones stored in Qdrant."
+            )
+
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"])
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"])
+
+        self.verify(os.path.join(model_dir, REFERENCE_FILE), min_similarity)
+        logger.info(f"Loaded ONNX embedding backend from {model_dir}/{model_file}")
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, sentences: list, batch_size: int = 32, **kwargs):
+        """
+        Encodes sentences like SentenceTransformer.encode with the default arguments.
+
+        Returns:
+            np.ndarray: One embedding per sentence.
+        """
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(list(sentences[start:start + batch_size]))
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            token_embeddings = self.session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+            embeddings.append(self._pool(token_embeddings, attention_mask))
+
+        return np.concatenate(embeddings) if embeddings else np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    def verify(self, reference_path: str, min_similarity: float):
+        """
+        Compares the embeddings of the reference sentences with the ones the torch model produced at export time.
+
+        Raises:
+            RuntimeError: If the dimension differs or any cosine similarity is below min_similarity.
+        """
+        reference = np.load(reference_path)
+        vectors = self.encode(list(reference["sentences"]))
+
+        if vectors.shape != reference["embeddings"].shape:
+            raise RuntimeError(f"The ONNX model produces vectors of shape {vectors.shape}, expected {reference['embeddings'].shape}.")
+
+        similarity = float(cosine_similarities(vectors, reference["embeddings"]).min())
+        if similarity < min_similarity:
+            raise RuntimeError(
+                f"The ONNX model is not compatible with the stored vectors: minimum cosine similarity to the torch "
+                f"model is {similarity:.4f}, required are {min_similarity}."
+            )
+        logger.info(f"ONNX embedding parity check passed, minimum cosine similarity {similarity:.4f}")
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray):
+        if self.config["pooling"] == "cls":
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(token_embeddings.dtype)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.config["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = True):
+    """
+    Exports a sentence transformer to ONNX, optionally adds an int8 dynamically quantized copy and stores the
+    reference embeddings the ONNX backend is verified against.
+
+    Args:
+        model_name (str): The name or path of the sentence transformer.
+        output_dir (str): The directory the model files are written to.
+        quantize (bool): Whether to also write the int8 quantized model.
+
+    Returns:
+        List[str]: The files that were written.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, trust_remote_code=True, device="cpu")
+    transformer = model[0]
+    pooling = next(module for module in model if isinstance(module, Pooling))
+    pooling_config = pooling.get_config_dict()
+    if pooling_config.get("pooling_mode_cls_token"):
+        pooling_mode = "cls"
+    elif pooling_config.get("pooling_mode_mean_tokens"):
+        pooling_mode = "mean"
+    else:
+        raise ValueError(f"Unsupported pooling of {model_name}: {pooling_config}")
+
+    if not transformer.tokenizer.is_fast:
+        raise ValueError(f"{model_name} has no fast tokenizer (tokenizer.json), which the ONNX backend needs.")
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = transformer.tokenizer(REFERENCE_SENTENCES[:2], padding=True, return_tensors="pt")
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    torch.onnx.export(
+        TokenEmbeddings(transformer.auto_model).eval(),
+        (sample["input_ids"], sample["attention_mask"]),
+        model_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["token_embeddings"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_embeddings": {0: "batch", 1: "sequence"},
+        },
+        opset_version=17,
+        dynamo=False,
+    )
+    written = [model_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        written.append(quantized_path)
+
+    transformer.tokenizer.save_pretrained(output_dir)
+
+    config_path = os.path.join(output_dir, CONFIG_FILE)
+    with open(config_path, "w") as config_file:
+        json.dump({
+            "model_name": model_name,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length,
+            "pad_token_id": transformer.tokenizer.pad_token_id,
+            "pooling": pooling_mode,
+            "normalize": any(isinstance(module, Normalize) for module in model),
+        }, config_file, indent=2)
+    written.append(config_path)
+
+    reference_path = os.path.join(output_dir, REFERENCE_FILE)
+    np.savez(reference_path, sentences=np.array(REFERENCE_SENTENCES), embeddings=model.encode(REFERENCE_SENTENCES))
+    written.append(reference_path)
+
+    return written
+
+
+def create_embedding_backend(model_name: str):
+    """
+    Loads the embedding model with the backend selected by EMBEDDING_BACKEND:
+    'torch' (default) loads the SentenceTransformer, 'onnx' loads the model exported to EMBEDDING_ONNX_PATH
+    (EMBEDDING_ONNX_QUANTIZED=true for the int8 model, EMBEDDING_PARITY_THRESHOLD for the required similarity).
+
+    Args:
+        model_name (str): The name or path of the sentence transformer the stored vectors were created with.
+
+    Returns:
+        The model, providing encode and get_sentence_embedding_dimension.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        RuntimeError: If the ONNX model is not compatible with model_name.
+    """
+    backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, trust_remote_code=True)
+
+    if backend == "onnx":
+        return OnnxEmbeddingBackend(
+            model_dir=os.getenv("EMBEDDING_ONNX_PATH", "onnx_model"),
+            model_name=model_name,
+            quantized=os.getenv("EMBEDDING_ONNX_QUANTIZED", "false").lower() == "true",
+            min_similarity=float(os.getenv("EMBEDDING_PARITY_THRESHOLD", 0.98)),
+        )
+
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend}, use 'torch' or 'onnx'.")
+
+
+def embedding_backend_key(model_name: str):
+    """
+    Identifies the backend create_embedding_backend loads with the current environment, e.g. for cache keys:
+    vectors of the torch model, the ONNX export and its quantized variant differ slightly.
+
+    Args:
+        model_name (str): The name or path of the sentence transformer.
+
+    Returns:
+        str: 'torch:<model>' or 'onnx:<model>:<export path>' with ':quantized' for the int8 model.
+    """
+    backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+    if backend != "onnx":
+        return f"{backend}:{model_name}"
+
+    key = f"onnx:{model_name}:{os.path.abspath(os.getenv('EMBEDDING_ONNX_PATH', 'onnx_model'))}"
+    if os.getenv("EMBEDDING_ONNX_QUANTIZED", "false").lower() == "true":
+        key += ":quantized"
+    return key
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query_text: str):
+    """
+    Normalizes a query so that trivially different spellings of the same question share a cache entry.
+
+    Args:
+        query_text (str): The query the user asked.
+
+    Returns:
+        str: The query in NFKC form with collapsed whitespace.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query_text)).strip()
+
+
+class EmbeddingCache:
+    '''
+    Bounded LRU cache of query text -> embedding vector with a TTL, optionally backed by a SQLite file
+    so that it stays warm across restarts. Entries are keyed by the embedding backend (model, torch or ONNX export),
+    a backend change never serves vectors of another one. The SQLite file is only touched from one worker thread,
+    so the disk tier never blocks the event loop.
+    '''
+
+    def __init__(self, model_key: str, max_size: int = 1024, ttl_seconds: float = 86400, disk_path: str = None):
+        self.model_key = model_key
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (created_at, vector)
+        self._disk = None
+        self._disk_executor = None
+
+        if disk_path:
+            self._disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache")
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(model_name TEXT, query TEXT, created_at REAL, vector BLOB, PRIMARY KEY (model_name, query))"
+            )
+            self._disk.commit()
+
+    async def get(self, query_text: str):
+        """
+        Returns the cached vector of a query or None if it is missing or expired. Only a miss in memory waits for the
+        disk tier.
+        """
+        key = normalize_query(query_text)
+        entry = self._entries.get(key)
+
+        if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if entry is not None:
+            del self._entries[key]
+
+        vector = None
+        if self._disk is not None:
+            vector = await asyncio.get_running_loop().run_in_executor(self._disk_executor, self._get_from_disk, key)
+        if vector is not None:
+            self._remember(key, vector, time.time())
+            self.disk_hits += 1
+            return vector
+
+        self.misses += 1
+        return None
+
+    def put(self, query_text: str, vector: list):
+        """
+        Stores the vector of a query in memory and, if configured, on disk. The disk write runs in the background.
+        """
+        key = normalize_query(query_text)
+        created_at = time.time()
+        self._remember(key, vector, created_at)
+
+        if self._disk is not None:
+            self._disk_executor.submit(self._put_to_disk, key, created_at, np.asarray(vector, dtype=np.float32).tobytes())
+
+    def clear(self):
+        """
+        Removes all entries from memory and disk.
+        """
+        self._entries.clear()
+        if self._disk is not None:
+            self._disk_executor.submit(self._clear_disk).result()
+
+    def stats(self):
+        """
+        Returns the size and the hit/miss counters of the cache.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model_key": self.model_key,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_tier": self.disk_path is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+        }
+
+    def _remember(self, key: str, vector: list, created_at: float):
+        self._entries[key] = (created_at, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _put_to_disk(self, key: str, created_at: float, vector: bytes):
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model_name, query, created_at, vector) VALUES (?, ?, ?, ?)",
+                (self.model_key, key, created_at, vector)
+            )
+            self._disk.commit()
+        except sqlite3.Error as e:
+            # The disk tier is only an optimization, e.g. a locked file must not fail the query
+            logger.warning(f"Could not write query embedding to disk: {e}")
+
+    def _clear_disk(self):
+        self._disk.execute("DELETE FROM query_embeddings WHERE model_name = ?", (self.model_key,))
+        self._disk.commit()
+
+    def _get_from_disk(self, key: str):
+        try:
+            row = self._disk.execute(
+                "SELECT created_at, vector FROM query_embeddings WHERE model_name = ? AND query = ?",
+                (self.model_key, key)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if time.time() - row[0] > self.ttl_seconds:
+                self._disk.execute("DELETE FROM query_embeddings WHERE model_name = ? AND query = ?", (self.model_key, key))
+                self._disk.commit()
+                return None
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read query embedding from disk: {e}")
+            return None
+
+        return np.frombuffer(row[1], dtype=np.float32).tolist()
+
+
+def create_embedding_cache(model_key: str):
+    """
+    Creates the query embedding cache from the environment
+    (EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS, EMBEDDING_CACHE_PATH).
+
+    Args:
+        model_key (str): Identifies the embedding backend the vectors come from, see embedding_backend_key.
+
+    Returns:
+        EmbeddingCache: The new cache.
+    """
+    cache = EmbeddingCache(
+        model_key=model_key,
+        max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", 1024)),
+        ttl_seconds=float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 86400)),
+        disk_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+    )
+    logger.info(f"Query embedding cache: {cache.max_size} entries, TTL {cache.ttl_seconds}s, disk tier {cache.disk_path}")
+    return cache
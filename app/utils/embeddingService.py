@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingService:
+    '''
+    Collects concurrent encode requests on a queue and lets a background worker encode them in batches
+    (up to max_batch_size texts or max_wait_ms after the first one arrived) in a thread pool,
+    so the event loop stays free and the model gets the throughput of batched inference.
+    '''
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5, workers: int = 1):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self._queue = None
+        self._worker = None
+        self._batch = None # the requests the worker took off the queue and has not answered yet
+        self._stopped = False
+
+    def start(self):
+        """
+        Starts the batching worker on the running event loop, also after stop.
+        """
+        self._stopped = False
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+            logger.info(f"Embedding service started (batch size {self.max_batch_size}, wait {self.max_wait_ms} ms)")
+
+    async def stop(self):
+        """
+        Stops the batching worker. Requests that are still queued or being encoded fail with a RuntimeError,
+        later requests as well until the service is started again.
+        """
+        self._stopped = True
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        pending = self._batch or []
+        self._batch = None
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Embedding service stopped."))
+
+    async def encode(self, text: str):
+        """
+        Encodes a single text, batched together with other concurrent requests.
+
+        Args:
+            text (str): The text to encode.
+
+        Returns:
+            List[float]: The embedding of the text.
+
+        Raises:
+            RuntimeError: If the service has been stopped.
+        """
+        if self._stopped:
+            raise RuntimeError("Embedding service stopped.")
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def encode_many(self, texts: list):
+        """
+        Encodes a list of texts, e.g. for ingestion, without blocking the event loop.
+
+        Args:
+            texts (List[str]): The texts to encode.
+
+        Returns:
+            List[List[float]]: The embeddings in the order of the texts.
+        """
+        return await asyncio.gather(*(self.encode(text) for text in texts))
+
+    async def encode_batch(self, texts: list):
+        """
+        Encodes a list of texts with a single model.encode call in the thread pool, bypassing the request queue.
+
+        Args:
+            texts (List[str]): The texts to encode.
+
+        Returns:
+            List[List[float]]: The embeddings in the order of the texts.
+        """
+        if not texts:
+            return []
+        vectors = await asyncio.get_running_loop().run_in_executor(self._executor, self.model.encode, list(texts))
+        return [vector.tolist() for vector in vectors]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = self._batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+
+            # Collect more requests until the batch is full or the deadline has passed
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(self._executor, self.model.encode, texts)
+                for (_, future), vector in zip(batch, vectors):
+                    if not future.done():
+                        future.set_result(vector.tolist())
+            except Exception as e:
+                logger.error(f"Error encoding batch of {len(texts)} texts: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self._batch = None
+
+
+def create_embedding_service(model):
+    """
+    Creates the embedding service from the environment (EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS).
+
+    Args:
+        model: The model whose encode method is used.
+
+    Returns:
+        EmbeddingService: The new service, its worker starts with the first request.
+    """
+    return EmbeddingService(
+        model,
+        max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 32)),
+        max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5)),
+    )
@@ -0,0 +1,172 @@
+import contextvars
+import os
+import time
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets in milliseconds, slower stages fall into an overflow bucket
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    '''
+    Counts the durations of a stage in fixed buckets, so quantiles can be estimated without keeping every sample.
+    '''
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, duration_ms: float):
+        self.counts[bisect_left(self.buckets, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def quantile(self, q: float):
+        """
+        Returns the upper bound of the bucket that contains the q-quantile, at most the largest observed duration.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                upper = self.buckets[index] if index < len(self.buckets) else self.max_ms
+                return round(min(upper, self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 2),
+            "buckets": [{"le_ms": bound, "count": count} for bound, count in zip(self.buckets + (None,), self.counts)],
+        }
+
+
+class Span:
+    '''
+    Measures the duration of a with block and reports it to the instrumentation when the block exits.
+    '''
+    __slots__ = ("instrumentation", "name", "start", "duration_ms")
+
+    def __init__(self, instrumentation, name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.duration_ms = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+        self.instrumentation.record(self.name, self.duration_ms)
+        return False
+
+
+class NoopSpan:
+    '''
+    Returned by span while instrumentation is disabled, so a disabled span costs one attribute check.
+    '''
+    __slots__ = ()
+    duration_ms = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Instrumentation:
+    '''
+    Times the stages of a request (encode, metadata prefilter, search, ratings, LLM, history write, ...) with spans.
+    Every duration is added to a per-stage histogram of this worker and to the timings of the current request,
+    which the app sends back in the Server-Timing header.
+    '''
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.histograms = {}
+        self._request_timings = contextvars.ContextVar("request_timings", default=None)
+
+    def span(self, name: str):
+        """
+        Returns a context manager that times its block as the stage name.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name)
+
+    def record(self, name: str, duration_ms: float):
+        """
+        Adds the duration of a stage to its histogram and to the timings of the current request.
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.observe(duration_ms)
+
+        timings = self._request_timings.get()
+        if timings is not None:
+            timings.append((name, duration_ms))
+
+    def start_request(self):
+        """
+        Starts collecting the timings of the current request, tasks started from it afterwards report to it as well.
+        """
+        if self.enabled:
+            self._request_timings.set([])
+
+    def server_timing(self, total_ms: float = None):
+        """
+        Formats the timings of the current request as Server-Timing header value, stages that ran several times
+        are summed up.
+
+        Returns:
+            str: The header value or None if nothing was recorded.
+        """
+        timings = self._request_timings.get()
+        if not timings and total_ms is None:
+            return None
+
+        durations = {}
+        for name, duration_ms in timings or []:
+            durations[name] = durations.get(name, 0) + duration_ms
+        if total_ms is not None:
+            durations["total"] = total_ms
+        return ", ".join(f"{name};dur={duration_ms:.1f}" for name, duration_ms in durations.items())
+
+    def snapshot(self):
+        """
+        Returns the histograms of all stages.
+        """
+        return {
+            "enabled": self.enabled,
+            "stages": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+    def reset(self):
+        self.histograms = {}
+
+
+def create_instrumentation():
+    """
+    Creates the instrumentation from the environment (INSTRUMENTATION_ENABLED, enabled by default).
+    """
+    return Instrumentation(enabled=os.getenv("INSTRUMENTATION_ENABLED", "true").lower() in ("1", "true", "yes"))
+
+
+instrumentation = create_instrumentation()
@@ -0,0 +1,144 @@
+import datetime
+from app.ormModels.linkChange import LinkChange, LinkChangeCompaction
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Change log entries deleted per statement while compacting
+COMPACTION_CHUNK_SIZE = 400
+
+
+class LinkChangesCompacted(Exception):
+    '''
+    Raised when the changes since a version were compacted, the links have to be listed again
+    '''
+
+    def __init__(self, since: int, compacted_version: int):
+        super().__init__(f"The link changes up to version {compacted_version} were compacted, since={since} needs a full listing")
+        self.since = since
+        self.compacted_version = compacted_version
+
+
+async def record_link_change(link_id: str, operation: str):
+    """
+    Appends a change of a link to the change log
+    
+    Args:
+        link_id (str): ID of the metadata point that changed
+        operation (str): "upsert" if it was added or updated, "delete" if it was deleted
+    
+    Returns:
+        int: The version of the change
+    """
+    try:
+        change = await LinkChange.create(link_id=str(link_id), operation=operation)
+        return change.version
+    except Exception as e:
+        raise RuntimeError(f"Failed to record_link_change: {str(e)}")
+
+
+
+async def record_link_changes(link_ids: list, operation: str):
+    """
+    Appends the same change of many links to the change log in one insert
+    
+    Args:
+        link_ids (List[str]): IDs of the metadata points that changed
+        operation (str): "upsert" if they were added or updated, "delete" if they were deleted
+    """
+    if not link_ids:
+        return
+    try:
+        await LinkChange.bulk_create([LinkChange(link_id=str(link_id), operation=operation) for link_id in link_ids])
+    except Exception as e:
+        raise RuntimeError(f"Failed to record_link_changes: {str(e)}")
+
+async def get_links_version():
+    """
+    Gets the version of the latest change, 0 if nothing changed yet
+    
+    Returns:
+        int: The latest version
+    """
+    latest = await LinkChange.all().order_by("-version").first()
+    return max(latest.version if latest else 0, await get_compacted_version())
+
+
+async def get_compacted_version():
+    """
+    Gets the version up to which the change log was compacted, 0 if it never was
+
+    Returns:
+        int: The compacted version
+    """
+    latest = await LinkChangeCompaction.all().order_by("-version").first()
+    return latest.version if latest else 0
+
+
+async def get_link_changes_since(version: int):
+    """
+    Gets the links that changed after a version, only the latest operation of every link counts
+    
+    Args:
+        version (int): The version the client has seen last
+    
+    Returns:
+        Tuple[int, List[str], List[str]]: The latest version, the IDs of the upserted and the IDs of the deleted links
+
+    Raises:
+        LinkChangesCompacted: If changes after the version were compacted away
+    """
+    compacted_version = await get_compacted_version()
+    if version < compacted_version:
+        raise LinkChangesCompacted(version, compacted_version)
+
+    changes = await LinkChange.filter(version__gt=version).order_by("version").values("version", "link_id", "operation")
+    if not changes:
+        return await get_links_version(), [], []
+
+    latest_operations = {}
+    for change in changes:
+        latest_operations[change["link_id"]] = change["operation"]
+
+    upserted = [link_id for link_id, operation in latest_operations.items() if operation == UPSERT]
+    deleted = [link_id for link_id, operation in latest_operations.items() if operation == DELETE]
+    return changes[-1]["version"], upserted, deleted
+
+
+async def compact_link_changes(retention_days: float):
+    """
+    Removes the change log entries older than the retention horizon that are no longer needed: of every link only its
+    latest entry is kept, and deletes older than the horizon are dropped as well. Clients that saw a version before
+    the horizon get LinkChangesCompacted from get_link_changes_since and list all links again
+
+    Args:
+        retention_days (float): How long every change is kept
+
+    Returns:
+        Tuple[int, int]: The version the log was compacted up to (0 if nothing was old enough) and the number of
+        removed entries
+    """
+    horizon = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+    old_changes = await LinkChange.filter(created_at__lt=horizon).order_by("version").values("version", "link_id", "operation")
+    if not old_changes:
+        return 0, 0
+    compacted_version = old_changes[-1]["version"]
+
+    latest_changes = {}
+    for change in old_changes:
+        latest_changes[change["link_id"]] = change
+    changed_since = set(await LinkChange.filter(version__gt=compacted_version).values_list("link_id", flat=True))
+    kept_versions = {
+        change["version"] for link_id, change in latest_changes.items()
+        if change["operation"] == UPSERT and link_id not in changed_since
+    }
+
+    removed_versions = [change["version"] for change in old_changes if change["version"] not in kept_versions]
+    try:
+        # The compaction is recorded first, so no client reads a delta with entries already missing
+        await LinkChangeCompaction.create(version=compacted_version, deleted=len(removed_versions))
+        for start in range(0, len(removed_versions), COMPACTION_CHUNK_SIZE):
+            await LinkChange.filter(version__in=removed_versions[start:start + COMPACTION_CHUNK_SIZE]).delete()
+    except Exception as e:
+        raise RuntimeError(f"Failed to compact_link_changes: {str(e)}")
+    return compacted_version, len(removed_versions)
@@ -0,0 +1,79 @@
+import asyncio
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str):
+    """
+    Normalizes a URL so that different spellings of the same link are equal: surrounding whitespace, the case of the
+    scheme and host, default ports and the fragment are dropped. Path and query are kept as they are, since servers
+    may treat them case or slash sensitive.
+
+    Args:
+        url (str): The URL as submitted.
+
+    Returns:
+        str: The normalized URL, the stripped input if it can not be parsed.
+    """
+    url = (url or "").strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.hostname:
+        return url
+
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname.lower()
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{port}"
+    if parts.username or parts.password:
+        credentials = parts.username or ""
+        if parts.password:
+            credentials += ":" + parts.password
+        netloc = credentials + "@" + netloc
+
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+class SingleFlight:
+    '''
+    Runs a coroutine at most once per key at a time: callers that arrive while it is running wait for the same
+    result instead of starting it again.
+    '''
+
+    def __init__(self):
+        self._in_flight = {}
+
+    async def run(self, key, function):
+        """
+        Runs function() unless it is already running for the key.
+
+        Args:
+            key: The key to de-duplicate on.
+            function (callable): Returns the coroutine to run.
+
+        Returns:
+            Tuple[Any, bool]: The result and whether it was shared with a call that was already running.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            # Shielded, so a caller that disconnects does not cancel the run of the others
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(function())
+        self._in_flight[key] = task
+        try:
+            return await asyncio.shield(task), False
+        finally:
+            if task.done():
+                self._in_flight.pop(key, None)
+            else:
+                task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+    def __len__(self):
+        return len(self._in_flight)
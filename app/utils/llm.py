@@ -1,11 +1,18 @@
 import os
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
+from app.utils.contextBuilder import create_context_builder
+from app.utils.instrumentation import instrumentation
+import logging
 
+logger = logging.getLogger(__name__)
+
+LLM_MODEL_NAME = "gpt-4o-mini-2024-07-18"
 openai_key = os.getenv("OPENAI_KEY")
-llm_model = ChatOpenAI(model="gpt-4o-mini-2024-07-18", temperature=0.7, openai_api_key=openai_key)
+llm_model = ChatOpenAI(model=LLM_MODEL_NAME, temperature=0.7, openai_api_key=openai_key)
+context_builder = create_context_builder(LLM_MODEL_NAME)
 
 # Template for the LLM prompt
 prompt_template = PromptTemplate(
@@ -25,6 +32,31 @@ prompt_template = PromptTemplate(
 )
 
 
+def build_context(query: str, retrieved_docs: List[Dict]) -> str:
+    """
+    Create the context for the prompt from the retrieved documents within the token budget of the context builder.
+    
+    Args:
+        query (str): The query text.
+        retrieved_docs (List[Dict]): A list of documents retrieved from the database.
+        
+    Returns:
+        str: The numbered list of sources, summaries and chunks.
+    """
+    with instrumentation.span("context"):
+        context, report = context_builder.build(retrieved_docs)
+    report["prompt_tokens"] = context_builder.count_tokens(prompt_template.format(context=context, question=query))
+    logger.info(f"LLM context: {report}")
+    return context
+
+
+def create_chain():
+    """
+    Create the chain using the pipe operator. The model is looked up on every call so it can be swapped, e.g. for a fake LLM in benchmarks.
+    """
+    return prompt_template | llm_model | StrOutputParser()
+
+
 async def generate_response_from_retrieved_documents(
     query: str,
     retrieved_docs: List[Dict],
@@ -39,18 +71,34 @@ async def generate_response_from_retrieved_documents(
     Returns:
         str: The generated response.
     """
-    # Initialize the OpenAI model
+    chain = create_chain()
+    
+    # Generate the response without blocking the event loop while waiting for the model
+    context = build_context(query, retrieved_docs)
+    with instrumentation.span("llm"):
+        response = await chain.ainvoke({"context": context, "question": query})
+
+    return response
 
-    # Create the context from retrieved documents
-    context = "\n".join(
-        [f"{i+1}. [Quelle]: {doc['metadata'].get('url', 'No URL available')}\n [Summary]: {doc['metadata'].get('summary', 'No text available')}\n [Relevant chunk]: {doc['chunk']}\n\n" 
-         for i, doc in enumerate(retrieved_docs)]
-    )
 
-    # Create the chain using the pipe operator
-    chain = prompt_template | llm_model | StrOutputParser() 
+async def stream_response_from_retrieved_documents(
+    query: str,
+    retrieved_docs: List[Dict],
+) -> AsyncIterator[str]:
+    """
+    Generate a response based on the retrieved documents and query, token by token.
     
-    # Generate the response
-    response = chain.invoke({"context": context, "question": query})
+    Args:
+        query (str): The query text.
+        retrieved_docs (List[Dict]): A list of documents retrieved from the database.
+        
+    Yields:
+        str: The next part of the generated response.
+    """
+    chain = create_chain()
 
-    return response
+    context = build_context(query, retrieved_docs)
+    with instrumentation.span("llm"):
+        async for chunk in chain.astream({"context": context, "question": query}):
+            if chunk:
+                yield chunk
@@ -0,0 +1,329 @@
+import logging
+import math
+import time
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+from app.utils.linkIngestion import normalize_url
+from app.utils.linkChangeHandler import LinkChangesCompacted
+
+logger = logging.getLogger(__name__)
+
+MIRROR_PAGE_SIZE = 1000
+MIN_CAPACITY = 64 # the arrays grow by doubling, so adding a point is amortized O(1)
+
+
+def to_float(value):
+    """
+    Converts a payload value into a float, missing or non-numeric values become NaN (they never match a range).
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return value
+
+
+class MetadataMirror:
+    '''
+    In-process copy of the filterable fields of the metadata collection (ids, link_type, the score columns and the
+    average rating) as NumPy arrays, so the metadata filters of a query are evaluated as vectorized masks instead of
+    scrolling Qdrant. It also indexes the normalized URLs, so link ingestion can skip known URLs without a lookup.
+    Changes made through this worker are applied directly. Changes made elsewhere (other workers, the scraping worker)
+    are picked up by refresh: it applies the links changed in the link change log since the version it has seen and
+    reloads if the number of points still differs (links written without a change log entry), the changes since its
+    version were compacted or the mirror is older than max_age_seconds.
+    '''
+
+    def __init__(self, collection_name: str, score_fields: list, rating_field: str, max_age_seconds: float = 300,
+                 links_version=None, link_changes_since=None):
+        self.collection_name = collection_name
+        self.score_fields = list(score_fields)
+        self.rating_field = rating_field
+        self.max_age_seconds = max_age_seconds
+        # Coroutine functions of the link change log, without them refresh only compares the number of points
+        self.links_version = links_version
+        self.link_changes_since = link_changes_since
+        self.loaded = False
+        self.loaded_at = None
+        self.version = None # the change log version the mirror is up to date with
+        self.points_count = 0 # number of points Qdrant should have according to the mirror
+        self._pending_changes = None # changes applied while a load is in progress, replayed after it
+        self._set_rows([])
+
+    def covers(self, collection_name: str):
+        """
+        Returns whether filters on the collection can be evaluated by the mirror.
+        """
+        return self.loaded and collection_name == self.collection_name
+
+    async def load(self, client: AsyncQdrantClient):
+        """
+        Reads the filterable fields of all points of the collection and replaces the mirror with them.
+
+        Returns:
+            int: The number of mirrored points.
+        """
+        start = time.perf_counter()
+        self._pending_changes = []
+        try:
+            # Read before the points, changes made during the scroll are applied again by the next refresh
+            version = await self.links_version() if self.links_version else None
+            rows = []
+            offset = None
+            while True:
+                records, offset = await client.scroll(
+                    collection_name=self.collection_name,
+                    limit=MIRROR_PAGE_SIZE,
+                    offset=offset,
+                    with_payload=self._payload_fields(),
+                    with_vectors=False,
+                )
+                rows.extend(self._to_row(record.id, (record.payload or {}).get("metadata", {})) for record in records)
+                if offset is None:
+                    break
+
+            self._set_rows(rows)
+            self.points_count = len(rows)
+            self.version = version
+            self.loaded = True
+            self.loaded_at = time.time()
+        finally:
+            pending_changes, self._pending_changes = self._pending_changes, None
+
+        for change, args in pending_changes:
+            change(*args)
+
+        logger.info(f"Loaded metadata mirror of {self.collection_name} with {len(rows)} points in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return len(rows)
+
+    async def refresh(self, client: AsyncQdrantClient, force: bool = False):
+        """
+        Applies the changes of the link change log and reloads the mirror if it is not loaded yet, forced, too old or
+        the number of points in Qdrant still differs.
+
+        Returns:
+            bool: Whether the mirror was reloaded.
+        """
+        if self.loaded and not force and time.time() - self.loaded_at < self.max_age_seconds:
+            if self.link_changes_since and self.version is not None:
+                try:
+                    version, upserted, deleted = await self.link_changes_since(self.version)
+                except LinkChangesCompacted:
+                    await self.load(client)
+                    return True
+                await self.apply_changes(client, upserted, deleted)
+                self.version = max(self.version, version)
+
+            count_result = await client.count(collection_name=self.collection_name, exact=True)
+            if count_result.count == self.points_count:
+                return False
+
+        await self.load(client)
+        return True
+
+    async def apply_changes(self, client: AsyncQdrantClient, upserted: list, deleted: list):
+        """
+        Reads the current fields of the upserted links with one retrieve and removes the deleted ones.
+
+        Returns:
+            int: The number of changed links.
+        """
+        if upserted:
+            records = await client.retrieve(
+                collection_name=self.collection_name,
+                ids=list(upserted),
+                with_payload=self._payload_fields(),
+                with_vectors=False,
+            )
+            found = set()
+            for record in records:
+                found.add(str(record.id))
+                self.upsert(record.id, (record.payload or {}).get("metadata", {}))
+            # Upserted and deleted again since
+            for point_id in upserted:
+                if str(point_id) not in found:
+                    self.remove(point_id)
+
+        for point_id in deleted:
+            self.remove(point_id)
+        return len(upserted) + len(deleted)
+
+    def upsert(self, point_id: str, metadata: dict):
+        """
+        Adds a point or replaces its fields after its metadata was written to Qdrant.
+        """
+        if self._pending_changes is not None:
+            self._pending_changes.append((self.upsert, (point_id, metadata)))
+        if not self.loaded:
+            return
+
+        row = self._to_row(point_id, metadata)
+        index = self._index.get(row["id"])
+        if index is None:
+            self._append(row)
+            self.points_count += 1
+            return
+
+        self._unindex_url(index)
+        self.urls[index] = row["url"]
+        self._index_url(index)
+        self.link_type_codes[index] = self._link_type_code(row["link_type"])
+        for field in self.score_fields:
+            self.scores[field][index] = row[field]
+        self.ratings[index] = row[self.rating_field]
+
+    def remove(self, point_id: str):
+        """
+        Removes a point after it was deleted from Qdrant.
+        """
+        if self._pending_changes is not None:
+            self._pending_changes.append((self.remove, (point_id,)))
+
+        index = self._index.pop(str(point_id), None)
+        if index is not None and self.alive[index]:
+            self._unindex_url(index)
+            self.alive[index] = False
+            self.points_count -= 1
+
+    def set_rating(self, point_id: str, average_rating: float):
+        """
+        Updates the average rating of a point after it was written to its payload.
+        """
+        if self._pending_changes is not None:
+            self._pending_changes.append((self.set_rating, (point_id, average_rating)))
+
+        index = self._index.get(str(point_id))
+        if index is not None:
+            self.ratings[index] = to_float(average_rating)
+
+    def ids_for_url(self, url: str):
+        """
+        Returns the ids of the points whose URL normalizes to the same URL.
+        """
+        return list(self._url_ids.get(normalize_url(url), ()))
+
+    def filter_ids(self, resolved_filters: dict):
+        """
+        Evaluates the metadata filters of a query like the Qdrant filter built in quadrant.resolve_chunk_filter.
+
+        Args:
+            resolved_filters (dict): The filters as returned by quadrant.resolve_filters.
+
+        Returns:
+            List[str]: The ids of the matching metadata points.
+        """
+        mask = self.alive.copy()
+
+        link_types = resolved_filters["link_types"]
+        if link_types:
+            codes = [self._link_type_codes[link_type] for link_type in link_types if link_type in self._link_type_codes]
+            mask &= np.isin(self.link_type_codes, codes)
+
+        for category, range_values in resolved_filters["category_filters"].items():
+            if range_values != [0, 100]:
+                values = self.scores.get(category)
+                if values is None:
+                    # A field that is not mirrored can not match a range
+                    return []
+                mask &= (values >= range_values[0]) & (values <= range_values[1])
+
+        # Documents without ratings always pass the rating filter
+        general_rating = resolved_filters["general_rating"]
+        if general_rating != [0, 5]:
+            mask &= np.isnan(self.ratings) | ((self.ratings >= general_rating[0]) & (self.ratings <= general_rating[1]))
+
+        return self.ids[mask].tolist()
+
+    def stats(self):
+        """
+        Returns the size and age of the mirror.
+        """
+        return {
+            "collection_name": self.collection_name,
+            "loaded": self.loaded,
+            "points": int(self.alive.sum()),
+            "urls": len(self._url_ids),
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+        }
+
+    def _payload_fields(self):
+        return ["metadata.url", "metadata.link_type", "metadata." + self.rating_field] + ["metadata." + field for field in self.score_fields]
+
+    def _to_row(self, point_id, metadata: dict):
+        link_type = metadata.get("link_type")
+        url = metadata.get("url")
+        return {
+            "id": str(point_id),
+            "url": normalize_url(url) if isinstance(url, str) and url else None,
+            "link_type": link_type if isinstance(link_type, str) else None,
+            **{field: to_float(metadata.get(field)) for field in self.score_fields},
+            self.rating_field: to_float(metadata.get(self.rating_field)),
+        }
+
+    def _rows(self):
+        link_types = {code: link_type for link_type, code in self._link_type_codes.items()}
+        return [
+            {
+                "id": self.ids[index],
+                "url": self.urls[index],
+                "link_type": link_types.get(int(self.link_type_codes[index])),
+                **{field: float(self.scores[field][index]) for field in self.score_fields},
+                self.rating_field: float(self.ratings[index]),
+            }
+            for index in range(self._size) if self.alive[index]
+        ]
+
+    def _set_rows(self, rows: list):
+        self._link_type_codes = {} # link_type -> integer code, -1 for points without link_type
+        self.ids = np.array([row["id"] for row in rows], dtype=object)
+        self.urls = [row["url"] for row in rows]
+        self.link_type_codes = np.array([self._link_type_code(row["link_type"]) for row in rows], dtype=np.int32)
+        self.scores = {field: np.array([row[field] for row in rows], dtype=np.float64) for field in self.score_fields}
+        self.ratings = np.array([row[self.rating_field] for row in rows], dtype=np.float64)
+        self.alive = np.ones(len(rows), dtype=bool)
+        self._size = len(rows) # used rows, the arrays may be longer
+        self._index = {row["id"]: index for index, row in enumerate(rows)}
+        self._url_ids = {} # normalized url -> ids of its points
+        for index in range(len(rows)):
+            self._index_url(index)
+
+    def _append(self, row: dict):
+        if self._size == len(self.ids):
+            self._grow(max(MIN_CAPACITY, 2 * len(self.ids)))
+
+        index = self._size
+        self._size += 1
+        self.ids[index] = row["id"]
+        self.urls.append(row["url"])
+        self.link_type_codes[index] = self._link_type_code(row["link_type"])
+        for field in self.score_fields:
+            self.scores[field][index] = row[field]
+        self.ratings[index] = row[self.rating_field]
+        self.alive[index] = True
+        self._index[row["id"]] = index
+        self._index_url(index)
+
+    def _grow(self, capacity: int):
+        # Unused rows are not alive, so filter_ids never returns them
+        extra = capacity - len(self.ids)
+        self.ids = np.concatenate([self.ids, np.full(extra, None, dtype=object)])
+        self.link_type_codes = np.concatenate([self.link_type_codes, np.full(extra, -1, dtype=np.int32)])
+        self.scores = {field: np.concatenate([values, np.full(extra, np.nan)]) for field, values in self.scores.items()}
+        self.ratings = np.concatenate([self.ratings, np.full(extra, np.nan)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def _index_url(self, index: int):
+        if self.urls[index]:
+            self._url_ids.setdefault(self.urls[index], set()).add(self.ids[index])
+
+    def _unindex_url(self, index: int):
+        ids = self._url_ids.get(self.urls[index])
+        if ids is not None:
+            ids.discard(self.ids[index])
+            if not ids:
+                del self._url_ids[self.urls[index]]
+
+    def _link_type_code(self, link_type: str):
+        if link_type is None:
+            return -1
+        return self._link_type_codes.setdefault(link_type, len(self._link_type_codes))
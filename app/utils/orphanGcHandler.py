@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import os
+import socket
+import uuid
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+from app.ormModels.orphanGcJob import OrphanGcJob
+from app.utils.quadrant import delete_orphan_chunks
+
+ORPHAN_CHUNKS = "orphan_chunks"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+# Renewed after every batch, a batch scrolls and checks at most 1000 chunks
+ORPHAN_GC_LEASE_SECONDS = 300
+
+owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+orphan_gc_tasks = set()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _lease_end():
+    return _now() + datetime.timedelta(seconds=ORPHAN_GC_LEASE_SECONDS)
+
+
+def orphan_gc_job_to_dict(job: OrphanGcJob):
+    """
+    Converts the orphan chunk collection into the JSON returned by /api/links/gc
+    """
+    return {
+        "status": job.status,
+        "dry_run": job.dry_run,
+        "scanned": job.scanned,
+        "orphans": job.orphans,
+        "deleted": job.deleted,
+        "error": job.error,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+async def get_orphan_gc_job():
+    """
+    Returns the state of the last orphan chunk collection of any worker
+
+    Returns:
+        OrphanGcJob: The job, with status 'idle' if none ran yet
+    """
+    job = await OrphanGcJob.get_or_none(name=ORPHAN_CHUNKS)
+    return job or OrphanGcJob(name=ORPHAN_CHUNKS)
+
+
+async def claim_orphan_gc(batch_size: int, dry_run: bool):
+    """
+    Claims the orphan chunk collection for this process with a conditional update, unless it is running in a worker
+    whose lease has not expired
+
+    Args:
+        batch_size (int): Chunks scanned per batch
+        dry_run (bool): Only count the orphaned chunks
+
+    Returns:
+        bool: True if this process claimed the collection
+    """
+    try:
+        await OrphanGcJob.get_or_create(name=ORPHAN_CHUNKS)
+    except IntegrityError:
+        pass # created by another worker at the same time
+
+    now = _now()
+    claimed = await OrphanGcJob.filter(
+        ~Q(status=RUNNING) | Q(lease_until__isnull=True) | Q(lease_until__lt=now), name=ORPHAN_CHUNKS,
+    ).update(
+        status=RUNNING, dry_run=dry_run, batch_size=batch_size, scanned=0, orphans=0, deleted=0, error=None,
+        owner=owner, lease_until=_lease_end(), started_at=now, finished_at=None,
+    )
+    return claimed == 1
+
+
+async def run_orphan_gc(collection_chunk_name: str, collection_metadata_name: str, batch_size: int, dry_run: bool):
+    """
+    Runs a claimed orphan chunk collection and writes its progress after every batch
+    """
+    async def report(stats):
+        await OrphanGcJob.filter(name=ORPHAN_CHUNKS, owner=owner).update(lease_until=_lease_end(), **stats)
+
+    try:
+        stats = await delete_orphan_chunks(collection_chunk_name, collection_metadata_name, batch_size, dry_run, progress=report)
+        await OrphanGcJob.filter(name=ORPHAN_CHUNKS, owner=owner).update(status=FINISHED, finished_at=_now(), lease_until=None, **stats)
+    except Exception as e:
+        print(f"Orphan chunk collection failed: {e}")
+        await OrphanGcJob.filter(name=ORPHAN_CHUNKS, owner=owner).update(status=FAILED, error=str(e), finished_at=_now(), lease_until=None)
+
+
+async def start_orphan_gc(collection_chunk_name: str, collection_metadata_name: str, batch_size: int, dry_run: bool):
+    """
+    Starts the orphan chunk collection in the background, unless it is already running in any worker
+
+    Returns:
+        bool: True if the collection was started
+    """
+    if not await claim_orphan_gc(batch_size, dry_run):
+        return False
+
+    task = asyncio.create_task(run_orphan_gc(collection_chunk_name, collection_metadata_name, batch_size, dry_run))
+    orphan_gc_tasks.add(task)
+    task.add_done_callback(orphan_gc_tasks.discard)
+    return True
@@ -1,14 +1,26 @@
-from app.ormModels.points import UserPoints
-from tortoise.exceptions import DoesNotExist
+from app.ormModels.points import PointGrant, UserPoints
+from tortoise.exceptions import DoesNotExist, IntegrityError
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
 from quart import current_app
+from app.utils.writeBehind import write_behind
 
-async def grant_points(user_id, points):
+POINT_GRANTS = "point_grants"
+
+# Dialects that add to an existing balance with INSERT ... ON CONFLICT DO UPDATE, others fall back to UPDATE + INSERT
+UPSERT_DIALECTS = ("sqlite", "postgres")
+# Users per upsert statement, two bound variables each stay below SQLite's limit of 999 on older builds
+UPSERT_CHUNK_SIZE = 400
+
+
+async def grant_points(user_id, points, reason=""):
     """
     Grants points to the user.
     
     Args:
         user_id (str): The ID of the user.
         points (int): The number of points to grant to the user.
+        reason (str): Why the points were granted, stored in the point ledger.
 
     Returns:
         int: The updated points of the user after the operation.
@@ -16,19 +28,79 @@ async def grant_points(user_id, points):
     Raises:
         Exception: If there is any issue while updating or creating user points.
     """
-    try:
-        user_points, created = await UserPoints.get_or_create(user_id=user_id, defaults={'points': 0})
-        
-        if not created:
-            user_points.points += points    
-        await user_points.save() 
-        return user_points.points
+    await grant_points_bulk([{"user_id": user_id, "points": points, "reason": reason}])
+    user_points = await UserPoints.get(user_id=user_id)
+    return user_points.points
+
+
+async def grant_points_bulk(grants: list):
+    """
+    Grants the points of many grants in one transaction: every grant is added to the point ledger and the balances
+    are increased in the database (points = points + n), so concurrent grants never overwrite each other.
     
+    Args:
+        grants (list): Dicts with user_id, points and an optional reason
+    """
+    points_by_user = {}
+    for grant in grants:
+        points_by_user[grant["user_id"]] = points_by_user.get(grant["user_id"], 0) + grant["points"]
+
+    try:
+        async with in_transaction() as connection:
+            await PointGrant.bulk_create(
+                [PointGrant(user_id=grant["user_id"], points=grant["points"], reason=grant.get("reason") or "") for grant in grants],
+                using_db=connection,
+            )
+            await _add_to_balances(connection, points_by_user)
     except Exception as e:
         print(f"Error granting points: {e}")
         raise
 
 
+async def _add_to_balances(connection, points_by_user: dict):
+    if not points_by_user:
+        return
+
+    dialect = connection.capabilities.dialect
+    if dialect in UPSERT_DIALECTS:
+        # One statement per UPSERT_CHUNK_SIZE users, a missing balance is created with the granted points
+        table = UserPoints._meta.db_table
+        balances = list(points_by_user.items())
+        for start in range(0, len(balances), UPSERT_CHUNK_SIZE):
+            chunk = balances[start:start + UPSERT_CHUNK_SIZE]
+            placeholders = ", ".join(
+                "(?, ?)" if dialect == "sqlite" else f"(${2 * index + 1}, ${2 * index + 2})"
+                for index in range(len(chunk))
+            )
+            await connection.execute_query(
+                f'INSERT INTO "{table}" ("user_id", "points") VALUES {placeholders} '
+                f'ON CONFLICT ("user_id") DO UPDATE SET "points" = "{table}"."points" + excluded."points"',
+                [value for user_id, points in chunk for value in (user_id, points)],
+            )
+        return
+
+    for user_id, points in points_by_user.items():
+        updated = await UserPoints.filter(user_id=user_id).using_db(connection).update(points=F("points") + points)
+        if not updated:
+            try:
+                await UserPoints.create(user_id=user_id, points=points, using_db=connection)
+            except IntegrityError:
+                # A concurrent first grant created the balance in the meantime
+                await UserPoints.filter(user_id=user_id).using_db(connection).update(points=F("points") + points)
+
+
+async def queue_grant_points(user_id, points, reason=""):
+    """
+    Grants points to the user in the background, the caller does not wait for the write.
+    
+    Args:
+        user_id (str): The ID of the user.
+        points (int): The number of points to grant to the user.
+        reason (str): Why the points were granted, stored in the point ledger.
+    """
+    await write_behind.submit(POINT_GRANTS, {"user_id": user_id, "points": points, "reason": reason})
+
+
 async def get_points(user_id):
     """
     Retrieves the points of the user from the database.
@@ -42,12 +114,15 @@ async def get_points(user_id):
     Raises:
         Exception: If there is an issue during the database query.
     """
+    # Grants that are still queued count already
+    pending_points = sum(grant["points"] for grant in write_behind.pending(POINT_GRANTS) if grant["user_id"] == user_id)
+
     try:
         user_points = await UserPoints.get(user_id=user_id)
-        return user_points.points 
+        return user_points.points + pending_points
     
     except DoesNotExist:
-        return 0
+        return pending_points
     
     except Exception as e:
         print(f"Error getting points: {e}")
@@ -83,4 +158,7 @@ def get_customer_tier(points):
     except KeyError:
         # If the TIERS config is missing, raise an error
         print("Error: TIERS configuration is missing or invalid.")
-        raise
\ No newline at end of file
+        raise
+
+
+write_behind.register(POINT_GRANTS, grant_points_bulk)
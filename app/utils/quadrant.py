@@ -1,26 +1,172 @@
-import numpy as np
 import logging
-from qdrant_client import QdrantClient
-from sentence_transformers import SentenceTransformer
-from qdrant_client.models import PointStruct, PointIdsList, Filter, FieldCondition, MatchValue, FilterSelector
-from app.utils.ratingHandler import getDocumentRating
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    PointIdsList, Filter, FieldCondition, MatchValue, MatchAny, FilterSelector, QueryRequest,
+    HasIdCondition, IsEmptyCondition, PayloadField
+)
+from app.utils.ratingHandler import getCachedDocumentRatings, getDocumentRatings
+from app.utils.embeddingBackend import create_embedding_backend, embedding_backend_key
+from app.utils.embeddingCache import create_embedding_cache
+from app.utils.embeddingService import create_embedding_service
+from app.utils.metadataMirror import MetadataMirror
+from app.utils.linkChangeHandler import get_links_version, get_link_changes_since
+from app.utils.linkIngestion import normalize_url
+from app.utils.instrumentation import instrumentation
+from app.utils.collectionSetup import SCORE_FIELDS
+import asyncio
+import base64
+import json
 import os
+import time
+import uuid
 
 # Configure Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 GROUP_BY_PARAMETER = "url"
+RATING_PAYLOAD_KEY = "avg_rating" # Key inside the metadata payload that mirrors the average user rating
+REVISION_PAYLOAD_KEY = "revision" # Key inside the metadata payload that changes with every update, for optimistic version checks
+SCROLL_PAGE_SIZE = 1000
+BATCH_GROUP_OVERSAMPLING = 4 # Batch searches fetch this many chunks per requested group to group them client-side
 
-# Load the connection to QDrant and the Model used for vectoring
+MODEL_NAME = os.getenv("MODEL_NAME", "Alibaba-NLP/gte-multilingual-base")
+
+# Load the Model used for vectoring with the backend selected by EMBEDDING_BACKEND
 try:
-    model = SentenceTransformer(os.getenv("MODEL_NAME", "Alibaba-NLP/gte-multilingual-base"), trust_remote_code=True)
-    qdrant_client = QdrantClient(host=os.getenv("QDRANT_HOST", "localhost"), port=int(os.getenv("QDRANT_PORT", 6333)))
-    logger.info(f"Successfully loaded QDrant and SentenceTransformer")
+    model = create_embedding_backend(MODEL_NAME)
+    logger.info(f"Successfully loaded embedding model")
 except Exception as e:
-    logger.error(f"Error loading QDrant or SentenceTransformer: {e}")
+    logger.error(f"Error loading embedding model: {e}")
     raise e
 
+# Encodes concurrent queries in batches off the event loop
+embedding_service = create_embedding_service(model)
+
+# Users repeat their questions a lot, so query vectors are cached instead of encoded again
+embedding_cache = create_embedding_cache(embedding_backend_key(MODEL_NAME))
+
+# The connection to QDrant, shared by all requests of a worker. Created in before_serving, closed in after_serving
+qdrant_client = None
+
+# Filterable fields of the metadata collection, so query filters are evaluated in-process. Loaded in before_serving
+metadata_mirror = MetadataMirror(
+    os.getenv("COLLECTION_METADATA", "metadata_collection"),
+    SCORE_FIELDS,
+    RATING_PAYLOAD_KEY,
+    max_age_seconds=float(os.getenv("METADATA_MIRROR_MAX_AGE_SECONDS", 300)),
+    links_version=get_links_version,
+    link_changes_since=get_link_changes_since,
+)
+
+
+def create_qdrant_client(location: str = None):
+    """
+    Creates an async Qdrant client from the environment (QDRANT_HOST, QDRANT_PORT, QDRANT_GRPC_PORT, QDRANT_PREFER_GRPC).
+    
+    Args:
+        location (str, optional): ':memory:' or a URL that overrides the environment, e.g. for benchmarks.
+    
+    Returns:
+        AsyncQdrantClient: The new client.
+    """
+    if location:
+        return AsyncQdrantClient(location=location)
+
+    return AsyncQdrantClient(
+        host=os.getenv("QDRANT_HOST", "localhost"),
+        port=int(os.getenv("QDRANT_PORT", 6333)),
+        grpc_port=int(os.getenv("QDRANT_GRPC_PORT", 6334)),
+        prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true",
+    )
+
+
+async def init_qdrant_client(location: str = None):
+    """
+    Creates the shared Qdrant client used by all functions in this module.
+    
+    Args:
+        location (str, optional): ':memory:' or a URL that overrides the environment.
+    """
+    global qdrant_client
+    qdrant_client = create_qdrant_client(location)
+    logger.info(f"Successfully connected QDrant client")
+
+
+async def close_qdrant_client():
+    """
+    Closes the shared Qdrant client.
+    """
+    global qdrant_client
+    if qdrant_client is not None:
+        await qdrant_client.close()
+        qdrant_client = None
+
+
+
+
+async def refresh_metadata_mirror(force: bool = False):
+    """
+    Loads the metadata mirror or reloads it if the metadata collection changed outside of this worker.
+    
+    Args:
+        force (bool): Whether to reload even if the number of points did not change.
+        
+    Returns:
+        bool: Whether the mirror was reloaded.
+    """
+    return await metadata_mirror.refresh(qdrant_client, force=force)
+
+
+async def refresh_metadata_mirror_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_metadata_mirror()
+        except Exception as e:
+            logger.error(f"Error refreshing the metadata mirror: {e}")
+
+
+async def encode_query(query_text: str):
+    """
+    Encodes a query into a vector, served from the embedding cache if the query has been encoded before.
+    
+    Args:
+        query_text (str): The query string that will be encoded.
+        
+    Returns:
+        List[float]: The embedding of the query.
+    """
+    query_vector = await embedding_cache.get(query_text)
+    if query_vector is None:
+        logger.info(f"Encoding query text: {query_text}")
+        with instrumentation.span("encode"):
+            query_vector = await embedding_service.encode(query_text)
+        embedding_cache.put(query_text, query_vector)
+    return query_vector
+
+
+async def encode_queries(query_texts: list):
+    """
+    Encodes several queries, the ones missing in the embedding cache with a single model.encode batch.
+    
+    Args:
+        query_texts (List[str]): The query strings that will be encoded.
+        
+    Returns:
+        List[List[float]]: The embeddings in the order of the queries.
+    """
+    query_vectors = [await embedding_cache.get(query_text) for query_text in query_texts]
+    missing_texts = list(dict.fromkeys(query_text for query_text, query_vector in zip(query_texts, query_vectors) if query_vector is None))
+
+    if missing_texts:
+        logger.info(f"Encoding {len(missing_texts)} query texts in one batch")
+        with instrumentation.span("encode"):
+            encoded = dict(zip(missing_texts, await embedding_service.encode_batch(missing_texts)))
+        for query_text, query_vector in encoded.items():
+            embedding_cache.put(query_text, query_vector)
+        query_vectors = [query_vector if query_vector is not None else encoded[query_text] for query_text, query_vector in zip(query_texts, query_vectors)]
 
+    return query_vectors
 
 
 def format_and_validate_data(data: dict):
@@ -56,39 +202,302 @@ def format_and_validate_data(data: dict):
     return validated_data
 
 
-async def update_qdrant_entry(collection_name: str, point_id: str, new_data: dict):
+class VersionConflictError(ValueError):
+    """
+    Raised if a point was changed since the version an update expects.
+    """
+
+
+async def update_qdrant_entries(collection_name: str, updates: list):
+    """
+    Updates the metadata of many entries in Qdrant without touching their vectors. The new data is merged into the
+    existing metadata payload, updates of several points with the same data need a single payload write.
+    
+    Every update gives the point a new revision (metadata.revision). An update that contains 'expected_version' is only
+    applied if the revision of the point still equals it (None for points that were never updated). It is written with
+    a filter on the revision, so the check and the write happen atomically in Qdrant.
+    
+    Args:
+        collection_name (str): The name of the collection to update the points in.
+        updates (List[dict]): The updates, each with the 'id' of the point, the 'data' to merge into its metadata and
+                              optionally the 'expected_version'.
+        
+    Returns:
+        List[dict]: For every update the 'id', the 'status' ('updated', 'conflict' or 'not_found') and the current 'version'.
+        
+    Raises:
+        Exception: If an error occurs while updating the points.
+    """
+    point_ids = list(dict.fromkeys(str(update["id"]) for update in updates))
+    existing_payloads = {}
+    for start in range(0, len(point_ids), SCROLL_PAGE_SIZE):
+        records = await qdrant_client.retrieve(
+            collection_name=collection_name,
+            ids=point_ids[start:start + SCROLL_PAGE_SIZE],
+            with_payload=True,
+            with_vectors=False,
+        )
+        existing_payloads.update({str(record.id): record.payload.get("metadata", {}) for record in records})
+
+    results = {}
+    applied_data = {}
+    unchecked = {} # canonical data -> (data, point ids)
+    checked = [] # (point id, data, expected version)
+
+    for update in updates:
+        point_id = str(update["id"])
+        # The revision is managed here, clients can not overwrite it
+        data = {key: value for key, value in update.get("data", {}).items() if key != REVISION_PAYLOAD_KEY}
+
+        if point_id not in existing_payloads:
+            results[point_id] = {"id": point_id, "status": "not_found", "version": None}
+        elif "expected_version" in update:
+            checked.append((point_id, data, update["expected_version"]))
+        else:
+            unchecked.setdefault(json.dumps(data, sort_keys=True), (data, []))[1].append(point_id)
+
+    # Updates without version check, all points with the same data share one write and one new revision
+    for data, group_ids in unchecked.values():
+        revision = uuid.uuid4().hex
+        await qdrant_client.set_payload(
+            collection_name=collection_name,
+            payload={**data, REVISION_PAYLOAD_KEY: revision},
+            points=group_ids,
+            key="metadata",
+        )
+        for point_id in group_ids:
+            results[point_id] = {"id": point_id, "status": "updated", "version": revision}
+            applied_data[point_id] = data
+
+    # Updates with version check only match the point while it still has the expected revision
+    if checked:
+        new_revisions = {}
+        for point_id, data, expected_version in checked:
+            if expected_version is None:
+                revision_condition = IsEmptyCondition(is_empty=PayloadField(key="metadata." + REVISION_PAYLOAD_KEY))
+            else:
+                revision_condition = FieldCondition(key="metadata." + REVISION_PAYLOAD_KEY, match=MatchValue(value=expected_version))
+
+            new_revisions[point_id] = uuid.uuid4().hex
+            await qdrant_client.set_payload(
+                collection_name=collection_name,
+                payload={**data, REVISION_PAYLOAD_KEY: new_revisions[point_id]},
+                points=Filter(must=[HasIdCondition(has_id=[point_id]), revision_condition]),
+                key="metadata",
+            )
+
+        # The point carries the new revision if and only if this write won
+        records = await qdrant_client.retrieve(
+            collection_name=collection_name,
+            ids=list(new_revisions),
+            with_payload=["metadata." + REVISION_PAYLOAD_KEY],
+            with_vectors=False,
+        )
+        stored_revisions = {str(record.id): record.payload.get("metadata", {}).get(REVISION_PAYLOAD_KEY) for record in records}
+
+        for point_id, data, _ in checked:
+            if point_id not in stored_revisions:
+                # Deleted since the first retrieve
+                results[point_id] = {"id": point_id, "status": "not_found", "version": None}
+            elif stored_revisions.get(point_id) == new_revisions[point_id]:
+                results[point_id] = {"id": point_id, "status": "updated", "version": new_revisions[point_id]}
+                applied_data[point_id] = data
+            else:
+                results[point_id] = {"id": point_id, "status": "conflict", "version": stored_revisions.get(point_id)}
+
+    if metadata_mirror.covers(collection_name):
+        for point_id, data in applied_data.items():
+            metadata_mirror.upsert(point_id, {**existing_payloads[point_id], **data})
+
+    logger.info(f"Updated {len(applied_data)} of {len(updates)} points in {collection_name}")
+    return [results[str(update["id"])] for update in updates]
+
+
+async def update_qdrant_entry(collection_name: str, point_id: str, new_data: dict, expected_version=None, check_version: bool = False):
     """
     Updates an entry in Qdrant, keeping the existing data intact unless overridden by `new_data`.
+    Only the metadata payload is written, the vector stays as it is.
     
     Args:
         collection_name (str): The name of the collection to update the point in.
         point_id (str): The ID of the point to update.
         new_data (dict): A dictionary of new data to update the point with.
+        expected_version (str, optional): The revision the point must still have, used if check_version is set.
+        check_version (bool): Whether to only update the point if it still has expected_version.
         
     Returns:
-        str: The ID of the updated point.
+        str: The new revision of the updated point.
         
     Raises:
+        VersionConflictError: If the point was changed since expected_version.
         ValueError: If the point does not exist or if an error occurs during the update.
     """
+    update = {"id": point_id, "data": new_data}
+    if check_version:
+        update["expected_version"] = expected_version
+
     try:
-        existing_point = await get_point(collection_name, point_id)
+        result = (await update_qdrant_entries(collection_name, [update]))[0]
+    except Exception as e:
+        raise ValueError(f"An error occurred while updating the point: {str(e)}")
+
+    if result["status"] == "not_found":
+        raise ValueError(f"Point with ID {point_id} does not exist.")
+    if result["status"] == "conflict":
+        raise VersionConflictError(f"Point with ID {point_id} was changed in the meantime, its version is {result['version']}.")
+    return result["version"]
+
+
+def resolve_filters(filters: dict):
+    """
+    Applies the fallback values to the filters of a query, so equal filters always resolve to the same dictionary.
+    
+    Args:
+        filters (dict): A dictionary containing filter conditions such as query limits, category filters, and ratings.
         
-        # Check if the point exists
-        if not existing_point or len(existing_point) == 0:
-            raise ValueError(f"Point with ID {point_id} does not exist.")
+    Returns:
+        dict: The 'query_limit', 'general_rating', 'link_types' and 'category_filters' the query runs with.
+    """
+    query_limit = filters.get('queryLimit', 10) if isinstance(filters.get('queryLimit', 10), int) and 1 <= filters.get('queryLimit', 10) <= 25 else 10
+    category_filters = {
+        "co2_score": [0, 100],
+        "reduk_score": [0, 100],
+        "regul_score": [0, 100],
+        "report_score": [0, 100],
+        "sustfin_score": [0, 100],
+    }
+    category_filters.update(filters.get('categoryFilters') or {})
+
+    return {
+        "query_limit": query_limit,
+        "general_rating": list(filters.get('generalRating') or [0, 5]),
+        "link_types": sorted(filters.get('linkTypes') or []),
+        "category_filters": {category: list(range_values) for category, range_values in category_filters.items()},
+    }
+
+
+async def resolve_chunk_filter(collection_metadata: str, resolved_filters: dict):
+    """
+    Turns the resolved filters into the filter of the chunk search by looking up the ids of the matching metadata points.
+    
+    Args:
+        collection_metadata (str): The name of the metadata collection.
+        resolved_filters (dict): The filters as returned by resolve_filters.
         
-        existing_payload = existing_point[0].payload["metadata"]
-                
-        updated_payload = {**existing_payload, **new_data}
-        send_payload = {"metadata": updated_payload}
-        point = PointStruct(id=point_id, vector=np.random.rand(768).tolist(), payload=send_payload) # Random vector because we dont care about the metadata
-    
-        qdrant_client.upsert(collection_name=collection_name, points=[point])
-        return point_id  
+    Returns:
+        Filter: The filter for the chunk collection or None if no document matches the filters.
+    """
+    general_rating = resolved_filters["general_rating"]
+    link_types = resolved_filters["link_types"]
+    category_filters = resolved_filters["category_filters"]
+
+    # Building the filter for metadata based on the restrictions
+    metadata_filter_query = {
+        "must": []
+    }
+
+    # Filter for link_type (skip if not set or empty)
+    if link_types:
+        metadata_filter_query["must"].append({
+            "key": "metadata.link_type",
+            "match": {"any": link_types}
+        })
+
+    # Filters for categories (skip if in range from 0 - 100)
+    for category, range_values in category_filters.items():
+        if range_values != [0, 100]:
+            metadata_filter_query["must"].append({
+                "key": "metadata." + category,
+                "range": {"gte": range_values[0], "lte": range_values[1]}
+            })
+
+    # Filter for the aggregated user rating (skip if in range from 0 - 5), documents without ratings always pass
+    if general_rating != [0, 5]:
+        metadata_filter_query["must"].append({
+            "should": [
+                {"key": "metadata." + RATING_PAYLOAD_KEY, "range": {"gte": general_rating[0], "lte": general_rating[1]}},
+                {"is_empty": {"key": "metadata." + RATING_PAYLOAD_KEY}}
+            ]
+        })
+
+    # If no filter is set, the chunk search runs unrestricted
+    if not metadata_filter_query["must"]:
+        return Filter()
+
+    # Restrict the chunk search to the ids of the matching metadata points, evaluated in-process if the collection is mirrored
+    if metadata_mirror.covers(collection_metadata):
+        start = time.perf_counter()
+        valid_ids = metadata_mirror.filter_ids(resolved_filters)
+        logger.info(f"Filtering the metadata mirror took {(time.perf_counter() - start) * 1000:.3f} ms")
+    else:
+        logger.info("Querying metadata collection with filters.")
+        logger.info(metadata_filter_query)
+        valid_ids = await get_point_ids(collection_metadata, Filter.model_validate(metadata_filter_query))
+
+    if not valid_ids:
+        logger.info("No valid IDs found after applying filters.")
+        return None
+
+    return Filter.model_validate({
+        "must": [
+            {"key": "link_id", "match": {"any": valid_ids}}
+        ]
+    })
+
+
+async def build_documents(collection_metadata: str, chunk_hits_per_query: list):
+    """
+    Combines the chunk hits of one or more queries with the metadata and ratings of their documents,
+    fetched once for all queries.
+    
+    Args:
+        collection_metadata (str): The name of the metadata collection.
+        chunk_hits_per_query (List[List[ScoredPoint]]): The best chunk of every document, per query.
         
-    except Exception as e:
-        raise ValueError(f"An error occurred while updating the point: {str(e)}")
+    Returns:
+        List[List[dict]]: The documents of every query.
+    """
+    link_ids = list(dict.fromkeys(
+        chunk_hit.payload.get("link_id", "") for chunk_hits in chunk_hits_per_query for chunk_hit in chunk_hits
+    ))
+
+    # Retrieve the related metadata of all hits at once
+    start = time.perf_counter()
+    with instrumentation.span("metadata"):
+        metadata_result = await qdrant_client.retrieve(
+            collection_name=collection_metadata,
+            ids=link_ids
+        ) if link_ids else []
+    metadata_payloads = {str(point.id): point.payload for point in metadata_result}
+    with instrumentation.span("ratings"):
+        document_ratings = getCachedDocumentRatings(link_ids)
+    logger.info(f"Fetching metadata for {len(link_ids)} documents took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    documents_per_query = []
+    for chunk_hits in chunk_hits_per_query:
+        # Prepare to store documents with additional metadata
+        documents = []
+
+        for chunk_hit in chunk_hits:
+            link_id = chunk_hit.payload.get("link_id", "")
+
+            # Skip chunks whose metadata point has been deleted in the meantime
+            if link_id not in metadata_payloads:
+                logger.warning(f"No metadata found for link_id {link_id}, skipping its chunk.")
+                continue
+
+            # Combine primary document and related metadata
+            documents.append({
+                "id_metadata": link_id,
+                "metadata": metadata_payloads[link_id].get("metadata", {}),
+                "chunk": chunk_hit.payload.get("chunk", "No content available."),
+                "score": chunk_hit.score,
+                "user_rating": document_ratings.get(link_id)
+            })
+
+        documents_per_query.append(documents)
+
+    return documents_per_query
 
 
 async def query_qdrant(collection_name: str, collection_metadata: str, query_text: str, filters: dict):
@@ -110,257 +519,432 @@ async def query_qdrant(collection_name: str, collection_metadata: str, query_tex
     """
     try:
         # Encode the query text into a vector
-        logger.info(f"Encoding query text: {query_text}")
-        query_vector = model.encode([query_text])[0].tolist()
+        query_vector = await encode_query(query_text)
 
         # Filters with fallback values
-        query_limit = filters.get('queryLimit', 10) if isinstance(filters.get('queryLimit', 10), int) and 1 <= filters.get('queryLimit', 10) <= 25 else 10
-        general_rating = filters.get('generalRating', [0, 5])
-        link_types = filters.get('linkTypes', [])
-        category_filters = filters.get('categoryFilters', {
-            "co2_score": [0, 100],
-            "reduk_score": [0, 100],
-            "regul_score": [0, 100],
-            "report_score": [0, 100],
-            "sustfin_score": [0, 100],
-        })
-
-        # Building the filter for metadata based on the restrictions
-        metadata_filter_query = {
-            "must": []
-        }
-
-        # Filter for link_type (skip if not set or empty)
-        if link_types:
-            metadata_filter_query["must"].append({
-                "key": "metadata.link_type",
-                "match": {"any": link_types}
-            })
+        resolved_filters = resolve_filters(filters)
+        with instrumentation.span("prefilter"):
+            query_filter = await resolve_chunk_filter(collection_metadata, resolved_filters)
+        if query_filter is None:
+            return []
 
-        # Filters for categories (skip if in range from 0 - 100)
-        for category, range_values in category_filters.items():
-            if range_values != [0, 100]:
-                metadata_filter_query["must"].append({
-                    "key": "metadata." + category,
-                    "range": {"gte": range_values[0], "lte": range_values[1]}
-                })
-
-        # If either filter from above or scoring filter is set, we need to do these steps for filters
-        metadata_points = []
-        if metadata_filter_query["must"] or general_rating != [0, 5]:
-            logger.info("Querying metadata collection with filters.")
-            logger.info(metadata_filter_query)
-
-            # Get number of all available points in collection
-            collection_info = qdrant_client.get_collection(collection_metadata)
-            total_points = collection_info.points_count
-            metadata_results = qdrant_client.query_points(
-                collection_name=collection_metadata,
-                query_filter=metadata_filter_query, # Set filter that was given above
-                limit=total_points # Get all points from metadata collection
+        # Query the chunk collection using valid IDs and query vector
+        logger.info(f"Querying chunk collection")
+        start = time.perf_counter()
+        with instrumentation.span("search"):
+            results = await qdrant_client.query_points_groups(
+                collection_name=collection_name,
+                query=query_vector,
+                query_filter=query_filter,
+                group_by=GROUP_BY_PARAMETER,
+                limit=resolved_filters["query_limit"],
+                group_size=1
             )
+        logger.info(f"Chunk search took {(time.perf_counter() - start) * 1000:.1f} ms")
 
-            metadata_points = {str(point.id): point.payload for point in metadata_results.points} if metadata_results.points else {}
-
-            # Limit the valid ids even more by seeing if ranking is in the range
-            if general_rating != [0, 5]:
-                min_rating, max_rating = general_rating
-                filtered_valid_ids = []
-                for valid_id, payload in metadata_points.items():
-                    user_rating = await getDocumentRating(valid_id)
-                    if user_rating is None or (min_rating <= user_rating <= max_rating):
-                        filtered_valid_ids.append(valid_id)
-                        payload["user_rating"] = user_rating  # Cache the rating
-                valid_ids = filtered_valid_ids
-            else:
-                valid_ids = list(metadata_points.keys())
+        # Extract the primary document of every group
+        chunk_hits = [group.hits[0] for group in results.groups if group.hits]
 
-            if not valid_ids:
-                logger.info("No valid IDs found after applying filters.")
-                return []
+        return (await build_documents(collection_metadata, [chunk_hits]))[0]
 
-            query_filter = {
-                "must": [
-                    {"key": "link_id", "match": {"any": valid_ids}}  
-                ]
-            }
-        else:
-            query_filter = {}
+    except Exception as e:
+        logger.error(f"Error querying Qdrant: {e}")
+        raise
 
-        # Query the chunk collection using valid IDs and query vector
-        logger.info(f"Querying chunk collection")
-        results = qdrant_client.query_points_groups(
-            collection_name=collection_name,
-            query=query_vector,
-            query_filter=query_filter,
-            group_by=GROUP_BY_PARAMETER,
-            limit=query_limit,
-            group_size=1
-        )
 
-        # Prepare to store documents with additional metadata
-        documents = []
+async def query_qdrant_batch(collection_name: str, collection_metadata: str, query_texts: list, filters: dict):
+    """
+    Runs several queries that share the same filters with one encode batch, one metadata filter lookup,
+    one batch search and one metadata fetch.
+    
+    Qdrant has no batch variant of the group search, so every search fetches BATCH_GROUP_OVERSAMPLING chunks per
+    requested group and keeps the best chunk per URL. Queries whose chunks come from too few URLs to fill the limit
+    are repeated with the group search, so the results equal the ones of query_qdrant.
+    
+    Args:
+        collection_name (str): The name of the chunk collection to query.
+        collection_metadata (str): The name of the metadata collection to query.
+        query_texts (List[str]): The query strings that will be encoded and used for semantic search.
+        filters (dict): A dictionary containing filter conditions such as query limits, category filters, and ratings.
+    
+    Returns:
+        List[List[dict]]: The documents of every query in the order of query_texts, like query_qdrant returns them.
+        
+    Raises:
+        Exception: If an error occurs during the query process.
+    """
+    try:
+        query_vectors = await encode_queries(query_texts)
 
-        # Loop through results to fetch additional metadata
-        for group in results.groups:
-            if not group.hits:
-                continue
+        resolved_filters = resolve_filters(filters)
+        query_limit = resolved_filters["query_limit"]
+        with instrumentation.span("prefilter"):
+            query_filter = await resolve_chunk_filter(collection_metadata, resolved_filters)
+        if query_filter is None:
+            return [[] for _ in query_texts]
 
-            # Extract the primary document's data
-            chunk_hit = group.hits[0]
-            link_id = chunk_hit.payload.get("link_id", "")
+        logger.info(f"Querying chunk collection with a batch of {len(query_texts)} queries")
+        start = time.perf_counter()
+        with instrumentation.span("search"):
+            responses = await qdrant_client.query_batch_points(
+                collection_name=collection_name,
+                requests=[
+                    QueryRequest(query=query_vector, filter=query_filter, limit=query_limit * BATCH_GROUP_OVERSAMPLING, with_payload=True)
+                    for query_vector in query_vectors
+                ]
+            )
 
-            # Retrieve related metadata from preloaded metadata points
-            related_metadata = None
+        chunk_hits_per_query = []
+        for query_vector, response in zip(query_vectors, responses):
+            # Keep the best chunk per URL, like the group search with group_size=1
+            best_hits = {}
+            for point in response.points:
+                best_hits.setdefault(point.payload.get(GROUP_BY_PARAMETER), point)
+            chunk_hits = list(best_hits.values())[:query_limit]
 
-            # If metadata_points is empty, we'll fetch metadata from the database using link_id
-            if not metadata_points:
-                logger.info(f"Fetching metadata for link_id {link_id} since metadata_points is empty.")
-                metadata_result = qdrant_client.retrieve(
-                    collection_name=collection_metadata,
-                    ids=[link_id]
-                )
-                payload = metadata_result[0].payload
-            # The metadata is loaded already from the prior filters, get it there
-            else:
-                payload = metadata_points[link_id]
-              
-                
-            related_metadata = {
-                "id": link_id,
-                "metadata": payload.get("metadata", {})
-            }
-            user_rating = payload.get("user_rating")
-            
-            # If the rating hasnt been loaded because of no filter, load it at the end here
-            if general_rating == [0, 5]:
-                user_rating = await getDocumentRating(link_id)
+            # More groups may exist beyond the fetched chunks
+            if len(chunk_hits) < query_limit and len(response.points) == query_limit * BATCH_GROUP_OVERSAMPLING:
+                with instrumentation.span("search"):
+                    results = await qdrant_client.query_points_groups(
+                        collection_name=collection_name,
+                        query=query_vector,
+                        query_filter=query_filter,
+                        group_by=GROUP_BY_PARAMETER,
+                        limit=query_limit,
+                        group_size=1
+                    )
+                chunk_hits = [group.hits[0] for group in results.groups if group.hits]
 
-            # Combine primary document and related metadata
-            documents.append({
-                "id_metadata": related_metadata.get("id") if related_metadata else None,
-                "metadata": related_metadata.get("metadata") if related_metadata else {},
-                "chunk": chunk_hit.payload.get("chunk", "No content available."),
-                "score": chunk_hit.score,
-                "user_rating": user_rating
-            })
+            chunk_hits_per_query.append(chunk_hits)
+        logger.info(f"Batch chunk search took {(time.perf_counter() - start) * 1000:.1f} ms")
 
-        return documents
+        return await build_documents(collection_metadata, chunk_hits_per_query)
 
     except Exception as e:
         logger.error(f"Error querying Qdrant: {e}")
         raise
 
 
-async def get_documents(collection_name: str, tippgeberFilter=None):
+def encode_cursor(offset):
     """
-    Retrieves all documents from a Qdrant collection using the Python client scroll method.
+    Turns the next_page_offset of a Qdrant scroll into an opaque cursor for clients.
+    
+    Args:
+        offset: The point id the next page starts at (int or UUID string) or None.
+        
+    Returns:
+        str: The cursor or None if there is no next page.
+    """
+    if offset is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(offset).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """
+    Turns a cursor created by encode_cursor back into a scroll offset.
+    
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(offset, (int, str)) or isinstance(offset, bool):
+        raise ValueError("Invalid cursor.")
+    return offset
+
+
+async def get_documents_page(collection_name: str, tippgeberFilter=None, limit: int = SCROLL_PAGE_SIZE, offset=None):
+    """
+    Retrieves one page of documents from a Qdrant collection using the Python client scroll method.
     Supports filtering by a custom filter condition.
 
     Args:
         collection_name (str): The name of the collection to query.
         tippgeberFilter (str, optional): An optional filter for the `tippgeber_id`.
+        limit (int): The maximum number of documents of the page.
+        offset (optional): The point id the page starts at, as returned for the previous page.
     
     Returns:
-        List[dict]: A list of retrieved documents as dictionaries, with 'id' and 'metadata' fields.
+        Tuple[List[dict], Any]: The documents of the page as dictionaries with 'id' and 'metadata' fields
+        and the offset of the next page (None on the last page).
         
     Raises:
         Exception: If an error occurs during the document retrieval.
     """
-    try:     
-        collection_info = qdrant_client.get_collection(collection_name)
-        total_points = collection_info.points_count
-        documents = []
-        
+    try:
+        scroll_filter = None
         if tippgeberFilter:
-            result, _ = qdrant_client.scroll(
-                collection_name=collection_name,
-                limit=total_points,
-                scroll_filter=Filter(
-                    should=[FieldCondition(
-                        key="metadata.user.id", match=MatchValue(value=tippgeberFilter)
-                    )],
-                ),
-                with_payload=True,
-                with_vectors=False,  
+            scroll_filter = Filter(
+                should=[FieldCondition(
+                    key="metadata.user.id", match=MatchValue(value=tippgeberFilter)
+                )],
             )
-        else:
-            result, _ = qdrant_client.scroll(
-                collection_name=collection_name,
-                limit=total_points, 
-                with_payload=True,
-                with_vectors=False,  
-            )
-        
-        for record in result:
-            document = {
+
+        result, next_offset = await qdrant_client.scroll(
+            collection_name=collection_name,
+            limit=limit,
+            offset=offset,
+            scroll_filter=scroll_filter,
+            with_payload=True,
+            with_vectors=False,
+        )
+
+        documents = [
+            {
                 "id": record.id,
                 "metadata": record.payload.get("metadata", {})
             }
-            documents.append(document)
-            
-        return documents
+            for record in result
+        ]
+        return documents, next_offset
 
     except Exception as e:
-        logging.error(f"Error in get_documents: {e}", exc_info=True)
+        logging.error(f"Error in get_documents_page: {e}", exc_info=True)
         raise
 
 
-async def delete_point_by_id(collection_metadata_name: str, collection_chunk_name: str, point_id: str):
+async def iter_document_pages(collection_name: str, tippgeberFilter=None, page_size: int = SCROLL_PAGE_SIZE, offset=None):
     """
-    Deletes a point from a Qdrant collection based on the point's ID.
+    Yields the documents of a Qdrant collection page by page, so only one page is held in memory at a time.
+
+    Args:
+        collection_name (str): The name of the collection to query.
+        tippgeberFilter (str, optional): An optional filter for the `tippgeber_id`.
+        page_size (int): The number of documents per page.
+        offset (optional): The point id to start at.
+
+    Yields:
+        List[dict]: The documents of the next page.
+    """
+    while True:
+        documents, offset = await get_documents_page(collection_name, tippgeberFilter, page_size, offset)
+        if documents:
+            yield documents
+        if offset is None:
+            return
+
+
+async def get_documents_by_ids(collection_name: str, point_ids: list):
+    """
+    Retrieves the documents with the given ids, ids that do not exist (anymore) are left out.
+
+    Args:
+        collection_name (str): The name of the collection to query.
+        point_ids (List[str]): The ids of the documents.
+    
+    Returns:
+        List[dict]: The documents as dictionaries with 'id' and 'metadata' fields.
+    """
+    documents = []
+    for start in range(0, len(point_ids), SCROLL_PAGE_SIZE):
+        records = await qdrant_client.retrieve(
+            collection_name=collection_name,
+            ids=point_ids[start:start + SCROLL_PAGE_SIZE],
+            with_payload=True,
+            with_vectors=False,
+        )
+        documents.extend({"id": record.id, "metadata": record.payload.get("metadata", {})} for record in records)
+    return documents
+
+
+async def get_documents(collection_name: str, tippgeberFilter=None):
+    """
+    Retrieves all documents from a Qdrant collection, reading it page by page.
+    Supports filtering by a custom filter condition.
+
+    Args:
+        collection_name (str): The name of the collection to query.
+        tippgeberFilter (str, optional): An optional filter for the `tippgeber_id`.
+    
+    Returns:
+        List[dict]: A list of retrieved documents as dictionaries, with 'id' and 'metadata' fields.
+        
+    Raises:
+        Exception: If an error occurs during the document retrieval.
+    """
+    documents = []
+    async for page in iter_document_pages(collection_name, tippgeberFilter):
+        documents.extend(page)
+    return documents
+
+
+async def delete_points_by_ids(collection_metadata_name: str, collection_chunk_name: str, point_ids: list):
+    """
+    Deletes many metadata points and all of their chunks with one delete call per collection.
    
     Args:
         collection_metadata_name (str): The name of the metadata collection.
         collection_chunk_name (str): The name of the chunk collection.
-        point_id (str): The ID of the point to delete.
+        point_ids (List[str]): The IDs of the metadata points to delete.
         
     Returns:
-        str: A success message if the deletion is successful.
+        Tuple[List[str], List[str]]: The IDs that were deleted and the IDs that were not found.
     
     Raises:
         Exception: If any error occurs during the deletion process.
     """
     try:
-        print(f"Deleting point with ID: {point_id}")
+        point_ids = list(dict.fromkeys(str(point_id) for point_id in point_ids))
 
-        # Fetch the metadata point by ID
-        metadata_result = await get_point(collection_metadata_name, point_id)
+        # Only delete what exists, so the caller can report unknown ids
+        existing_ids = set()
+        for start in range(0, len(point_ids), SCROLL_PAGE_SIZE):
+            records = await qdrant_client.retrieve(
+                collection_name=collection_metadata_name,
+                ids=point_ids[start:start + SCROLL_PAGE_SIZE],
+                with_payload=False,
+                with_vectors=False,
+            )
+            existing_ids.update(str(record.id) for record in records)
 
-        # Ensure the metadata point exists
-        if not metadata_result or len(metadata_result) == 0:
-            raise ValueError(f"Metadata point with ID {point_id} not found.")
-        
-        # Delete all chunks containing the URL in the payload
-        qdrant_client.delete(
+        deleted_ids = [point_id for point_id in point_ids if point_id in existing_ids]
+        missing_ids = [point_id for point_id in point_ids if point_id not in existing_ids]
+        if not deleted_ids:
+            return deleted_ids, missing_ids
+
+        # Delete all chunks of the links with a single filter
+        await qdrant_client.delete(
             collection_name=collection_chunk_name,
             points_selector=FilterSelector(
-            filter=Filter(
-                must=[
-                    FieldCondition(
-                        key="link_id",
-                        match=MatchValue(value=point_id),
-                        ),
-                    ],
+                filter=Filter(
+                    must=[FieldCondition(key="link_id", match=MatchAny(any=deleted_ids))],
                 )
             ),
         )
-        print(f"Chunks associated with id {point_id} deleted successfully.")
 
-        # Delete the metadata point
-        qdrant_client.delete(
+        # Delete the metadata points
+        await qdrant_client.delete(
             collection_name=collection_metadata_name,
             points_selector=PointIdsList(
-                points=[point_id],
+                points=deleted_ids,
             )
         )
-        print(f"Metadata point with ID {point_id} deleted successfully.")
-        return "Success"
+        logger.info(f"Deleted {len(deleted_ids)} metadata points and their chunks.")
+
+        if metadata_mirror.covers(collection_metadata_name):
+            for point_id in deleted_ids:
+                metadata_mirror.remove(point_id)
+
+        return deleted_ids, missing_ids
     except Exception as e:
-        logging.error(f"Error deleting point with ID {point_id}: {e}", exc_info=True)
+        logging.error(f"Error deleting points {point_ids}: {e}", exc_info=True)
         raise
 
 
+async def delete_point_by_id(collection_metadata_name: str, collection_chunk_name: str, point_id: str):
+    """
+    Deletes a point from a Qdrant collection based on the point's ID.
+   
+    Args:
+        collection_metadata_name (str): The name of the metadata collection.
+        collection_chunk_name (str): The name of the chunk collection.
+        point_id (str): The ID of the point to delete.
+        
+    Returns:
+        str: A success message if the deletion is successful.
+    
+    Raises:
+        Exception: If any error occurs during the deletion process.
+    """
+    print(f"Deleting point with ID: {point_id}")
+
+    deleted_ids, _ = await delete_points_by_ids(collection_metadata_name, collection_chunk_name, [point_id])
+
+    # Ensure the metadata point existed
+    if not deleted_ids:
+        raise ValueError(f"Metadata point with ID {point_id} not found.")
+
+    print(f"Metadata point with ID {point_id} and its chunks deleted successfully.")
+    return "Success"
+
+
+async def delete_orphan_chunks(collection_chunk_name: str, collection_metadata_name: str, batch_size: int = SCROLL_PAGE_SIZE,
+                               dry_run: bool = False, progress=None):
+    """
+    Finds chunk points whose link_id has no metadata point (e.g. left over by failed ingestions or deletions)
+    and deletes them batch by batch.
+    
+    Orphans are checked a second time right before they are deleted, so a link whose metadata point was
+    written during the scan keeps its chunks.
+    
+    Args:
+        collection_chunk_name (str): The name of the chunk collection.
+        collection_metadata_name (str): The name of the metadata collection.
+        batch_size (int): The number of chunks scanned per page.
+        dry_run (bool): Whether to only count the orphans without deleting them.
+        progress (callable, optional): Called (and awaited if it is async) with the current statistics after every page.
+        
+    Returns:
+        dict: The number of 'scanned' chunks, 'orphans' found and 'deleted' chunks.
+    
+    Raises:
+        Exception: If any error occurs while scanning or deleting.
+    """
+    stats = {"scanned": 0, "orphans": 0, "deleted": 0}
+    known_links = {} # link_id -> whether its metadata point exists
+    offset = None
+
+    async def existing_link_ids(link_ids: list):
+        records = await qdrant_client.retrieve(
+            collection_name=collection_metadata_name,
+            ids=link_ids,
+            with_payload=False,
+            with_vectors=False,
+        )
+        return {str(record.id) for record in records}
+
+    while True:
+        records, offset = await qdrant_client.scroll(
+            collection_name=collection_chunk_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=["link_id"],
+            with_vectors=False,
+        )
+        stats["scanned"] += len(records)
+
+        unknown_ids = list({str(record.payload.get("link_id")) for record in records if record.payload.get("link_id")} - known_links.keys())
+        if unknown_ids:
+            existing = await existing_link_ids(unknown_ids)
+            known_links.update({link_id: link_id in existing for link_id in unknown_ids})
+
+        orphans = {}
+        for record in records:
+            link_id = record.payload.get("link_id")
+            if not link_id or not known_links[str(link_id)]:
+                orphans.setdefault(str(link_id) if link_id else None, []).append(record.id)
+        stats["orphans"] += sum(len(chunk_ids) for chunk_ids in orphans.values())
+
+        if orphans and not dry_run:
+            # Links whose metadata point appeared in the meantime keep their chunks
+            appeared = await existing_link_ids([link_id for link_id in orphans if link_id])
+            for link_id in appeared:
+                known_links[link_id] = True
+                stats["orphans"] -= len(orphans.pop(link_id))
+
+            orphan_chunk_ids = [chunk_id for chunk_ids in orphans.values() for chunk_id in chunk_ids]
+            if orphan_chunk_ids:
+                await qdrant_client.delete(
+                    collection_name=collection_chunk_name,
+                    points_selector=PointIdsList(points=orphan_chunk_ids),
+                )
+                stats["deleted"] += len(orphan_chunk_ids)
+
+        logger.info(f"Orphan chunk GC: {stats}")
+        if progress:
+            reported = progress(dict(stats))
+            if asyncio.iscoroutine(reported):
+                await reported
+
+        if offset is None:
+            return stats
+
+
 async def get_point(collection_name: str, point_id: str):
     """
     Retrieves a point from the Qdrant collection by ID.
@@ -376,7 +960,7 @@ async def get_point(collection_name: str, point_id: str):
         Exception: If the point cannot be found or if an error occurs during retrieval.
     """
     try:
-        metadata_result = qdrant_client.retrieve(
+        metadata_result = await qdrant_client.retrieve(
             collection_name=collection_name,
             ids=[point_id]
         )
@@ -384,3 +968,165 @@ async def get_point(collection_name: str, point_id: str):
     except Exception as e:
         logger.error(f"Error retrieving point: {e}")
         raise
+
+
+async def get_point_ids(collection_name: str, scroll_filter: Filter):
+    """
+    Retrieves the IDs of all points matching a filter, page by page and without payloads.
+    
+    Args:
+        collection_name (str): The name of the collection to scroll.
+        scroll_filter (Filter): The filter the points must match.
+    
+    Returns:
+        List[str]: The IDs of the matching points.
+        
+    Raises:
+        Exception: If an error occurs during the scroll.
+    """
+    try:
+        point_ids = []
+        offset = None
+
+        while True:
+            records, offset = await qdrant_client.scroll(
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            point_ids.extend(str(record.id) for record in records)
+
+            if offset is None:
+                return point_ids
+
+    except Exception as e:
+        logger.error(f"Error retrieving point ids: {e}")
+        raise
+
+
+async def get_link_ids_by_url(collection_metadata: str, url: str):
+    """
+    Finds the metadata points of a URL, stored either as submitted or normalized.
+    
+    Args:
+        collection_metadata (str): The name of the metadata collection.
+        url (str): The URL of the link.
+        
+    Returns:
+        List[str]: The ids of the metadata points with this URL.
+    """
+    urls = list(dict.fromkeys([url.strip(), normalize_url(url)]))
+    return await get_point_ids(collection_metadata, Filter(
+        must=[FieldCondition(key="metadata.url", match=MatchAny(any=urls))]
+    ))
+
+
+async def find_link_by_url(collection_metadata: str, url: str):
+    """
+    Finds an existing link by its URL. The URL index of the metadata mirror is only a shortcut for URLs it knows: it
+    misses links added by other workers or the scraper until its next refresh, so a miss is always confirmed by an
+    exact match on the metadata.url index.
+    
+    Args:
+        collection_metadata (str): The name of the metadata collection.
+        url (str): The URL of the link.
+        
+    Returns:
+        dict: The id and metadata of the existing link or None.
+    """
+    if metadata_mirror.covers(collection_metadata):
+        point_ids = metadata_mirror.ids_for_url(url)
+        documents = await get_documents_by_ids(collection_metadata, point_ids) if point_ids else []
+        if documents:
+            return documents[0]
+
+    point_ids = await get_link_ids_by_url(collection_metadata, url)
+    documents = await get_documents_by_ids(collection_metadata, point_ids) if point_ids else []
+    return documents[0] if documents else None
+
+
+async def set_document_rating(collection_metadata: str, point_id: str, average_rating: float):
+    """
+    Writes the average user rating of a document into its metadata payload, so rating filters can run inside Qdrant.
+    
+    Args:
+        collection_metadata (str): The name of the metadata collection.
+        point_id (str): The ID of the metadata point.
+        average_rating (float): The average rating of the document or None if it has no ratings.
+        
+    Raises:
+        Exception: If an error occurs while updating the payload.
+    """
+    try:
+        await qdrant_client.set_payload(
+            collection_name=collection_metadata,
+            payload={RATING_PAYLOAD_KEY: average_rating},
+            points=[point_id],
+            key="metadata",
+        )
+        if metadata_mirror.covers(collection_metadata):
+            metadata_mirror.set_rating(point_id, average_rating)
+    except Exception as e:
+        logger.error(f"Error setting rating of point {point_id}: {e}")
+        raise
+
+
+async def resync_document_ratings(collection_metadata: str):
+    """
+    Compares the rating stored in every metadata payload with the ratings in the database and fixes the ones that drifted.
+    
+    Args:
+        collection_metadata (str): The name of the metadata collection.
+    
+    Returns:
+        List[str]: The ids of the metadata points whose rating was corrected.
+        
+    Raises:
+        Exception: If an error occurs during the resync.
+    """
+    try:
+        corrected = []
+        checked = 0
+        offset = None
+
+        while True:
+            records, offset = await qdrant_client.scroll(
+                collection_name=collection_metadata,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            document_ratings = await getDocumentRatings([record.id for record in records])
+
+            # Group the drifted points by their correct rating, so each distinct value needs only one update
+            drifted_points = {}
+            for record in records:
+                average_rating = document_ratings.get(str(record.id), (None, 0))[0]
+                if record.payload.get("metadata", {}).get(RATING_PAYLOAD_KEY) != average_rating:
+                    drifted_points.setdefault(average_rating, []).append(record.id)
+
+            for average_rating, point_ids in drifted_points.items():
+                await qdrant_client.set_payload(
+                    collection_name=collection_metadata,
+                    payload={RATING_PAYLOAD_KEY: average_rating},
+                    points=point_ids,
+                    key="metadata",
+                )
+                if metadata_mirror.covers(collection_metadata):
+                    for point_id in point_ids:
+                        metadata_mirror.set_rating(point_id, average_rating)
+                corrected.extend(str(point_id) for point_id in point_ids)
+
+            checked += len(records)
+            logger.info(f"Checked ratings of {checked} metadata points, corrected {len(corrected)}.")
+
+            if offset is None:
+                return corrected
+
+    except Exception as e:
+        logger.error(f"Error resyncing document ratings: {e}")
+        raise
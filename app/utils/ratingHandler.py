@@ -1,5 +1,19 @@
+import asyncio
+import logging
+from tortoise.expressions import F
+from tortoise.functions import Avg, Count, Sum
+from tortoise.transactions import in_transaction
 from app.ormModels.rating import Rating
-from app.utils.pointHandler import grant_points
+from app.ormModels.documentRatingStats import DocumentRatingStats
+from app.utils.pointHandler import queue_grant_points
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound variables per statement, so large id lists are split
+RATING_BATCH_SIZE = 500
+
+# Process-local qdrant_id -> average rating, refreshed from the document_rating_stats table
+_document_rating_index = {}
 
 
 """
@@ -11,37 +25,62 @@ Args:
     rating (float): Amount of points to give
     
 Returns:
-    The update object with message what action was taken
+    The update object with message what action was taken and the new average rating of the document
 """
 async def saveRating(user_id: str, document_id: str, rating: float):
     try:
-        existing_rating = await Rating.filter(user_id=user_id, qdrant_id=document_id).first()
+        async with in_transaction() as connection:
+            existing_rating = await Rating.filter(user_id=user_id, qdrant_id=document_id).using_db(connection).select_for_update().first()
+
+            if existing_rating:
+                rating_delta = rating - existing_rating.rating
+                count_delta = 0
+                existing_rating.rating = rating
+                await existing_rating.save(using_db=connection)
+                rating_instance = existing_rating
+            else:
+                rating_delta = rating
+                count_delta = 1
+                rating_instance = await Rating.create(
+                    user_id=user_id,
+                    qdrant_id=document_id,
+                    rating=rating,
+                    using_db=connection
+                )
+
+            # Keep the aggregate of the document in sync within the same transaction
+            await DocumentRatingStats.get_or_create(qdrant_id=document_id, using_db=connection)
+            await DocumentRatingStats.filter(qdrant_id=document_id).using_db(connection).update(
+                rating_sum=F("rating_sum") + rating_delta,
+                rating_count=F("rating_count") + count_delta
+            )
+            stats = await DocumentRatingStats.get(qdrant_id=document_id).using_db(connection)
+            stats.average_rating = stats.rating_sum / stats.rating_count
+            await stats.save(update_fields=["average_rating"], using_db=connection)
+
+        average_rating = round(stats.average_rating, 2)
+        _document_rating_index[document_id] = average_rating
 
         if existing_rating:
-            existing_rating.rating = rating
-            await existing_rating.save()  
             return {
                 "type": "update",
                 "rating": {
-                    "user_id": existing_rating.user_id,
-                    "qdrant_id": existing_rating.qdrant_id,
-                    "rating": existing_rating.rating
-                }
+                    "user_id": rating_instance.user_id,
+                    "qdrant_id": rating_instance.qdrant_id,
+                    "rating": rating_instance.rating
+                },
+                "average_rating": average_rating
             }
         else:
-            rating_instance = await Rating.create(
-                user_id=user_id,
-                qdrant_id=document_id,
-                rating=rating
-            )
-            await grant_points(user_id, 10)
+            await queue_grant_points(user_id, 10, "rating")
             return {
                 "type": "created",
                 "rating": {
                     "user_id": rating_instance.user_id,
                     "qdrant_id": rating_instance.qdrant_id,
                     "rating": rating_instance.rating
-                }
+                },
+                "average_rating": average_rating
             }
     except Exception as e:
         raise RuntimeError(f"Failed to save or update rating: {str(e)}")
@@ -96,4 +135,123 @@ async def getDocumentRating(qdrant_id: str):
         return round(average_rating, 2) 
     
     except Exception as e:
-        raise RuntimeError(f"Failed to calculate average rating: {str(e)}")
\ No newline at end of file
+        raise RuntimeError(f"Failed to calculate average rating: {str(e)}")
+
+"""
+Gets the overall rating of many documents with one grouped aggregate query per batch of ids
+    
+Args:
+    qdrant_ids (list[str]): The IDs of the documents
+    
+Returns:
+   A dict of qdrant_id -> (average rounded to two decimals, number of ratings). Documents without ratings are not included
+"""
+async def getDocumentRatings(qdrant_ids: list):
+    try:
+        ids = list({str(qdrant_id) for qdrant_id in qdrant_ids})
+        document_ratings = {}
+
+        for start in range(0, len(ids), RATING_BATCH_SIZE):
+            rows = await Rating.filter(qdrant_id__in=ids[start:start + RATING_BATCH_SIZE]) \
+                .annotate(average_rating=Avg("rating"), rating_count=Count("id")) \
+                .group_by("qdrant_id") \
+                .values("qdrant_id", "average_rating", "rating_count")
+
+            for row in rows:
+                document_ratings[row["qdrant_id"]] = (round(row["average_rating"], 2), row["rating_count"])
+
+        return document_ratings
+    
+    except Exception as e:
+        raise RuntimeError(f"Failed to calculate average ratings: {str(e)}")
+
+
+"""
+Gets the overall rating of a document from the process-local rating index
+    
+Args:
+    qdrant_id (str): The ID of the document
+    
+Returns:
+   The average rating rounded to two decimals or None if the document has no ratings
+"""
+def getCachedDocumentRating(qdrant_id: str):
+    return _document_rating_index.get(str(qdrant_id))
+
+
+"""
+Gets the overall rating of many documents from the process-local rating index
+    
+Args:
+    qdrant_ids (list[str]): The IDs of the documents
+    
+Returns:
+   A dict of qdrant_id -> average rating rounded to two decimals. Documents without ratings are not included
+"""
+def getCachedDocumentRatings(qdrant_ids: list):
+    index = _document_rating_index
+    return {str(qdrant_id): index[str(qdrant_id)] for qdrant_id in qdrant_ids if str(qdrant_id) in index}
+
+
+"""
+Reloads the process-local rating index from the document_rating_stats table
+    
+Returns:
+   The number of documents in the index
+"""
+async def refreshRatingIndex():
+    global _document_rating_index
+    try:
+        rows = await DocumentRatingStats.filter(rating_count__gt=0).values_list("qdrant_id", "average_rating")
+        _document_rating_index = {qdrant_id: round(average_rating, 2) for qdrant_id, average_rating in rows}
+        return len(_document_rating_index)
+    
+    except Exception as e:
+        raise RuntimeError(f"Failed to refresh rating index: {str(e)}")
+
+
+"""
+Refreshes the rating index in an endless loop, so ratings saved by other workers become visible
+    
+Args:
+    interval (float): Seconds between two refreshes
+"""
+async def refreshRatingIndexPeriodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refreshRatingIndex()
+        except RuntimeError as e:
+            logger.error(e)
+
+
+"""
+Rebuilds the document_rating_stats table from all existing ratings and reloads the rating index
+    
+Returns:
+   The number of documents that have ratings
+"""
+async def rebuildDocumentRatingStats():
+    try:
+        rows = await Rating.all() \
+            .annotate(rating_sum=Sum("rating"), rating_count=Count("id")) \
+            .group_by("qdrant_id") \
+            .values("qdrant_id", "rating_sum", "rating_count")
+
+        async with in_transaction() as connection:
+            await DocumentRatingStats.all().using_db(connection).delete()
+            await DocumentRatingStats.bulk_create([
+                DocumentRatingStats(
+                    qdrant_id=row["qdrant_id"],
+                    rating_sum=row["rating_sum"],
+                    rating_count=row["rating_count"],
+                    average_rating=row["rating_sum"] / row["rating_count"]
+                )
+                for row in rows
+            ], batch_size=RATING_BATCH_SIZE, using_db=connection)
+
+        await refreshRatingIndex()
+        return len(rows)
+    
+    except Exception as e:
+        raise RuntimeError(f"Failed to rebuild rating stats: {str(e)}")
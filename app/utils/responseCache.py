@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+from app.utils.linkChangeHandler import get_link_changes_since, get_links_version, LinkChangesCompacted
+
+logger = logging.getLogger(__name__)
+
+
+def canonicalize_filters(resolved_filters: dict):
+    """
+    Turns resolved query filters into a string that is equal for equal filters (key order, int vs. float).
+
+    Args:
+        resolved_filters (dict): The filters as returned by quadrant.resolve_filters.
+
+    Returns:
+        str: The canonical form of the filters.
+    """
+    def canonical(value):
+        if isinstance(value, dict):
+            return {key: canonical(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [canonical(item) for item in value]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        return value
+
+    return json.dumps(canonical(resolved_filters), sort_keys=True)
+
+
+class SemanticResponseCache:
+    '''
+    Caches (query embedding, filters) -> (documents, response_text) of /api/query.
+    A query is served from the cache if an entry with exactly the same filters has an embedding with a cosine
+    similarity of at least `threshold`, so paraphrases of a recent question skip retrieval and generation.
+    The cache is local to a worker. Changes made on other workers reach it through the link change log: sync applies
+    the changes since the version it saw last before every lookup.
+    '''
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 600, threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # entry id -> entry
+        self._next_id = 0
+        self.version = None # the change log version the entries are up to date with
+
+    async def sync(self):
+        """
+        Removes the entries whose links changed in the change log since the last sync, e.g. on another worker.
+
+        Returns:
+            int: The change log version the cache is up to date with, pass it to put. None if the cache is disabled
+            or the change log could not be read, put does not store anything then.
+        """
+        if self.max_size <= 0:
+            return None
+
+        try:
+            if self.version is None:
+                self.version = await get_links_version()
+                return self.version
+
+            version, upserted, deleted = await get_link_changes_since(self.version)
+        except LinkChangesCompacted:
+            # The changes since the last sync are gone, so is every way to tell which entries are still valid
+            self.clear()
+            self.version = None
+            return None
+        except Exception as e:
+            # Without the change log the entries cannot be trusted
+            logger.error(f"Error reading the link change log, clearing the response cache: {e}")
+            self.clear()
+            self.version = None
+            return None
+
+        for link_id in upserted + deleted:
+            self.invalidate_link(link_id)
+        self.version = max(self.version, version)
+        return self.version
+
+    def get(self, query_vector: list, resolved_filters: dict):
+        """
+        Returns the cached (documents, response_text) of the most similar query with the same filters or None.
+        """
+        if self.max_size <= 0:
+            return None
+
+        self._expire()
+        filters_key = canonicalize_filters(resolved_filters)
+        candidates = [(entry_id, entry) for entry_id, entry in self._entries.items() if entry["filters_key"] == filters_key]
+
+        if candidates:
+            similarities = np.stack([entry["vector"] for _, entry in candidates]) @ self._normalize(query_vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                entry_id, entry = candidates[best]
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                logger.info(f"Semantic cache hit with similarity {similarities[best]:.4f}")
+                return entry["documents"], entry["response_text"]
+
+        self.misses += 1
+        return None
+
+    def put(self, query_vector: list, resolved_filters: dict, documents: list, response_text: str, version: int = None):
+        """
+        Stores the result of a query, evicting the least recently used entries above max_size. A result retrieved at
+        an older version than the cache is up to date with might contain changed links and is not stored.
+
+        Args:
+            version (int): The version sync returned before the documents were retrieved.
+        """
+        if self.max_size <= 0 or version is None or version != self.version:
+            return
+
+        self._entries[self._next_id] = {
+            "vector": self._normalize(query_vector),
+            "filters_key": canonicalize_filters(resolved_filters),
+            "documents": documents,
+            "response_text": response_text,
+            "link_ids": {str(document.get("id_metadata")) for document in documents},
+            "created_at": time.time(),
+        }
+        self._next_id += 1
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_link(self, link_id: str):
+        """
+        Removes every entry whose documents contain the link, e.g. after it was updated, deleted or re-rated.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        stale_ids = [entry_id for entry_id, entry in self._entries.items() if str(link_id) in entry["link_ids"]]
+        for entry_id in stale_ids:
+            del self._entries[entry_id]
+        return len(stale_ids)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the size and the hit/miss counters of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "threshold": self.threshold,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    def _expire(self):
+        now = time.time()
+        expired_ids = [entry_id for entry_id, entry in self._entries.items() if now - entry["created_at"] > self.ttl_seconds]
+        for entry_id in expired_ids:
+            del self._entries[entry_id]
+
+    @staticmethod
+    def _normalize(vector: list):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+# Shared by the query, link and rating routes of a worker.
+# RESPONSE_CACHE_SIZE=0 disables the cache
+response_cache = SemanticResponseCache(
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", 256)),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 600)),
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+)
@@ -0,0 +1,282 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+import httpx
+from tortoise.expressions import Q
+from app.ormModels.scrapeJob import ScrapeJob
+from app.utils.quadrant import find_link_by_url, get_link_ids_by_url, refresh_metadata_mirror
+from app.utils.linkChangeHandler import record_link_change, UPSERT
+from app.utils.linkIngestion import normalize_url, SingleFlight
+from app.utils.pointHandler import queue_grant_points
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+PENDING_STATES = [QUEUED, RUNNING]
+
+SCRAPE_POINTS = 100
+
+
+def scrape_job_to_dict(job: ScrapeJob):
+    """
+    Converts a scrape job into the JSON returned by /api/links/jobs/<id>
+    """
+    return {
+        "id": str(job.id),
+        "url": job.url,
+        "status": job.status,
+        "link_id": job.link_id,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+class ScrapeJobDispatcher:
+    '''
+    Sends submitted links to the scraping worker in the background through one pooled HTTP client (keep-alive,
+    bounded connections and timeouts), at most max_concurrency at a time. The state of every submission is a
+    ScrapeJob row, points are granted when its scrape succeeded.
+
+    Every pending job is leased by the process that runs it. The lease is renewed every lease_seconds / 3, a job
+    whose lease expired (its process stopped or crashed) is claimed by the next process that checks the pending
+    jobs. The claim is a conditional update, so a job is only ever dispatched by one process.
+    '''
+
+    def __init__(self, worker_url: str, collection_metadata: str, max_concurrency: int = 4, timeout_seconds: float = 300, lease_seconds: float = 60):
+        self.worker_url = worker_url
+        self.collection_metadata = collection_metadata
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._client = None
+        self._semaphore = None
+        self._lease_task = None
+        self._tasks = set()
+        self._submissions = SingleFlight() # concurrent submissions of the same URL get the same job
+
+    def start(self):
+        """
+        Creates the pooled HTTP client, called on startup or with the first submission.
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url="http://" + self.worker_url,
+                timeout=httpx.Timeout(self.timeout_seconds, connect=10),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._lease_task is None:
+            self._lease_task = asyncio.create_task(self._keep_leases())
+
+    async def stop(self):
+        """
+        Cancels the running jobs and closes the HTTP client. Cancelled jobs stay pending, their leases are released so
+        the next process that starts (or checks its leases) resumes them right away.
+        """
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+            await asyncio.gather(self._lease_task, return_exceptions=True)
+            self._lease_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await ScrapeJob.filter(owner=self.owner, status__in=PENDING_STATES).update(lease_until=None)
+        except Exception as e:
+            logger.error(f"Error releasing the scrape job leases: {e}")
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def resume_pending(self):
+        """
+        Claims and dispatches the pending jobs without a valid lease, i.e. the jobs whose process stopped or crashed.
+        A job claimed by another process at the same time is skipped.
+
+        Returns:
+            int: The number of resumed jobs.
+        """
+        now = self._now()
+        jobs = await ScrapeJob.filter(self._lease_expired(now), status__in=PENDING_STATES).order_by("created_at")
+        resumed = 0
+        for job in jobs:
+            claimed = await ScrapeJob.filter(self._lease_expired(now), id=job.id, status__in=PENDING_STATES).update(
+                owner=self.owner, lease_until=self._lease_end(),
+            )
+            if claimed == 1:
+                self._dispatch(job)
+                resumed += 1
+        return resumed
+
+    async def submit(self, url: str, title: str = "", link_type: str = "", user: dict = None):
+        """
+        Creates a job for a link and dispatches it, unless the link is already stored or being scraped.
+
+        Args:
+            url (str): The URL of the link.
+            title (str): The title of the link.
+            link_type (str): The type of the link.
+            user (dict): The 'id' and 'name' of the submitting user.
+
+        Returns:
+            ScrapeJob: The new job, the pending job of the same URL or a finished job with status 'duplicate'.
+        """
+        # The job keeps the normalized URL, the lookup gets the submitted one to also match links stored before normalization
+        normalized_url = normalize_url(url)
+        user = user or {}
+        job, _ = await self._submissions.run(normalized_url, lambda: self._create_job(normalized_url, url, title, link_type, user))
+        return job
+
+    async def submit_many(self, links: list):
+        """
+        Submits many links, at most max_concurrency lookups at a time.
+
+        Args:
+            links (List[dict]): The links with 'url' and optional 'title', 'type' and 'user'.
+
+        Returns:
+            List[ScrapeJob]: The jobs in the order of the links.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def submit_link(link):
+            async with semaphore:
+                return await self.submit(link["url"], link.get("title", ""), link.get("type", ""), link.get("user"))
+
+        return await asyncio.gather(*(submit_link(link) for link in links))
+
+    async def _create_job(self, url: str, submitted_url: str, title: str, link_type: str, user: dict):
+        pending_job = await ScrapeJob.filter(url=url, status__in=PENDING_STATES).first()
+        if pending_job:
+            return pending_job
+
+        job = ScrapeJob(url=url, title=title or "", link_type=link_type or "", user_id=user.get("id", ""), user_name=user.get("name", ""))
+        existing = await find_link_by_url(self.collection_metadata, submitted_url)
+        if existing:
+            job.status = DUPLICATE
+            job.link_id = str(existing["id"])
+            await job.save()
+            return job
+
+        job.status = QUEUED
+        job.owner = self.owner
+        job.lease_until = self._lease_end()
+        await job.save()
+        self._dispatch(job)
+        return job
+
+    def _dispatch(self, job: ScrapeJob):
+        self.start()
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: ScrapeJob):
+        async with self._semaphore:
+            try:
+                if not await self._set_state(job, status=RUNNING):
+                    return
+                await self._scrape(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scrape job {job.id} for {job.url} failed: {e}")
+                job.status = FAILED
+                job.error = str(e)
+            await self._set_state(job, status=job.status, link_id=job.link_id, error=job.error, lease_until=None)
+
+    async def _set_state(self, job: ScrapeJob, **values):
+        # Only the owner writes the job, a process that lost its lease (e.g. stalled longer than lease_seconds) stops
+        for field, value in values.items():
+            setattr(job, field, value)
+        job.updated_at = self._now()
+        updated = await ScrapeJob.filter(id=job.id, owner=self.owner).update(updated_at=job.updated_at, **values)
+        if updated != 1:
+            logger.warning(f"Scrape job {job.id} for {job.url} is run by another process now")
+        return updated == 1
+
+    async def _keep_leases(self):
+        # Renews the leases of this process and claims the pending jobs of stopped or crashed processes
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await ScrapeJob.filter(owner=self.owner, status__in=PENDING_STATES).update(lease_until=self._lease_end())
+                resumed_jobs = await self.resume_pending()
+                if resumed_jobs:
+                    logger.info(f"Resumed {resumed_jobs} scrape jobs with an expired lease")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error renewing the scrape job leases: {e}")
+
+    def _lease_end(self):
+        return self._now() + datetime.timedelta(seconds=self.lease_seconds)
+
+    @staticmethod
+    def _lease_expired(now: datetime.datetime):
+        return Q(lease_until__isnull=True) | Q(lease_until__lt=now)
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    async def _scrape(self, job: ScrapeJob):
+        # A link scraped since the job was queued (e.g. by another worker) is not scraped again
+        existing = await find_link_by_url(self.collection_metadata, job.url)
+        if existing:
+            job.status = DUPLICATE
+            job.link_id = str(existing["id"])
+            return
+
+        response = await self._client.post("/scrape", json={
+            "url": job.url,
+            "title": job.title,
+            "type": job.link_type,
+            "user": {"id": job.user_id, "name": job.user_name},
+        })
+        if response.status_code != 200:
+            job.status = FAILED
+            job.error = f"Scraping API error ({response.status_code}): {response.text}"
+            return
+
+        await queue_grant_points(job.user_id, SCRAPE_POINTS, "link")
+        job.status = SUCCEEDED
+
+        # The worker wrote the new metadata point, pick it up in the metadata mirror and the change log
+        try:
+            await refresh_metadata_mirror()
+            link_ids = await get_link_ids_by_url(self.collection_metadata, job.url)
+            for link_id in link_ids:
+                await record_link_change(link_id, UPSERT)
+            job.link_id = str(link_ids[0]) if link_ids else None
+        except Exception as e:
+            logger.error(f"Error registering the link of scrape job {job.id}: {e}")
+
+
+def create_scrape_job_dispatcher():
+    """
+    Creates the scrape job dispatcher from the environment (WORKER_URL, COLLECTION_METADATA, SCRAPE_MAX_CONCURRENCY,
+    SCRAPE_TIMEOUT_SECONDS, SCRAPE_LEASE_SECONDS).
+
+    Returns:
+        ScrapeJobDispatcher: The new dispatcher, its HTTP client is created on startup or with the first submission.
+    """
+    return ScrapeJobDispatcher(
+        worker_url=os.getenv("WORKER_URL", "localhost:8000"),
+        collection_metadata=os.getenv("COLLECTION_METADATA", "metadata_collection"),
+        max_concurrency=int(os.getenv("SCRAPE_MAX_CONCURRENCY", 4)),
+        timeout_seconds=float(os.getenv("SCRAPE_TIMEOUT_SECONDS", 300)),
+        lease_seconds=float(os.getenv("SCRAPE_LEASE_SECONDS", 60)),
+    )
+
+
+scrape_jobs = create_scrape_job_dispatcher()
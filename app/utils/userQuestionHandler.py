@@ -1,41 +1,206 @@
-from app.ormModels.userQuestionHistorie import UserQuestion
+import datetime
+import json
+import os
+import zlib
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+from app.ormModels.userQuestionHistorie import UserQuestion, UserQuestionSlot, UserQuestionCounter
+from app.utils.writeBehind import write_behind
+
+
+QUESTION_HISTORY = "question_history"
+
+# Number of questions kept per user and whether their responses are stored zlib compressed
+QUESTION_HISTORY_SIZE = max(3, int(os.getenv("QUESTION_HISTORY_SIZE", 3)))
+QUESTION_HISTORY_COMPRESS = os.getenv("QUESTION_HISTORY_COMPRESS", "true").lower() in ("1", "true", "yes")
+
+
+def compact_response(response: object):
+    """
+    Reduces a query response to the response text and the point ids and scores of its documents
+
+    Args:
+        response (json object): The response with "response_text" and "documents" as returned by /api/query
+
+    Returns:
+        dict: The response text and the documents as {"id", "score"}
+    """
+    response = response or {}
+    return {
+        "response_text": response.get("response_text"),
+        "documents": [
+            {"id": document.get("id_metadata", document.get("id")), "score": round(document["score"], 4) if document.get("score") is not None else None}
+            for document in response.get("documents") or []
+        ],
+    }
+
+
+def pack_response(response: dict, compress: bool = QUESTION_HISTORY_COMPRESS):
+    """
+    Serializes a compact response for the payload column
+
+    Returns:
+        Tuple[bytes, bool]: The payload and whether it is compressed
+    """
+    payload = json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if compress:
+        return zlib.compress(payload), True
+    return payload, False
+
+
+def unpack_response(payload: bytes, compressed: bool):
+    """
+    Reads a payload written by pack_response
+    """
+    if payload is None:
+        return None
+    return json.loads(zlib.decompress(payload) if compressed else payload)
 
 
 async def add_requested_question(user_id: str, question: str, response: object):
     """
     Adds a question to the historie of questions from a user
     For Sandip: You can adapt the logic here what happens when a question is being added
-    
+
     Args:
         user_id (str): ID of the user
         question (str): The question the user asked
         response (json object): The response with document and server response the user recieved
-    
+
     Returns:
         The question the user asked
     """
+    await add_requested_questions([{"user_id": user_id, "question": question, "response": compact_response(response)}])
+    return question
+
+
+async def add_requested_questions(entries: list):
+    """
+    Adds many questions to the historie, every question overwrites the oldest slot of its user.
+    The sequences are reserved with one atomic increment of the counter of each user, so workers that write questions
+    of the same user at the same time never get the same slot, and a slot only takes a newer question than it holds.
+
+    Args:
+        entries (list): Dicts with user_id, question and the compact response, oldest first
+    """
     try:
-        await UserQuestion.create(user_id=user_id, question=question, response=response)
-        count = await UserQuestion.filter(user_id=user_id).count()
+        entries_by_user = {}
+        for entry in entries:
+            entries_by_user.setdefault(entry["user_id"], []).append(entry)
+        await ensure_question_slots(list(entries_by_user))
+
+        async with in_transaction() as connection:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for user_id, user_entries in entries_by_user.items():
+                # The row lock of the update keeps concurrent writers of the user apart until the commit
+                await UserQuestionCounter.filter(user_id=user_id).using_db(connection).update(next_sequence=F("next_sequence") + len(user_entries))
+                counter = await UserQuestionCounter.get(user_id=user_id).using_db(connection)
+                first_sequence = counter.next_sequence - len(user_entries)
 
-        if count > 3:
-            # Delete the oldest question (For Sandip: You should remove that the 4th last question is deleted here)
-            to_delete = await UserQuestion.filter(user_id=user_id).order_by("created_at").limit(count - 3).values_list("id", flat=True)
-            await UserQuestion.filter(id__in=to_delete).delete()
+                # Only the last QUESTION_HISTORY_SIZE questions of a user survive, so every slot is written once
+                slots = {}
+                for sequence, entry in enumerate(user_entries, start=first_sequence):
+                    slots[sequence % QUESTION_HISTORY_SIZE] = (sequence, entry)
+
+                for slot, (sequence, entry) in slots.items():
+                    payload, compressed = pack_response(entry["response"])
+                    await UserQuestionSlot.filter(user_id=user_id, slot=slot, sequence__lt=sequence).using_db(connection).update(
+                        sequence=sequence,
+                        question=entry["question"],
+                        payload=payload,
+                        compressed=compressed,
+                        created_at=now,
+                    )
     except Exception as e:
-        raise RuntimeError(f"Failed to add_question: {str(e)}")
+        raise RuntimeError(f"Failed to add_questions: {str(e)}")
+
+
+async def ensure_question_slots(user_ids: list):
+    """
+    Creates the counter and the empty slots of users that have none yet, and the slots missing after
+    QUESTION_HISTORY_SIZE was increased. The counter of a user with slots continues after its newest question.
+
+    Args:
+        user_ids (list): IDs of the users
+    """
+    rows = await UserQuestionSlot.filter(user_id__in=user_ids).values("user_id", "slot", "sequence")
+    counter_ids = set(await UserQuestionCounter.filter(user_id__in=user_ids).values_list("user_id", flat=True))
+
+    existing_slots = {}
+    next_sequences = {}
+    for row in rows:
+        existing_slots.setdefault(row["user_id"], set()).add(row["slot"])
+        next_sequences[row["user_id"]] = max(next_sequences.get(row["user_id"], 0), row["sequence"] + 1)
 
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for user_id in user_ids:
+        missing_slots = [slot for slot in range(QUESTION_HISTORY_SIZE) if slot not in existing_slots.get(user_id, set())]
+        if user_id in counter_ids and not missing_slots:
+            continue
+        try:
+            async with in_transaction() as connection:
+                if user_id not in counter_ids:
+                    await UserQuestionCounter.create(user_id=user_id, next_sequence=next_sequences.get(user_id, 0), using_db=connection)
+                await UserQuestionSlot.bulk_create(
+                    [UserQuestionSlot(user_id=user_id, slot=slot, sequence=-1, question="", created_at=now) for slot in missing_slots],
+                    using_db=connection,
+                )
+        except IntegrityError:
+            # Another worker created them in the meantime
+            pass
+
+
+async def queue_requested_question(user_id: str, question: str, response: object):
+    """
+    Adds a question to the historie in the background, the caller does not wait for the write
+
+    Args:
+        user_id (str): ID of the user
+        question (str): The question the user asked
+        response (json object): The response with document and server response the user recieved
+    """
+    await write_behind.submit(QUESTION_HISTORY, {"user_id": user_id, "question": question, "response": compact_response(response)})
 
 
 async def get_last_three_questions(user_id: str):
     """
     Gets the last three questions a user asked
-    
+
     Args:
         user_id (str): ID of the user
-    
+
     Returns:
       the last three questions a user asked
     """
-    questions = await UserQuestion.filter(user_id=user_id).order_by("-created_at").limit(3).values_list("question", flat=True)
-    return questions
+    questions = await UserQuestionSlot.filter(user_id=user_id, sequence__gte=0).order_by("-sequence").limit(3).values_list("question", flat=True)
+
+    # Questions that are still queued are the newest ones
+    pending = [entry["question"] for entry in write_behind.pending(QUESTION_HISTORY) if entry["user_id"] == user_id]
+    return (pending[::-1] + list(questions))[:3]
+
+
+async def migrate_question_history():
+    """
+    Moves the last questions of every user from the old user_questions table into the question slots and empties it
+
+    Returns:
+        int: The number of migrated questions
+    """
+    user_ids = await UserQuestion.all().distinct().values_list("user_id", flat=True)
+    migrated = 0
+    for user_id in user_ids:
+        if await UserQuestionSlot.filter(user_id=user_id, sequence__gte=0).exists():
+            continue
+        questions = await UserQuestion.filter(user_id=user_id).order_by("-created_at", "-id").limit(QUESTION_HISTORY_SIZE)
+        await add_requested_questions([
+            {"user_id": user_id, "question": question.question, "response": compact_response(question.response)}
+            for question in reversed(questions)
+        ])
+        migrated += len(questions)
+
+    await UserQuestion.all().delete()
+    return migrated
+
+
+write_behind.register(QUESTION_HISTORY, add_requested_questions)
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# A batch that failed this often is dropped, so a broken entry does not block the queue forever
+MAX_FLUSH_ATTEMPTS = 3
+
+
+class WriteBehindQueue:
+    '''
+    Takes bookkeeping writes (question history, point grants) off the request path: submit only appends the entry to
+    the queue of its kind and a background task hands the entries in batches to the writer registered for the kind,
+    which writes them in one transaction. The queue holds at most max_size entries, when it is full submit waits for
+    the next flush instead of growing. stop flushes everything that is left.
+    '''
+
+    def __init__(self, flush_interval_ms: float = 200, batch_size: int = 500, max_size: int = 10000):
+        self.flush_interval_ms = flush_interval_ms
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self._writers = {}
+        self._queues = {}
+        self._size = 0
+        self._worker = None
+        self._wakeup = None
+        self._space = None
+        self._stopping = False
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_flush_ms = None
+
+    def register(self, kind: str, writer):
+        """
+        Registers the coroutine function that writes a list of entries of a kind.
+        """
+        self._writers[kind] = writer
+        self._queues.setdefault(kind, deque())
+
+    def start(self):
+        """
+        Starts the background flush task on the running event loop.
+        """
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._stopping = False
+            self._worker = asyncio.create_task(self._run())
+            logger.info(f"Write-behind queue started (flush every {self.flush_interval_ms} ms, batch size {self.batch_size})")
+
+    async def stop(self):
+        """
+        Stops the background task after the batch it is writing and writes all entries that are still queued.
+        """
+        if self._worker is not None:
+            # Cancelling the task could interrupt a write, let it finish its current flush and exit instead
+            self._stopping = True
+            self._wakeup.set()
+            await self._worker
+            self._worker = None
+
+        # Failed batches stay queued for a retry until they were attempted MAX_FLUSH_ATTEMPTS times
+        for _ in range(MAX_FLUSH_ATTEMPTS):
+            await self.flush()
+            if not self._size:
+                break
+        self._wakeup = None
+        self._space = None
+
+    async def submit(self, kind: str, entry):
+        """
+        Queues an entry for its writer, waits only while the queue is full. Without a running background task the
+        entry is written right away.
+        """
+        if kind not in self._writers:
+            raise ValueError(f"No writer registered for {kind}.")
+
+        if self._worker is None:
+            self._queues[kind].append((entry, 0))
+            self._size += 1
+            await self.flush()
+            return
+
+        async with self._space:
+            while self._size >= self.max_size:
+                self._wakeup.set()
+                await self._space.wait()
+            self._queues[kind].append((entry, 0))
+            self._size += 1
+
+        if len(self._queues[kind]) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self, kind: str):
+        """
+        Returns the entries of a kind that are not written yet, oldest first, e.g. to merge them into reads.
+        """
+        return [entry for entry, _ in self._queues.get(kind, ())]
+
+    async def flush(self):
+        """
+        Writes all queued entries, one batch after another.
+
+        Returns:
+            int: The number of written entries.
+        """
+        start = time.perf_counter()
+        written = 0
+        for kind, queue in self._queues.items():
+            while queue:
+                batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+                try:
+                    await self._writers[kind]([entry for entry, _ in batch])
+                    written += len(batch)
+                except asyncio.CancelledError:
+                    # Whether the write went through is unknown, the entries are written again rather than lost
+                    queue.extendleft(reversed(batch))
+                    raise
+                except Exception as e:
+                    self.failures += 1
+                    retry = [(entry, attempts + 1) for entry, attempts in batch if attempts + 1 < MAX_FLUSH_ATTEMPTS]
+                    self.dropped += len(batch) - len(retry)
+                    logger.error(f"Error writing {len(batch)} {kind} entries ({len(retry)} kept for a retry): {e}")
+                    queue.extendleft(reversed(retry))
+                    self._size -= len(batch) - len(retry)
+                    break
+                self._size -= len(batch)
+
+        self.flushed += written
+        if written:
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+
+        # Wake up submissions that wait for space
+        if self._space is not None:
+            async with self._space:
+                self._space.notify_all()
+        return written
+
+    def stats(self):
+        """
+        Returns the queue depth per kind and the flush counters.
+        """
+        return {
+            "depth": self._size,
+            "depth_by_kind": {kind: len(queue) for kind, queue in self._queues.items()},
+            "max_size": self.max_size,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing the write-behind queue: {e}")
+
+
+def create_write_behind_queue():
+    """
+    Creates the write-behind queue from the environment (WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_MAX_SIZE).
+    """
+    return WriteBehindQueue(
+        flush_interval_ms=float(os.getenv("WRITE_BEHIND_FLUSH_MS", 200)),
+        batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500)),
+        max_size=int(os.getenv("WRITE_BEHIND_MAX_SIZE", 10000)),
+    )
+
+
+write_behind = create_write_behind_queue()
@@ -0,0 +1,84 @@
+"""
+Compares load time, memory and single-query latency of the torch, ONNX and int8 quantized ONNX embedding backends.
+Each backend is measured in a fresh process, so the memory numbers do not include the other backends.
+
+Export the ONNX model first with `quart export-onnx-model --output onnx_model`.
+
+Usage:
+    python -m benchmarks.embedding_backend_benchmark --onnx-path onnx_model
+"""
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+QUERY = "Wie kann ein Unternehmen seine CO2-Emissionen reduzieren?"
+
+
+def load_backend_module():
+    # Load embeddingBackend.py on its own: importing it through the app package would load the torch model of quadrant.py
+    # into the process and distort the memory measurement
+    path = os.path.join(os.path.dirname(__file__), "..", "app", "utils", "embeddingBackend.py")
+    spec = importlib.util.spec_from_file_location("embeddingBackend", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(backend: str, model_name: str, onnx_path: str, repetitions: int):
+    """
+    Loads one backend in the current process and returns its load time, peak RSS and encode latencies.
+    """
+    embedding_backend = load_backend_module()
+    start = time.perf_counter()
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, trust_remote_code=True)
+    else:
+        model = embedding_backend.OnnxEmbeddingBackend(onnx_path, model_name, quantized=backend == "onnx-int8", min_similarity=0)
+    load_seconds = time.perf_counter() - start
+
+    model.encode([QUERY])
+    latencies = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        model.encode([QUERY])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-name", default=os.getenv("MODEL_NAME", "Alibaba-NLP/gte-multilingual-base"))
+    parser.add_argument("--onnx-path", default=os.getenv("EMBEDDING_ONNX_PATH", "onnx_model"))
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(measure(args.single, args.model_name, args.onnx_path, args.repetitions)))
+        sys.exit(0)
+
+    print(f"{'backend':>10} {'load (s)':>9} {'peak RSS (MB)':>14} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for backend in args.backends:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.embedding_backend_benchmark", "--single", backend,
+             "--model-name", args.model_name, "--onnx-path", args.onnx_path, "--repetitions", str(args.repetitions)],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(f"{backend:>10} {result['load_seconds']:>9} {result['peak_rss_mb']:>14} {result['p50_ms']:>9} {result['p95_ms']:>9}")
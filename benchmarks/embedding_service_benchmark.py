@@ -0,0 +1,65 @@
+"""
+Compares encoding concurrent queries inline (model.encode inside the request coroutine, as before) with the
+micro-batching EmbeddingService, reporting requests per second and p99 latency.
+
+Usage:
+    python -m benchmarks.embedding_service_benchmark --requests 256 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import time
+from app.utils.quadrant import model
+from app.utils.embeddingService import EmbeddingService
+
+QUERIES = [
+    "Wie kann ein Unternehmen seine CO2-Emissionen reduzieren?",
+    "Was ist nachhaltige Finanzierung?",
+    "Welche Regulierungen gelten für das Nachhaltigkeitsreporting?",
+    "Welche Förderprogramme gibt es für erneuerbare Energien?",
+]
+
+
+async def run_level(encode, concurrency: int, total_requests: int):
+    """
+    Runs total_requests encodes with at most `concurrency` in flight and returns (requests/s, p99 latency in ms).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def single(n: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await encode(f"{QUERIES[n % len(QUERIES)]} ({n})")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(single(n) for n in range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return total_requests / elapsed, latencies[max(0, int(len(latencies) * 0.99) - 1)]
+
+
+async def run(levels: list, total_requests: int, batch_size: int, wait_ms: float):
+    async def encode_inline(text: str):
+        return model.encode([text])[0].tolist()
+
+    service = EmbeddingService(model, max_batch_size=batch_size, max_wait_ms=wait_ms)
+
+    print(f"{'parallel':>8} {'inline req/s':>13} {'inline p99 (ms)':>16} {'batched req/s':>14} {'batched p99 (ms)':>17}")
+    for concurrency in levels:
+        inline = await run_level(encode_inline, concurrency, total_requests)
+        batched = await run_level(service.encode, concurrency, total_requests)
+        print(f"{concurrency:>8} {inline[0]:>13.1f} {inline[1]:>16.1f} {batched[0]:>14.1f} {batched[1]:>17.1f}")
+
+    await service.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.requests, args.batch_size, args.wait_ms))
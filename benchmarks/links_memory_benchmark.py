@@ -0,0 +1,65 @@
+"""
+Measures the peak memory a worker allocates to serve /api/links/all for growing metadata collections: one scroll
+over all points serialized with a single json.dumps (the previous get_documents) vs. the page by page streaming of
+iter_document_pages, which should stay flat.
+
+Usage:
+    python -m benchmarks.links_memory_benchmark --location http://localhost:6333 --links 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+from app.utils import quadrant
+from benchmarks.synthetic import connect, seed_collections
+
+COLLECTION_CHUNK = "bench_chunk_collection"
+COLLECTION_METADATA = "bench_metadata_collection"
+
+
+async def measure(function):
+    """
+    Returns the peak of newly allocated memory in MB and the duration in ms of a coroutine function.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    await function()
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024, elapsed
+
+
+async def run(location: str, link_counts: list, page_size: int):
+    client = connect(location)
+    quadrant.qdrant_client = client
+
+    async def full_listing():
+        collection_info = await client.get_collection(COLLECTION_METADATA)
+        records, _ = await client.scroll(COLLECTION_METADATA, limit=collection_info.points_count, with_payload=True, with_vectors=False)
+        json.dumps({"documents": [{"id": record.id, "metadata": record.payload.get("metadata", {})} for record in records]})
+
+    async def streamed_listing():
+        async for page in quadrant.iter_document_pages(COLLECTION_METADATA, page_size=page_size):
+            ", ".join(json.dumps(document) for document in page)
+
+    print(f"{'links':>7} {'full (MB)':>10} {'full (ms)':>10} {'streamed (MB)':>14} {'streamed (ms)':>14}")
+    for link_count in link_counts:
+        await seed_collections(client, COLLECTION_CHUNK, COLLECTION_METADATA, link_count, chunks_per_link=0, dim=8)
+        full_mb, full_ms = await measure(full_listing)
+        streamed_mb, streamed_ms = await measure(streamed_listing)
+        print(f"{link_count:>7} {full_mb:>10.1f} {full_ms:>10.0f} {streamed_mb:>14.1f} {streamed_ms:>14.0f}")
+
+    await client.delete_collection(COLLECTION_CHUNK)
+    await client.delete_collection(COLLECTION_METADATA)
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--links", type=int, nargs="+", default=[5000, 20000])
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.location, args.links, args.page_size))
@@ -0,0 +1,122 @@
+"""
+Compares the old blocking chain.invoke with chain.ainvoke and chain.astream as used by /api/query and
+/api/query/stream, with a local fake LLM that answers after --first-token-ms and then emits a token every --token-ms.
+
+For every mode it runs --concurrency generations at once and reports the time to the first byte a client would
+receive, the total time and the longest stall of the event loop (measured by a 1 ms heartbeat task). With invoke the
+loop is blocked for the whole generation and concurrent requests run one after another.
+
+Usage:
+    python -m benchmarks.llm_streaming_benchmark --concurrency 10 --tokens 100
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from app.utils import llm
+
+DOCUMENTS = [
+    {"metadata": {"url": f"https://example.com/{n}", "summary": "Zusammenfassung"}, "chunk": "Relevanter Abschnitt"}
+    for n in range(10)
+]
+
+
+class FakeLatencyChatModel(BaseChatModel):
+    '''
+    Chat model that simulates the latency of a remote LLM: the sync API sleeps like a blocking HTTP call,
+    the async API awaits, so only the sync path blocks the event loop.
+    '''
+    tokens: int = 100
+    first_token_ms: float = 300
+    token_ms: float = 10
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-latency"
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep((self.first_token_ms + self.tokens * self.token_ms) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="x " * self.tokens))])
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep((self.first_token_ms + self.tokens * self.token_ms) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="x " * self.tokens))])
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for _ in range(self.tokens):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="x "))
+            await asyncio.sleep(self.token_ms / 1000)
+
+
+async def heartbeat(stalls: list, interval: float = 0.001):
+    """
+    Records how much later than scheduled each 1 ms sleep returns, i.e. how long the event loop was blocked.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        stalls.append(loop.time() - scheduled)
+
+
+async def generate(mode: str):
+    """
+    Runs one generation and returns (time to first byte, total time) in ms.
+    """
+    start = time.perf_counter()
+    inputs = {"context": llm.build_context("Was ist nachhaltige Finanzierung?", DOCUMENTS), "question": "Was ist nachhaltige Finanzierung?"}
+
+    if mode == "invoke":
+        llm.create_chain().invoke(inputs)
+    elif mode == "ainvoke":
+        await llm.generate_response_from_retrieved_documents("Was ist nachhaltige Finanzierung?", DOCUMENTS)
+    else:
+        first_byte = None
+        async for _ in llm.stream_response_from_retrieved_documents("Was ist nachhaltige Finanzierung?", DOCUMENTS):
+            if first_byte is None:
+                first_byte = (time.perf_counter() - start) * 1000
+        return first_byte, (time.perf_counter() - start) * 1000
+
+    # Without streaming the client gets its first byte with the complete answer
+    total = (time.perf_counter() - start) * 1000
+    return total, total
+
+
+async def run_mode(mode: str, concurrency: int):
+    stalls = []
+    monitor = asyncio.create_task(heartbeat(stalls))
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(generate(mode) for _ in range(concurrency)))
+    elapsed = (time.perf_counter() - start) * 1000
+
+    # Let the heartbeat record the stall that ended with the last generation
+    await asyncio.sleep(0.01)
+    monitor.cancel()
+    first_bytes = [first_byte for first_byte, _ in results]
+    return statistics.median(first_bytes), max(first_bytes), elapsed, max(stalls) * 1000
+
+
+async def run(concurrency: int, tokens: int, first_token_ms: float, token_ms: float):
+    llm.llm_model = FakeLatencyChatModel(tokens=tokens, first_token_ms=first_token_ms, token_ms=token_ms)
+
+    print(f"{'mode':>8} {'TTFB p50 (ms)':>14} {'TTFB max (ms)':>14} {'total (ms)':>11} {'max loop stall (ms)':>20}")
+    for mode in ["invoke", "ainvoke", "astream"]:
+        ttfb_p50, ttfb_max, elapsed, stall = await run_mode(mode, concurrency)
+        print(f"{mode:>8} {ttfb_p50:>14.1f} {ttfb_max:>14.1f} {elapsed:>11.1f} {stall:>20.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.tokens, args.first_token_ms, args.token_ms))
@@ -0,0 +1,70 @@
+"""
+Measures how long the metadata filter of a query takes when the matching link ids are scrolled from Qdrant
+(get_point_ids) vs. evaluated as NumPy masks on the in-process metadata mirror, for growing metadata collections.
+
+Usage:
+    python -m benchmarks.metadata_mirror_benchmark --location http://localhost:6333 --links 1000 10000 50000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from app.utils import quadrant
+from app.utils.collectionSetup import SCORE_FIELDS
+from app.utils.metadataMirror import MetadataMirror
+from benchmarks.synthetic import connect, seed_collections
+
+COLLECTION_CHUNK = "bench_chunk_collection"
+COLLECTION_METADATA = "bench_metadata_collection"
+FILTERS = {"linkTypes": ["report", "article"], "categoryFilters": {"co2_score": [20, 80], "reduk_score": [0, 60]}}
+
+
+async def time_ms(function, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+async def run(location: str, link_counts: list, repeat: int):
+    client = connect(location)
+    quadrant.qdrant_client = client
+    # An empty mirror that covers no collection, so resolve_chunk_filter scrolls Qdrant
+    quadrant.metadata_mirror = MetadataMirror("", SCORE_FIELDS, quadrant.RATING_PAYLOAD_KEY)
+    resolved_filters = quadrant.resolve_filters(FILTERS)
+
+    print(f"{'links':>7} {'load (ms)':>10} {'qdrant (ms)':>12} {'mirror (ms)':>12} {'matches':>8}")
+    for link_count in link_counts:
+        await seed_collections(client, COLLECTION_CHUNK, COLLECTION_METADATA, link_count, chunks_per_link=1, dim=8)
+        mirror = MetadataMirror(COLLECTION_METADATA, SCORE_FIELDS, quadrant.RATING_PAYLOAD_KEY)
+
+        start = time.perf_counter()
+        await mirror.load(client)
+        load = (time.perf_counter() - start) * 1000
+
+        async def from_mirror():
+            return mirror.filter_ids(resolved_filters)
+
+        async def from_qdrant():
+            result = await quadrant.resolve_chunk_filter(COLLECTION_METADATA, resolved_filters)
+            return result.must[0].match.any if result else []
+
+        qdrant_ms, qdrant_ids = await time_ms(from_qdrant, repeat)
+        mirror_ms, mirror_ids = await time_ms(from_mirror, repeat)
+        assert sorted(qdrant_ids) == sorted(mirror_ids), "mirror and Qdrant disagree"
+        print(f"{link_count:>7} {load:>10.1f} {qdrant_ms:>12.2f} {mirror_ms:>12.3f} {len(mirror_ids):>8}")
+
+    await client.delete_collection(COLLECTION_CHUNK)
+    await client.delete_collection(COLLECTION_METADATA)
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--links", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.location, args.links, args.repeat))
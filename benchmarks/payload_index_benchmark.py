@@ -0,0 +1,77 @@
+"""
+Measures filtered query latency on the chunk and metadata collections before and after the payload indexes
+from app/utils/collectionSetup.py are created.
+
+Local mode (':memory:' or a path) evaluates every filter by brute force and ignores payload indexes, so it only
+gives the baseline. Point --location at a Qdrant server (e.g. http://localhost:6333) to see the effect of the indexes.
+
+Usage:
+    python -m benchmarks.payload_index_benchmark --location http://localhost:6333 --links 20000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from qdrant_client.models import Filter
+from app.utils.collectionSetup import ensure_collection, CHUNK_PAYLOAD_INDEXES, METADATA_PAYLOAD_INDEXES
+from benchmarks.synthetic import connect, seed_collections, random_vectors
+
+COLLECTION_CHUNK = "bench_chunk_collection"
+COLLECTION_METADATA = "bench_metadata_collection"
+
+
+async def measure(client, link_ids: list, dim: int, repetitions: int):
+    """
+    Runs the two filtered queries of query_qdrant and returns the median latency of each in milliseconds.
+    """
+    rng = random.Random(7)
+    metadata_filter = Filter.model_validate({"must": [
+        {"key": "metadata.link_type", "match": {"any": ["report"]}},
+        {"key": "metadata.co2_score", "range": {"gte": 20, "lte": 60}},
+    ]})
+    metadata_timings = []
+    chunk_timings = []
+
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        await client.scroll(COLLECTION_METADATA, scroll_filter=metadata_filter, limit=len(link_ids), with_payload=False)
+        metadata_timings.append((time.perf_counter() - start) * 1000)
+
+        chunk_filter = Filter.model_validate({"must": [{"key": "link_id", "match": {"any": rng.sample(link_ids, max(1, len(link_ids) // 20))}}]})
+        start = time.perf_counter()
+        await client.query_points_groups(
+            COLLECTION_CHUNK, query=random_vectors(1, dim, rng)[0], query_filter=chunk_filter, group_by="url", limit=10, group_size=1
+        )
+        chunk_timings.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(metadata_timings), statistics.median(chunk_timings)
+
+
+async def run(location: str, link_count: int, chunks_per_link: int, dim: int, repetitions: int):
+    client = connect(location)
+    link_ids = await seed_collections(client, COLLECTION_CHUNK, COLLECTION_METADATA, link_count, chunks_per_link, dim)
+
+    without_indexes = await measure(client, link_ids, dim, repetitions)
+    await ensure_collection(client, COLLECTION_CHUNK, dim, CHUNK_PAYLOAD_INDEXES)
+    await ensure_collection(client, COLLECTION_METADATA, dim, METADATA_PAYLOAD_INDEXES)
+    with_indexes = await measure(client, link_ids, dim, repetitions)
+
+    print(f"{'query':>22} {'no index (ms)':>14} {'indexed (ms)':>13}")
+    print(f"{'metadata filter':>22} {without_indexes[0]:>14.2f} {with_indexes[0]:>13.2f}")
+    print(f"{'chunk group search':>22} {without_indexes[1]:>14.2f} {with_indexes[1]:>13.2f}")
+
+    await client.delete_collection(COLLECTION_CHUNK)
+    await client.delete_collection(COLLECTION_METADATA)
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--links", type=int, default=2000)
+    parser.add_argument("--chunks-per-link", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--repetitions", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.location, args.links, args.chunks_per_link, args.dim, args.repetitions))
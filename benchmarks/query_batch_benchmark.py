@@ -0,0 +1,57 @@
+"""
+Compares running N questions one by one through query_qdrant with a single query_qdrant_batch call (one encode batch,
+one batch search and one metadata fetch) against synthetic collections and reports queries per second.
+
+The embedding cache is cleared before every run, so both variants pay for encoding. Point --location at a Qdrant
+server (e.g. http://localhost:6333) to include the network round trips the batch saves.
+
+Usage:
+    python -m benchmarks.query_batch_benchmark --location http://localhost:6333 --batch-sizes 10 50 100
+"""
+import argparse
+import asyncio
+import time
+from app.utils import quadrant
+from benchmarks.synthetic import seed_collections
+
+COLLECTION_CHUNK = "bench_chunk_collection"
+COLLECTION_METADATA = "bench_metadata_collection"
+
+
+async def run(location: str, link_count: int, chunks_per_link: int, batch_sizes: list):
+    await quadrant.init_qdrant_client(location)
+    dim = quadrant.model.get_sentence_embedding_dimension()
+    await seed_collections(quadrant.qdrant_client, COLLECTION_CHUNK, COLLECTION_METADATA, link_count, chunks_per_link, dim)
+    filters = {"queryLimit": 10, "linkTypes": ["report", "article"]}
+
+    print(f"{'queries':>8} {'single (q/s)':>13} {'batch (q/s)':>12} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        query_texts = [f"Frage {n} zu nachhaltiger Finanzierung und CO2-Emissionen" for n in range(batch_size)]
+
+        quadrant.embedding_cache.clear()
+        start = time.perf_counter()
+        for query_text in query_texts:
+            await quadrant.query_qdrant(COLLECTION_CHUNK, COLLECTION_METADATA, query_text, filters)
+        single = batch_size / (time.perf_counter() - start)
+
+        quadrant.embedding_cache.clear()
+        start = time.perf_counter()
+        await quadrant.query_qdrant_batch(COLLECTION_CHUNK, COLLECTION_METADATA, query_texts, filters)
+        batch = batch_size / (time.perf_counter() - start)
+
+        print(f"{batch_size:>8} {single:>13.1f} {batch:>12.1f} {batch / single:>7.1f}x")
+
+    await quadrant.embedding_service.stop()
+    await quadrant.qdrant_client.delete_collection(COLLECTION_CHUNK)
+    await quadrant.qdrant_client.delete_collection(COLLECTION_METADATA)
+    await quadrant.close_qdrant_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--chunks-per-link", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 50, 100])
+    args = parser.parse_args()
+    asyncio.run(run(args.location, args.links, args.chunks_per_link, args.batch_sizes))
@@ -0,0 +1,68 @@
+"""
+Runs query_qdrant with 1, 10 and 50 parallel requests against synthetic collections and reports throughput and latency.
+
+With the async client, requests waiting on Qdrant no longer block each other, so throughput should grow with the
+concurrency level until Qdrant or the embedding model saturates. Local mode runs Qdrant inside this process, point
+--location at a Qdrant server (e.g. http://localhost:6333) for representative numbers.
+
+Usage:
+    python -m benchmarks.query_concurrency_benchmark --location http://localhost:6333 --links 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from app.utils import quadrant
+from benchmarks.synthetic import seed_collections
+
+COLLECTION_CHUNK = "bench_chunk_collection"
+COLLECTION_METADATA = "bench_metadata_collection"
+QUERIES = ["Wie kann ein Unternehmen seine CO2-Emissionen reduzieren?", "Was ist nachhaltige Finanzierung?", "Welche Regulierungen gelten für Reporting?"]
+
+
+async def run_level(concurrency: int, total_queries: int, filters: dict):
+    """
+    Runs total_queries queries with at most `concurrency` in flight and returns (throughput, p50, p95) in queries/s and ms.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def single(n: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await quadrant.query_qdrant(COLLECTION_CHUNK, COLLECTION_METADATA, QUERIES[n % len(QUERIES)], filters)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(single(n) for n in range(total_queries)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return total_queries / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+async def run(location: str, link_count: int, chunks_per_link: int, levels: list, total_queries: int):
+    await quadrant.init_qdrant_client(location)
+    dim = quadrant.model.get_sentence_embedding_dimension()
+    await seed_collections(quadrant.qdrant_client, COLLECTION_CHUNK, COLLECTION_METADATA, link_count, chunks_per_link, dim)
+    filters = {"queryLimit": 10, "linkTypes": ["report", "article"]}
+
+    print(f"{'parallel':>8} {'queries/s':>10} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for concurrency in levels:
+        throughput, p50, p95 = await run_level(concurrency, total_queries, filters)
+        print(f"{concurrency:>8} {throughput:>10.1f} {p50:>9.1f} {p95:>9.1f}")
+
+    await quadrant.qdrant_client.delete_collection(COLLECTION_CHUNK)
+    await quadrant.qdrant_client.delete_collection(COLLECTION_METADATA)
+    await quadrant.close_qdrant_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--chunks-per-link", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.location, args.links, args.chunks_per_link, args.concurrency, args.queries))
@@ -0,0 +1,194 @@
+"""
+Benchmarks the query pipeline offline: seeds Qdrant (local mode by default) with synthetic collections of every
+--chunks size, replaces the OpenAI chat model with a deterministic fake LLM and runs query_qdrant and the full
+/api/query route (through the Quart test client) at every --concurrency level.
+
+Every run reports throughput, p50/p95/p99 latency, errors, the peak RSS of the process so far and the average duration
+of every instrumented stage. With --output the results are also written as JSON together with the commit, so runs of
+different commits can be compared. Every request asks a different question, so neither the embedding cache nor the
+semantic response cache (disabled here) answers it.
+
+Local mode keeps all vectors in this process, which limits the collection size and inflates the RSS; point
+--location at a Qdrant server (e.g. http://localhost:6333) for sizes towards 1M chunks.
+
+Usage:
+    python -m benchmarks.query_pipeline_benchmark --chunks 1000 10000 100000 --concurrency 1 10 50 --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+# The routes read the collection names on import, never let the benchmark seed the real collections
+COLLECTION_CHUNK = os.environ["COLLECTION_CHUNK"] = "bench_chunk_collection"
+COLLECTION_METADATA = os.environ["COLLECTION_METADATA"] = "bench_metadata_collection"
+
+from app import app
+from app.routes.linkProject import queryQDrant
+from app.utils import llm, quadrant
+from app.utils.instrumentation import instrumentation
+from app.utils.responseCache import response_cache
+from benchmarks.llm_streaming_benchmark import FakeLatencyChatModel
+from benchmarks.synthetic import connect, seed_collections
+
+QUERIES = ["Wie kann ein Unternehmen seine CO2-Emissionen reduzieren?", "Was ist nachhaltige Finanzierung?", "Welche Regulierungen gelten für Reporting?"]
+FILTERS = {"queryLimit": 10, "linkTypes": ["report", "article"]}
+
+
+def percentile(sorted_values: list, q: float):
+    """
+    Returns the nearest-rank q-quantile of an ascending list.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))]
+
+
+def peak_rss_mb():
+    """
+    Returns the highest resident set size of this process so far in MB (ru_maxrss is in KB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run_level(query, concurrency: int, total_queries: int):
+    """
+    Runs total_queries calls of query(n) with at most `concurrency` in flight.
+
+    Returns:
+        dict: Throughput, latency percentiles in ms and the number of failed calls.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def single(n: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await query(n)
+            except Exception:
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(single(n) for n in range(total_queries)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput_qps": round(total_queries / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+        "errors": errors,
+    }
+
+
+async def run(args):
+    if (queryQDrant.COLLECTION_CHUNK_NAME, queryQDrant.COLLECTION_METADATA_NAME) != (COLLECTION_CHUNK, COLLECTION_METADATA):
+        sys.exit("COLLECTION_CHUNK / COLLECTION_METADATA are overridden (e.g. by .env), refusing to seed them.")
+
+    # Deterministic answers without network access, every request asks a new question
+    llm.llm_model = FakeLatencyChatModel(tokens=args.llm_tokens, first_token_ms=args.llm_ms, token_ms=0)
+    response_cache.max_size = 0
+    app.config["DB_URL"] = "sqlite://:memory:"
+    app.config["QDRANT_VALIDATE_ON_STARTUP"] = False
+
+    results = []
+    question_counter = 0
+
+    def next_question():
+        nonlocal question_counter
+        question_counter += 1
+        return f"{QUERIES[question_counter % len(QUERIES)]} ({question_counter})"
+
+    async with app.test_app() as test_app:
+        client = test_app.test_client()
+        # Replace the client created on startup with the benchmark's Qdrant
+        await quadrant.close_qdrant_client()
+        quadrant.qdrant_client = connect(args.location)
+        dim = quadrant.model.get_sentence_embedding_dimension()
+
+        async def call_query_qdrant(n: int):
+            await quadrant.query_qdrant(COLLECTION_CHUNK, COLLECTION_METADATA, next_question(), FILTERS)
+
+        async def call_route(n: int):
+            response = await client.post("/api/query", json={"query_text": next_question(), "filters": FILTERS, "user_id": f"user-{n % 50}"})
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/query answered {response.status_code}")
+            await response.get_data()
+
+        targets = {"query_qdrant": call_query_qdrant, "route": call_route}
+
+        print(f"{'chunks':>8} {'target':>13} {'parallel':>8} {'queries/s':>10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>6} {'RSS (MB)':>9}")
+        for chunk_count in args.chunks:
+            link_count = max(1, chunk_count // args.chunks_per_link)
+            start = time.perf_counter()
+            await seed_collections(quadrant.qdrant_client, COLLECTION_CHUNK, COLLECTION_METADATA, link_count, args.chunks_per_link, dim)
+            seed_seconds = time.perf_counter() - start
+            await quadrant.refresh_metadata_mirror(force=True)
+
+            for target in args.targets:
+                for concurrency in args.concurrency:
+                    instrumentation.reset()
+                    result = await run_level(targets[target], concurrency, args.queries)
+                    result.update({
+                        "chunks": link_count * args.chunks_per_link,
+                        "links": link_count,
+                        "target": target,
+                        "concurrency": concurrency,
+                        "queries": args.queries,
+                        "seed_seconds": round(seed_seconds, 1),
+                        "peak_rss_mb": round(peak_rss_mb(), 1),
+                        "stage_avg_ms": {name: stage["avg_ms"] for name, stage in instrumentation.snapshot()["stages"].items()},
+                    })
+                    results.append(result)
+                    print(f"{result['chunks']:>8} {target:>13} {concurrency:>8} {result['throughput_qps']:>10.1f} {result['p50_ms'] or 0:>9.1f} "
+                          f"{result['p95_ms'] or 0:>9.1f} {result['p99_ms'] or 0:>9.1f} {result['errors']:>6} {result['peak_rss_mb']:>9.1f}")
+
+        await quadrant.qdrant_client.delete_collection(COLLECTION_CHUNK)
+        await quadrant.qdrant_client.delete_collection(COLLECTION_METADATA)
+
+    if args.output:
+        report = {
+            "commit": current_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "model": quadrant.MODEL_NAME,
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--chunks-per-link", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--targets", nargs="+", choices=["query_qdrant", "route"], default=["query_qdrant", "route"])
+    parser.add_argument("--llm-ms", type=float, default=0, help="Latency of the fake LLM per answer")
+    parser.add_argument("--llm-tokens", type=int, default=50)
+    parser.add_argument("--output", help="Path of the JSON report")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""
+Compares the per-document rating lookup (getDocumentRating), the bulk lookup (getDocumentRatings)
+and the process-local rating index (getCachedDocumentRating) on a throwaway SQLite database.
+
+Usage:
+    python -m benchmarks.rating_lookup_benchmark --links 100 1000 5000 --ratings-per-link 3
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import uuid
+from tortoise import Tortoise
+from app.ormModels.rating import Rating
+from app.utils.ratingHandler import getDocumentRating, getDocumentRatings, getCachedDocumentRating, rebuildDocumentRatingStats
+
+
+async def seed(link_count: int, ratings_per_link: int):
+    """
+    Creates link_count documents with ratings_per_link ratings each and returns the document ids.
+    """
+    document_ids = [str(uuid.uuid4()) for _ in range(link_count)]
+    await Rating.bulk_create([
+        Rating(user_id=f"user-{n}", qdrant_id=document_id, rating=random.randint(0, 5))
+        for document_id in document_ids
+        for n in range(ratings_per_link)
+    ], batch_size=1000)
+    return document_ids
+
+
+async def run(link_counts: list, ratings_per_link: int):
+    print(f"{'links':>8} {'per-document (s)':>18} {'bulk (s)':>10} {'index (s)':>10} {'speedup':>8}")
+
+    for link_count in link_counts:
+        db_file = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        await Tortoise.init(db_url=f"sqlite://{db_file}", modules={"models": ["app.ormModels.rating", "app.ormModels.documentRatingStats"]})
+        await Tortoise.generate_schemas()
+
+        document_ids = await seed(link_count, ratings_per_link)
+
+        start = time.perf_counter()
+        for document_id in document_ids:
+            await getDocumentRating(document_id)
+        per_document = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await getDocumentRatings(document_ids)
+        bulk = time.perf_counter() - start
+
+        await rebuildDocumentRatingStats()
+        start = time.perf_counter()
+        for document_id in document_ids:
+            getCachedDocumentRating(document_id)
+        index = time.perf_counter() - start
+
+        print(f"{link_count:>8} {per_document:>18.4f} {bulk:>10.4f} {index:>10.6f} {per_document / bulk:>7.1f}x")
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--ratings-per-link", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.links, args.ratings_per_link))
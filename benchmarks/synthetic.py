@@ -0,0 +1,76 @@
+"""
+Helpers to seed Qdrant with synthetic chunk and metadata collections shaped like the ones the scraping worker writes.
+"""
+import random
+import uuid
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+LINK_TYPES = ["article", "report", "video", "podcast"]
+SCORE_FIELDS = ["co2_score", "reduk_score", "report_score", "sustfin_score", "regul_score"]
+
+
+def connect(location: str):
+    """
+    Returns an async client for ':memory:', a local path or a http(s) URL of a Qdrant server.
+    """
+    if location.startswith("http"):
+        return AsyncQdrantClient(url=location)
+    return AsyncQdrantClient(location=location) if location == ":memory:" else AsyncQdrantClient(path=location)
+
+
+def random_vectors(count: int, dim: int, rng: random.Random):
+    return [[rng.gauss(0, 1) for _ in range(dim)] for _ in range(count)]
+
+
+async def seed_collections(client: AsyncQdrantClient, collection_chunk: str, collection_metadata: str, link_count: int,
+                           chunks_per_link: int = 10, dim: int = 768, seed: int = 42, batch_size: int = 512):
+    """
+    (Re)creates both collections and fills them with link_count metadata points and link_count * chunks_per_link chunks.
+
+    Returns:
+        List[str]: The ids of the metadata points.
+    """
+    rng = random.Random(seed)
+    for collection_name in (collection_chunk, collection_metadata):
+        if await client.collection_exists(collection_name):
+            await client.delete_collection(collection_name)
+        await client.create_collection(collection_name, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+
+    link_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(link_count)]
+    metadata_points = []
+    chunk_points = []
+
+    for n, link_id in enumerate(link_ids):
+        url = f"https://example.org/links/{n}"
+        metadata = {
+            "url": url,
+            "title": f"Link {n}",
+            "name": f"Link {n}",
+            "link_type": rng.choice(LINK_TYPES),
+            "summary": f"Synthetic summary of link {n}. " * 5,
+            "user": {"id": f"user-{n % 50}", "name": f"User {n % 50}"},
+            **{field: rng.randint(0, 100) for field in SCORE_FIELDS},
+        }
+        metadata_points.append(PointStruct(id=link_id, vector=random_vectors(1, dim, rng)[0], payload={"metadata": metadata}))
+
+        for vector in random_vectors(chunks_per_link, dim, rng):
+            chunk_points.append(PointStruct(
+                id=str(uuid.UUID(int=rng.getrandbits(128))),
+                vector=vector,
+                payload={"link_id": link_id, "url": url, "chunk": f"Synthetic chunk of link {n}. " * 20},
+            ))
+
+        if len(chunk_points) >= batch_size:
+            await client.upsert(collection_chunk, points=chunk_points, wait=True)
+            chunk_points = []
+        if len(metadata_points) >= batch_size:
+            await client.upsert(collection_metadata, points=metadata_points, wait=True)
+            metadata_points = []
+
+    if chunk_points:
+        await client.upsert(collection_chunk, points=chunk_points, wait=True)
+    if metadata_points:
+        await client.upsert(collection_metadata, points=metadata_points, wait=True)
+
+    return link_ids
@@ -0,0 +1,61 @@
+import unittest
+
+from app.utils.contextBuilder import ContextBuilder
+
+CHUNK = "Green bonds finance projects with environmental benefits such as renewable energy and clean transport."
+
+
+def document(url, summary, chunk, score):
+    return {"metadata": {"url": url, "summary": summary}, "chunk": chunk, "score": score}
+
+
+class ContextBuilderTestCase(unittest.TestCase):
+
+    def builder(self, max_tokens):
+        # An unknown model name makes the builder estimate tokens from characters, no tokenizer download needed
+        return ContextBuilder("no-such-model", max_tokens=max_tokens, min_summary_tokens=10)
+
+    def test_near_duplicate_chunks_are_removed_across_urls(self):
+        documents = [
+            document("https://example.com/a", "A", CHUNK, 0.9),
+            document("https://mirror.example.org/a", "A", CHUNK.upper() + "  ", 0.8),
+            document("https://example.com/a", "A", CHUNK.replace("clean transport", "clean transport."), 0.7),
+            document("https://example.com/b", "B", "Sustainability reports disclose scope 3 emissions of the supply chain.", 0.6),
+        ]
+        context, report = self.builder(4000).build(documents)
+        self.assertEqual(report["duplicates_removed"], 2)
+        self.assertIn("https://example.com/b", context)
+        self.assertNotIn("mirror.example.org", context)
+
+    def test_summaries_are_kept_within_the_budget(self):
+        documents = [document(f"https://example.com/{n}", "word " * 200, f"chunk {n}", 1 - n / 10) for n in range(3)]
+        context, report = self.builder(4000).build(documents)
+        self.assertEqual(report["summaries_truncated"], 0)
+        self.assertNotIn("...", context)
+
+    def test_longest_summaries_are_shortened_first(self):
+        documents = [
+            document("https://example.com/long", "long " * 400, "first chunk", 0.9),
+            document("https://example.com/medium", "medium " * 120, "second chunk", 0.8),
+            document("https://example.com/short", "short " * 20, "third chunk", 0.7),
+        ]
+        builder = self.builder(700)
+        context, report = builder.build(documents)
+
+        self.assertEqual(report["documents_dropped"], 0)
+        self.assertEqual(report["summaries_truncated"], 1)
+        self.assertLessEqual(report["context_tokens"], 700)
+        self.assertIn("medium " * 120, context)
+        self.assertIn("short " * 20, context)
+
+    def test_lowest_scoring_documents_are_dropped_when_summaries_are_short(self):
+        documents = [document(f"https://example.com/{n}", "summary " * 40, f"chunk number {n} " * 30, 1 - n / 10) for n in range(5)]
+        context, report = self.builder(600).build(documents)
+        self.assertGreater(report["documents_dropped"], 0)
+        self.assertLessEqual(report["context_tokens"], 600)
+        self.assertIn("https://example.com/0", context)
+        self.assertNotIn("https://example.com/4", context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+from app.utils.embeddingBackend import OnnxEmbeddingBackend, export_onnx_model, cosine_similarities
+
+MODEL_NAME = os.getenv("MODEL_NAME", "Alibaba-NLP/gte-multilingual-base")
+SENTENCES = [
+    "Welche Unternehmen berichten über ihre Scope-3-Emissionen?",
+    "Wie hoch ist der Anteil erneuerbarer Energien im Strommix?",
+    "EU taxonomy alignment of capital expenditure",
+    "Kurz",
+    "Ein sehr langer Satz " * 40,
+]
+
+
+@unittest.skipIf(onnxruntime is None, "onnxruntime is not installed")
+class OnnxEmbeddingParityTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from sentence_transformers import SentenceTransformer
+        cls.model_dir = tempfile.mkdtemp()
+        export_onnx_model(MODEL_NAME, cls.model_dir, quantize=True)
+        cls.torch_vectors = SentenceTransformer(MODEL_NAME, trust_remote_code=True).encode(SENTENCES)
+
+    def test_onnx_matches_torch(self):
+        backend = OnnxEmbeddingBackend(self.model_dir, MODEL_NAME)
+        vectors = backend.encode(SENTENCES)
+        self.assertEqual(vectors.shape, self.torch_vectors.shape)
+        self.assertGreaterEqual(cosine_similarities(vectors, self.torch_vectors).min(), 0.999)
+
+    def test_quantized_onnx_matches_torch(self):
+        backend = OnnxEmbeddingBackend(self.model_dir, MODEL_NAME, quantized=True)
+        vectors = backend.encode(SENTENCES)
+        self.assertGreaterEqual(cosine_similarities(vectors, self.torch_vectors).min(), 0.98)
+
+    def test_refuses_other_model(self):
+        with self.assertRaises(RuntimeError):
+            OnnxEmbeddingBackend(self.model_dir, "some/other-model")
+
+    def test_refuses_incompatible_output(self):
+        reference = np.load(os.path.join(self.model_dir, "reference_embeddings.npz"))
+        broken_dir = tempfile.mkdtemp()
+        for file_name in os.listdir(self.model_dir):
+            os.symlink(os.path.join(self.model_dir, file_name), os.path.join(broken_dir, file_name))
+        os.remove(os.path.join(broken_dir, "reference_embeddings.npz"))
+        np.savez(os.path.join(broken_dir, "reference_embeddings.npz"), sentences=reference["sentences"], embeddings=-reference["embeddings"])
+
+        with self.assertRaises(RuntimeError):
+            OnnxEmbeddingBackend(broken_dir, MODEL_NAME)
+
+
+if __name__ == '__main__':
+    unittest.main()
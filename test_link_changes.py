@@ -0,0 +1,57 @@
+import datetime
+import unittest
+from tortoise import Tortoise
+
+from app.ormModels.linkChange import LinkChange
+from app.utils.linkChangeHandler import (
+    record_link_change, get_links_version, get_link_changes_since, compact_link_changes, LinkChangesCompacted, UPSERT, DELETE,
+)
+
+
+class LinkChangeCompactionTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.ormModels.linkChange"]})
+        await Tortoise.generate_schemas()
+
+    async def asyncTearDown(self):
+        await Tortoise.close_connections()
+
+    async def record_old_changes(self, changes, days):
+        created_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+        versions = [await record_link_change(link_id, operation) for link_id, operation in changes]
+        await LinkChange.filter(version__in=versions).update(created_at=created_at)
+        return versions
+
+    async def test_compaction_keeps_the_latest_upsert_of_every_link(self):
+        await self.record_old_changes([("a", UPSERT), ("a", UPSERT), ("b", UPSERT), ("b", DELETE), ("c", UPSERT)], days=40)
+        recent_version = await record_link_change("c", DELETE)
+
+        compacted_version, removed = await compact_link_changes(30)
+
+        self.assertEqual(compacted_version, 5)
+        self.assertEqual(removed, 4)
+        self.assertEqual(await LinkChange.all().order_by("version").values_list("version", flat=True), [2, recent_version])
+        self.assertEqual(await get_links_version(), recent_version)
+        self.assertEqual(await get_link_changes_since(compacted_version), (recent_version, [], ["c"]))
+
+    async def test_delta_from_before_the_compaction_needs_a_full_listing(self):
+        await self.record_old_changes([("a", UPSERT), ("a", DELETE)], days=40)
+        await compact_link_changes(30)
+
+        with self.assertRaises(LinkChangesCompacted):
+            await get_link_changes_since(1)
+        # Dropping the last entry does not move the version back
+        self.assertEqual(await get_links_version(), 2)
+        self.assertEqual(await record_link_change("b", UPSERT), 3)
+
+    async def test_recent_changes_are_kept(self):
+        await record_link_change("a", UPSERT)
+        await record_link_change("a", DELETE)
+
+        self.assertEqual(await compact_link_changes(30), (0, 0))
+        self.assertEqual(await get_link_changes_since(0), (2, [], ["a"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
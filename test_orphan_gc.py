@@ -0,0 +1,38 @@
+import asyncio
+import datetime
+import unittest
+from tortoise import Tortoise
+
+from app.ormModels.orphanGcJob import OrphanGcJob
+from app.utils.orphanGcHandler import claim_orphan_gc, ORPHAN_CHUNKS, RUNNING
+
+
+class OrphanGcClaimTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.ormModels.orphanGcJob"]})
+        await Tortoise.generate_schemas()
+
+    async def asyncTearDown(self):
+        await Tortoise.close_connections()
+
+    async def test_only_one_collection_runs_at_a_time(self):
+        claimed = await asyncio.gather(*(claim_orphan_gc(100, False) for _ in range(5)))
+
+        self.assertEqual(claimed.count(True), 1)
+        job = await OrphanGcJob.get(name=ORPHAN_CHUNKS)
+        self.assertEqual(job.status, RUNNING)
+        self.assertEqual(job.batch_size, 100)
+
+    async def test_collection_with_an_expired_lease_can_be_restarted(self):
+        expired = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+        await OrphanGcJob.create(name=ORPHAN_CHUNKS, status=RUNNING, owner="crashed", lease_until=expired, scanned=500)
+
+        self.assertTrue(await claim_orphan_gc(100, True))
+        job = await OrphanGcJob.get(name=ORPHAN_CHUNKS)
+        self.assertTrue(job.dry_run)
+        self.assertEqual(job.scanned, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
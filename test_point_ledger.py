@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+from tortoise import Tortoise
+
+from app.ormModels.points import PointGrant, UserPoints
+from app.utils.pointHandler import grant_points, grant_points_bulk
+
+PARALLEL_GRANTS = 500
+
+
+class PointLedgerTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.ormModels.points"]})
+        await Tortoise.generate_schemas()
+
+    async def asyncTearDown(self):
+        await Tortoise.close_connections()
+
+    async def assertBalanceMatchesLedger(self, user_id, expected):
+        balance = (await UserPoints.get(user_id=user_id)).points
+        ledger = sum(await PointGrant.filter(user_id=user_id).values_list("points", flat=True))
+        self.assertEqual(balance, expected)
+        self.assertEqual(ledger, expected)
+
+    async def test_first_grant_counts(self):
+        self.assertEqual(await grant_points("new-user", 10, "rating"), 10)
+        self.assertEqual(await grant_points("new-user", 5, "rating"), 15)
+        await self.assertBalanceMatchesLedger("new-user", 15)
+
+    async def test_parallel_grants_are_not_lost(self):
+        users = [f"user-{n}" for n in range(5)]
+        await asyncio.gather(*(grant_points(users[n % len(users)], 1 + n % 3, "rating") for n in range(PARALLEL_GRANTS)))
+
+        for index, user_id in enumerate(users):
+            expected = sum(1 + n % 3 for n in range(index, PARALLEL_GRANTS, len(users)))
+            await self.assertBalanceMatchesLedger(user_id, expected)
+        self.assertEqual(await PointGrant.all().count(), PARALLEL_GRANTS)
+
+    async def test_parallel_bulk_grants_are_not_lost(self):
+        await UserPoints.create(user_id="existing", points=7)
+        batches = [
+            [{"user_id": "existing", "points": 1, "reason": "rating"}, {"user_id": f"user-{n % 4}", "points": 2, "reason": "link"}]
+            for n in range(PARALLEL_GRANTS)
+        ]
+        await asyncio.gather(*(grant_points_bulk(batch) for batch in batches))
+
+        self.assertEqual((await UserPoints.get(user_id="existing")).points, 7 + PARALLEL_GRANTS)
+        for n in range(4):
+            await self.assertBalanceMatchesLedger(f"user-{n}", 2 * PARALLEL_GRANTS // 4)
+        self.assertEqual(await PointGrant.filter(reason="link").count(), PARALLEL_GRANTS)
+
+    async def test_bulk_grants_of_many_users(self):
+        # More users than fit into one statement (SQLite allows 999 bound variables on older builds)
+        grants = [{"user_id": f"user-{n % 1500}", "points": 1, "reason": "rating"} for n in range(3000)]
+        await grant_points_bulk(grants)
+
+        self.assertEqual(await UserPoints.all().count(), 1500)
+        self.assertEqual(set(await UserPoints.all().values_list("points", flat=True)), {2})
+        self.assertEqual(await PointGrant.all().count(), 3000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from tortoise import Tortoise
+
+from app.ormModels.userQuestionHistorie import UserQuestionSlot
+from app.utils.userQuestionHandler import (
+    QUESTION_HISTORY, QUESTION_HISTORY_SIZE, add_requested_question, add_requested_questions, get_last_three_questions,
+    queue_requested_question, unpack_response
+)
+from app.utils.writeBehind import write_behind
+
+RESPONSE = {"response_text": "Antwort", "documents": [{"id_metadata": "link-1", "score": 0.91234567}]}
+
+
+def entry(user_id, question):
+    return {"user_id": user_id, "question": question, "response": {"response_text": question, "documents": []}}
+
+
+class QuestionHistoryTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.ormModels.userQuestionHistorie"]})
+        await Tortoise.generate_schemas()
+
+    async def asyncTearDown(self):
+        await write_behind.stop()
+        await Tortoise.close_connections()
+
+    async def test_ring_buffer_wraps_around(self):
+        for number in range(QUESTION_HISTORY_SIZE + 4):
+            await add_requested_question("user", f"q{number}", RESPONSE)
+
+        slots = await UserQuestionSlot.filter(user_id="user").order_by("slot")
+        self.assertEqual(len(slots), QUESTION_HISTORY_SIZE)
+        self.assertEqual(sorted(slot.sequence for slot in slots), list(range(4, QUESTION_HISTORY_SIZE + 4)))
+        self.assertEqual(await get_last_three_questions("user"), [f"q{number}" for number in range(QUESTION_HISTORY_SIZE + 3, QUESTION_HISTORY_SIZE, -1)])
+
+        newest = max(slots, key=lambda slot: slot.sequence)
+        self.assertEqual(unpack_response(newest.payload, newest.compressed), {"response_text": "Antwort", "documents": [{"id": "link-1", "score": 0.9123}]})
+
+    async def test_batch_keeps_the_newest_questions(self):
+        await add_requested_questions([entry("user", f"q{number}") for number in range(7)] + [entry("other", "only")])
+        self.assertEqual(await get_last_three_questions("user"), ["q6", "q5", "q4"])
+        self.assertEqual(await get_last_three_questions("other"), ["only"])
+        self.assertEqual(await get_last_three_questions("nobody"), [])
+
+    async def test_concurrent_writers_never_share_a_sequence(self):
+        await asyncio.gather(*(add_requested_questions([entry("user", f"q{number}")]) for number in range(50)))
+
+        slots = await UserQuestionSlot.filter(user_id="user")
+        sequences = sorted(slot.sequence for slot in slots)
+        self.assertEqual(sequences, list(range(50 - QUESTION_HISTORY_SIZE, 50)))
+        self.assertEqual(len({slot.question for slot in slots}), QUESTION_HISTORY_SIZE)
+
+    async def test_pending_questions_are_merged(self):
+        await add_requested_questions([entry("user", "stored1"), entry("user", "stored2")])
+        write_behind.flush_interval_ms = 60000
+        write_behind.start()
+        await queue_requested_question("user", "pending", RESPONSE)
+
+        self.assertEqual(write_behind.pending(QUESTION_HISTORY)[0]["question"], "pending")
+        self.assertEqual(await get_last_three_questions("user"), ["pending", "stored2", "stored1"])
+        await write_behind.stop()
+        self.assertEqual(await get_last_three_questions("user"), ["pending", "stored2", "stored1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import unittest
+import uuid
+from qdrant_client.models import Distance, PointStruct, VectorParams
+from tortoise import Tortoise
+
+from app.ormModels.scrapeJob import ScrapeJob
+from app.utils import quadrant
+from app.utils.scrapeJobHandler import ScrapeJobDispatcher, QUEUED, RUNNING, SUCCEEDED, DUPLICATE
+
+
+class RecordingDispatcher(ScrapeJobDispatcher):
+    '''
+    Records the dispatched jobs instead of calling the scraping worker.
+    '''
+
+    def __init__(self, **kwargs):
+        super().__init__("localhost:8000", "metadata_collection", **kwargs)
+        self.dispatched = []
+
+    def _dispatch(self, job: ScrapeJob):
+        self.dispatched.append(job.url)
+
+
+class ScrapeJobLeaseTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.ormModels.scrapeJob"]})
+        await Tortoise.generate_schemas()
+
+    async def asyncTearDown(self):
+        await Tortoise.close_connections()
+
+    async def create_job(self, url, status, owner=None, lease_seconds=None):
+        lease_until = None
+        if lease_seconds is not None:
+            lease_until = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=lease_seconds)
+        return await ScrapeJob.create(url=url, status=status, owner=owner, lease_until=lease_until)
+
+    async def test_workers_resuming_at_once_dispatch_every_job_once(self):
+        for number in range(10):
+            await self.create_job(f"https://example.com/{number}", QUEUED if number % 2 else RUNNING)
+        workers = [RecordingDispatcher() for _ in range(2)]
+
+        resumed = await asyncio.gather(*(worker.resume_pending() for worker in workers))
+
+        self.assertEqual(sum(resumed), 10)
+        dispatched = workers[0].dispatched + workers[1].dispatched
+        self.assertEqual(sorted(dispatched), sorted(f"https://example.com/{number}" for number in range(10)))
+        for worker in workers:
+            self.assertEqual(await ScrapeJob.filter(owner=worker.owner).count(), len(worker.dispatched))
+
+    async def test_only_jobs_with_an_expired_lease_are_resumed(self):
+        await self.create_job("https://example.com/live", RUNNING, owner="other", lease_seconds=60)
+        await self.create_job("https://example.com/expired", RUNNING, owner="crashed", lease_seconds=-1)
+        await self.create_job("https://example.com/done", SUCCEEDED)
+        worker = RecordingDispatcher()
+
+        self.assertEqual(await worker.resume_pending(), 1)
+        self.assertEqual(worker.dispatched, ["https://example.com/expired"])
+        self.assertEqual((await ScrapeJob.get(url="https://example.com/live")).owner, "other")
+
+    async def test_a_worker_that_lost_its_lease_does_not_write_the_job(self):
+        job = await self.create_job("https://example.com/stalled", RUNNING, owner="other", lease_seconds=60)
+        worker = RecordingDispatcher()
+        worker._semaphore = asyncio.Semaphore(1)
+
+        await worker._run(job)
+
+        self.assertEqual((await ScrapeJob.get(id=job.id)).status, RUNNING)
+
+    async def test_stop_releases_the_leases(self):
+        worker = RecordingDispatcher(lease_seconds=60)
+        await self.create_job("https://example.com/pending", QUEUED, owner=worker.owner, lease_seconds=60)
+        await worker.stop()
+
+        next_worker = RecordingDispatcher()
+        self.assertEqual(await next_worker.resume_pending(), 1)
+
+
+class ScrapeJobSubmitTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.ormModels.scrapeJob"]})
+        await Tortoise.generate_schemas()
+        await quadrant.init_qdrant_client(":memory:")
+        await quadrant.qdrant_client.create_collection("metadata_collection", vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+
+    async def asyncTearDown(self):
+        await quadrant.close_qdrant_client()
+        await Tortoise.close_connections()
+
+    async def test_link_stored_before_normalization_is_a_duplicate(self):
+        # Stored as submitted, normalize_url drops the fragment
+        legacy_url = "https://example.com/report#summary"
+        link_id = str(uuid.uuid4())
+        await quadrant.qdrant_client.upsert("metadata_collection", points=[
+            PointStruct(id=link_id, vector=[1, 0, 0, 0], payload={"metadata": {"url": legacy_url}}),
+        ])
+        worker = RecordingDispatcher()
+
+        job = await worker.submit(legacy_url)
+
+        self.assertEqual(job.status, DUPLICATE)
+        self.assertEqual(job.link_id, link_id)
+        self.assertEqual(job.url, "https://example.com/report")
+        self.assertEqual(worker.dispatched, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
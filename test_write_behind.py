@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from app.utils.writeBehind import WriteBehindQueue
+
+
+class SlowWriter:
+    '''
+    Records the entries it wrote, every write takes delay seconds.
+    '''
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.written = []
+        self.started = asyncio.Event()
+
+    async def __call__(self, entries: list):
+        self.started.set()
+        await asyncio.sleep(self.delay)
+        self.written.extend(entries)
+
+
+class WriteBehindQueueTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def test_stop_during_a_write_keeps_all_entries(self):
+        queue = WriteBehindQueue(flush_interval_ms=10, batch_size=5)
+        writer = SlowWriter(0.2)
+        queue.register("entries", writer)
+        queue.start()
+
+        for number in range(12):
+            await queue.submit("entries", number)
+        await writer.started.wait()
+        await queue.stop()
+
+        self.assertEqual(sorted(writer.written), list(range(12)))
+        self.assertEqual(queue.stats()["depth"], 0)
+        self.assertEqual(queue.stats()["dropped"], 0)
+
+    async def test_cancelled_flush_requeues_its_batch(self):
+        queue = WriteBehindQueue(batch_size=5)
+        writer = SlowWriter(0.2)
+        queue.register("entries", writer)
+        queue.start()
+        for number in range(3):
+            await queue.submit("entries", number)
+
+        flush = asyncio.create_task(queue.flush())
+        await writer.started.wait()
+        flush.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await flush
+
+        self.assertEqual(queue.pending("entries"), [0, 1, 2])
+        self.assertEqual(queue.stats()["depth"], 3)
+        writer.delay = 0
+        await queue.stop()
+        self.assertEqual(writer.written, [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()